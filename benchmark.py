@@ -0,0 +1,303 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from clean_data import (
+    COLUMNS_TO_KEEP, KEY_COLUMN, RAW_SEPARATOR, add_plaza_edf, detect_encoding, find_duplicates, normalize_columns,
+    normalize_text,
+)
+from dataset import (
+    COL_LAT, COL_LON, COL_NOMBRE, COL_PLAZA_EDF, COL_REGION, COL_SISTEMA, COL_TIPO_ESTAB,
+    apply_filters, build_count_cube, build_filter_index, crosstab_cube, cube_kpis, load_data, resolve_filters, slice_cube,
+)
+from map_layers import MAP_DETAIL_ZOOM, MAP_ZOOM, base_map, build_spatial_index, data_layer
+from quality import validate
+from search import build_search_index, search_positions
+from synthetic_data import fit_profile, read_source, synthetic_frame
+
+RAW_PATH = 'data/establecimientos_20260310.csv'
+DEFAULT_SCALES = [1, 10, 100]
+DEFAULT_OUTPUT = 'benchmark_results.json'
+# Relative change of the median time reported as regression/improvement in --baseline mode
+DEFAULT_THRESHOLD = 0.10
+# Changes below this many milliseconds are timer noise, never a regression
+MIN_DELTA_MS = 0.5
+# Scaled copies move each facility by up to this many degrees (~100 m) so map cells differ
+SCALE_JITTER_DEG = 0.001
+# Share of noisy text values in --synthetic raw data
+SYNTHETIC_NOISE = 0.05
+
+# Typical sidebar selections (values taken from the data at run time)
+FILTER_SCENARIOS = {
+    'sin_filtros': lambda opts: {},
+    'region': lambda opts: {COL_REGION: opts[COL_REGION][:1]},
+    'region_sistema': lambda opts: {COL_REGION: opts[COL_REGION][:3], COL_SISTEMA: opts[COL_SISTEMA][:1]},
+    'tipo': lambda opts: {COL_TIPO_ESTAB: opts[COL_TIPO_ESTAB][:5]},
+    'plaza_edf': lambda opts: {COL_PLAZA_EDF: [True]},
+}
+# Misspelled, unaccented name search (typo in both words)
+SEARCH_QUERY = 'hospitl temco'
+# Map view used for the detail-zoom benchmark (Santiago centre)
+DETAIL_BOUNDS = {'_southWest': {'lat': -33.50, 'lng': -70.72}, '_northEast': {'lat': -33.40, 'lng': -70.58}}
+
+
+def scale_frame(df, factor, seed=0):
+    """
+    Réplica df factor veces. Cada copia tiene código y nombre propios (para que
+    normalización y cruce no se reduzcan a valores repetidos) y, si las
+    coordenadas son numéricas, un desplazamiento aleatorio de hasta SCALE_JITTER_DEG.
+    """
+    if factor == 1:
+        return df.copy()
+    copy_ids = np.repeat(np.arange(factor), len(df))
+    scaled = pd.concat([df] * factor, ignore_index=True)
+    suffix = pd.Series(copy_ids.astype(str), index=scaled.index)
+    if KEY_COLUMN in scaled.columns:
+        scaled[KEY_COLUMN] = scaled[KEY_COLUMN].astype(str) + '-' + suffix
+    if COL_NOMBRE in scaled.columns:
+        scaled[COL_NOMBRE] = scaled[COL_NOMBRE].astype(str) + (' ' + suffix).where(copy_ids > 0, '')
+
+    rng = np.random.default_rng(seed)
+    for col in (COL_LAT, COL_LON):
+        if col in scaled.columns and pd.api.types.is_numeric_dtype(scaled[col]):
+            jitter = rng.uniform(-SCALE_JITTER_DEG, SCALE_JITTER_DEG, len(scaled)) * (copy_ids > 0)
+            scaled[col] = (scaled[col].astype(float) + jitter).astype(scaled[col].dtype)
+    return scaled
+
+
+def measure(func, repeat, warmup=1):
+    """
+    Tiempos de func() (segundos) en repeat ejecuciones tras warmup, más el
+    pico de memoria asignada (bytes, tracemalloc) de una ejecución aparte.
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(warmup):
+            func()
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - start)
+        tracemalloc.start()
+        try:
+            func()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    return times, peak
+
+
+def summarize(name, scale, rows, times, peak):
+    p50, p90, p99 = np.percentile(times, [50, 90, 99])
+    return {
+        'name': name,
+        'scale': scale,
+        'rows': rows,
+        'repeat': len(times),
+        'min_ms': round(min(times) * 1e3, 3),
+        'mean_ms': round(float(np.mean(times)) * 1e3, 3),
+        'p50_ms': round(p50 * 1e3, 3),
+        'p90_ms': round(p90 * 1e3, 3),
+        'p99_ms': round(p99 * 1e3, 3),
+        'rows_per_s': round(rows / p50) if p50 > 0 else None,
+        'peak_mb': round(peak / 2 ** 20, 2),
+    }
+
+
+def read_raw(path):
+    return pd.read_csv(
+        path, sep=RAW_SEPARATOR, encoding=detect_encoding(path), dtype=str, low_memory=False, usecols=COLUMNS_TO_KEEP
+    )
+
+
+def scale_cases(raw, clean, tmp_dir, scale):
+    """
+    Casos de benchmark para un factor de escala: lista de (nombre, filas, función sin argumentos).
+    raw ya viene escalado (réplica o datos sintéticos); clean se replica aquí.
+    """
+    clean = scale_frame(clean, scale)
+    rows = len(clean)
+
+    csv_path = os.path.join(tmp_dir, f'clean_{scale}.csv')
+    parquet_path = os.path.join(tmp_dir, f'clean_{scale}.parquet')
+    clean.to_csv(csv_path, sep=';', index=False, encoding='utf-8')
+    clean.to_parquet(parquet_path, index=False)
+
+    names = raw[COL_NOMBRE].dropna().unique().tolist()
+    unmatched = clean.drop(columns=['PlazaEDF', 'ServicioSaludEDF'], errors='ignore')
+    filter_index = build_filter_index(clean)
+    count_cube = build_count_cube(clean)
+    spatial_index = build_spatial_index(clean)
+    options = filter_index['options']
+    scenarios = {name: make(options) for name, make in FILTER_SCENARIOS.items()}
+    valid = clean.dropna(subset=[COL_LAT, COL_LON])
+    region_filter = scenarios['region']
+    region_rows = apply_filters(clean, region_filter, filter_index)
+    region_positions = resolve_filters(filter_index, region_filter)
+    search_index = build_search_index(clean)
+
+    cases = [
+        ('normalize_text', len(names), lambda: [normalize_text(name) for name in names]),
+        ('normalize_columns', len(raw), lambda: normalize_columns(raw.copy(), verbose=False)),
+        ('add_plaza_edf', rows, lambda: add_plaza_edf(unmatched.copy())),
+        ('find_duplicates', rows, lambda: find_duplicates(clean)),
+        ('validate_quality', rows, lambda: validate(clean)),
+        ('load_data_csv', rows, lambda: load_data(csv_path, None)),
+        ('load_data_parquet', rows, lambda: load_data(csv_path, parquet_path)),
+        ('build_filter_index', rows, lambda: build_filter_index(clean)),
+    ]
+    for name, filters in scenarios.items():
+        cases.append((f'apply_filters_{name}', rows, lambda filters=filters: apply_filters(clean, filters, filter_index)))
+    cases += [
+        ('build_count_cube', rows, lambda: build_count_cube(clean)),
+        ('kpis_region', rows, lambda: cube_kpis(slice_cube(count_cube, region_filter))),
+        ('crosstab_region_sistema', rows, lambda: crosstab_cube(slice_cube(count_cube, {}), COL_REGION, '_sistema')),
+        ('build_spatial_index', rows, lambda: build_spatial_index(clean)),
+        ('map_national', rows, lambda: render_map(clean, valid, spatial_index, MAP_ZOOM)),
+        ('map_region_filtered', len(region_rows), lambda: render_map(
+            region_rows, region_rows.dropna(subset=[COL_LAT, COL_LON]), spatial_index, MAP_ZOOM
+        )),
+        ('map_detail', rows, lambda: render_map(clean, valid, spatial_index, MAP_DETAIL_ZOOM, DETAIL_BOUNDS)),
+        ('build_search_index', rows, lambda: build_search_index(clean)),
+        ('search_typo', rows, lambda: search_positions(search_index, SEARCH_QUERY)),
+        ('search_region', rows, lambda: search_positions(search_index, SEARCH_QUERY, rows=region_positions)),
+    ]
+    return cases
+
+
+def render_map(map_data, map_data_valid, spatial_index, zoom, bounds=None):
+    # Same work as visualizar_mapa() up to the HTML handed to the browser
+    m = base_map()
+    data_layer(map_data, map_data_valid, spatial_index, zoom, bounds).add_to(m)
+    return m.get_root().render()
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(raw_path, scales, repeat, only=None, synthetic=False):
+    raw = read_raw(raw_path)
+    profile = fit_profile(read_source(raw_path)) if synthetic else None
+    clean, error = load_data()
+    if error:
+        raise ValueError(f"No se pudieron cargar los datos limpios: {error}")
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for scale in scales:
+            print(f"Escala {scale}x ({len(clean) * scale:,} filas)...", file=sys.stderr)
+            if synthetic:
+                scaled_raw = synthetic_frame(profile, len(raw) * scale, noise=SYNTHETIC_NOISE)[raw.columns]
+            else:
+                scaled_raw = scale_frame(raw, scale)
+            for name, rows, func in scale_cases(scaled_raw, clean, tmp_dir, scale):
+                if only and not any(pattern in name for pattern in only):
+                    continue
+                times, peak = measure(func, repeat)
+                result = summarize(name, scale, rows, times, peak)
+                results.append(result)
+                print(f"  {name:<28} {result['p50_ms']:>12,.1f} ms  {result['peak_mb']:>9,.1f} MB", file=sys.stderr)
+
+    return {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'raw_file': raw_path,
+            'repeat': repeat,
+            'synthetic': synthetic,
+        },
+        'results': results,
+    }
+
+
+def compare(report, baseline, threshold=DEFAULT_THRESHOLD):
+    """
+    Compara la mediana de tiempo y el pico de memoria de cada caso con la línea base.
+
+    Returns:
+        lista de dicts con name, scale, ratios y status ('regresión', 'mejora' o 'igual').
+    """
+    base = {(r['name'], r['scale']): r for r in baseline['results']}
+    comparison = []
+    for result in report['results']:
+        previous = base.get((result['name'], result['scale']))
+        if previous is None or not previous['p50_ms']:
+            continue
+        time_ratio = result['p50_ms'] / previous['p50_ms']
+        memory_ratio = result['peak_mb'] / previous['peak_mb'] if previous['peak_mb'] else None
+        delta_ms = result['p50_ms'] - previous['p50_ms']
+        if abs(delta_ms) < MIN_DELTA_MS:
+            status = 'igual'
+        elif time_ratio > 1 + threshold:
+            status = 'regresión'
+        elif time_ratio < 1 - threshold:
+            status = 'mejora'
+        else:
+            status = 'igual'
+        comparison.append({
+            'name': result['name'],
+            'scale': result['scale'],
+            'p50_ms': result['p50_ms'],
+            'baseline_p50_ms': previous['p50_ms'],
+            'time_ratio': round(time_ratio, 3),
+            'memory_ratio': round(memory_ratio, 3) if memory_ratio is not None else None,
+            'status': status,
+        })
+    return comparison
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks de limpieza, filtros, KPIs y mapa sobre datos reales y escalados.")
+    parser.add_argument('--raw', default=RAW_PATH, help="Snapshot crudo para las etapas de limpieza (default: %(default)s)")
+    parser.add_argument('--scales', type=int, nargs='+', default=DEFAULT_SCALES,
+                        help="Factores de escala, p. ej. 1 10 100 1000 (default: %(default)s)")
+    parser.add_argument('--repeat', type=int, default=5, help="Repeticiones medidas por caso (default: %(default)s)")
+    parser.add_argument('--synthetic', action='store_true',
+                        help="Etapas de limpieza sobre datos sintéticos con ruido (synthetic_data.py) en vez de réplicas")
+    parser.add_argument('--only', nargs='+', help="Solo casos cuyo nombre contenga alguno de estos textos")
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help="Resultados en JSON (default: %(default)s)")
+    parser.add_argument('--baseline', help="JSON de una ejecución anterior con el cual comparar")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help="Cambio relativo de la mediana considerado regresión (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    report = run(args.raw, args.scales, args.repeat, args.only, args.synthetic)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            report['comparison'] = compare(report, json.load(f), args.threshold)
+        report['meta']['baseline'] = args.baseline
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"Resultados guardados en {args.output}", file=sys.stderr)
+
+    regressions = [c for c in report.get('comparison', []) if c['status'] == 'regresión']
+    for c in regressions:
+        print(f"Regresión: {c['name']} ({c['scale']}x) {c['baseline_p50_ms']:,.1f} -> {c['p50_ms']:,.1f} ms", file=sys.stderr)
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,17 @@
 import pandas as pd
+import numpy as np
 import re
 import unicodedata
 import os
 import sys
+import argparse
+import codecs
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 
 # Define the columns needed by the Streamlit app
 COLUMNS_TO_KEEP = [
+    "EstablecimientoCodigo",
     "RegionGlosa",
     "TipoEstablecimientoGlosa",
     "TipoSistemaSaludGlosa",
@@ -24,6 +29,91 @@ COLUMNS_TO_KEEP = [
     "TipoUrgencia"
 ]
 
+# Low-cardinality columns stored as categoricals in the columnar artifact
+CATEGORICAL_COLUMNS = [
+    "RegionGlosa",
+    "TipoEstablecimientoGlosa",
+    "TipoSistemaSaludGlosa",
+    "EstadoFuncionamiento",
+    "TieneServicioUrgencia",
+    "NivelAtencionEstabglosa",
+    "NivelComplejidadEstabGlosa",
+    "ComunaGlosa",
+    "DependenciaAdministrativa",
+    "TipoAtencionEstabGlosa",
+    "TipoUrgencia",
+    "ServicioSaludEDF"
+]
+
+# Declared layout of the raw MINSAL snapshot
+RAW_SEPARATOR = ';'
+RAW_ENCODINGS = ['utf-8', 'latin1']
+RAW_DECIMAL = ','
+# Column kinds other than plain text: 'decimal' (comma decimal), 'flag' (SI/NO), 'date'
+RAW_COLUMN_TYPES = {
+    "Latitud": "decimal",
+    "Longitud": "decimal",
+    "TieneServicioUrgencia": "flag",
+    "FechaInicioFuncionamientoEstab": "date",
+}
+# Values read as missing (same list as the pandas.read_csv default)
+RAW_NA_VALUES = [
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+    '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null'
+]
+# Streaming ingestion: bytes per block (pyarrow reader) and rows per chunk (pandas fallback)
+STREAM_BLOCK_SIZE = 16 * 1024 * 1024
+STREAM_CHUNK_ROWS = 50000
+
+# Stable facility key used to diff consecutive snapshots
+KEY_COLUMN = "EstablecimientoCodigo"
+
+# Source format of FechaInicioFuncionamientoEstab in the MINSAL files
+DATE_FORMAT = '%d-%m-%Y'
+
+# Patterns used by normalize_text, compiled once
+WHITESPACE_RE = re.compile(r'\s+')
+ALPHA_SPLIT_RE = re.compile(r'^([^a-zA-ZáéíóúñÁÉÍÓÚÑ]*)(.*)')
+NON_ALPHA_PREFIX_RE = re.compile(r'^[^a-zA-ZáéíóúñÁÉÍÓÚÑ]+')
+MINOR_WORDS = frozenset(['de', 'del', 'la', 'las', 'los', 'y', 'en'])
+
+# Plaza EDF matching: leading facility-type phrases and their abbreviation
+FACILITY_TYPE_PREFIXES = [
+    ('CENTRO COMUNITARIO DE SALUD FAMILIAR', 'CECOSF'),
+    ('CENTRO COMUNITARIO DE SALUD MENTAL', 'COSAM'),
+    ('CENTRO DE SALUD FAMILIAR', 'CESFAM'),
+    ('CONSULTORIO GENERAL RURAL', 'CGR'),
+    ('CONSULTORIO GENERAL URBANO', 'CGU'),
+    ('POSTA DE SALUD RURAL', 'PSR'),
+    ('SERVICIO DE ATENCION PRIMARIA DE URGENCIA DE ALTA RESOLUTIVIDAD', 'SAR'),
+    ('SERVICIO DE ATENCION PRIMARIA DE URGENCIA', 'SAPU'),
+    ('SERVICIO DE URGENCIA RURAL', 'SUR'),
+    ('HOSPITAL', 'HOSPITAL'),
+]
+FACILITY_TYPE_ABBREVIATIONS = frozenset(abbreviation for _, abbreviation in FACILITY_TYPE_PREFIXES)
+MATCH_PUNCTUATION_RE = re.compile(r'[^A-Z0-9 ]')
+MATCH_NGRAM = 3
+MATCH_TYPE_WEIGHT = 0.3
+MATCH_MIN_SCORE = 0.6
+MATCH_MIN_MARGIN = 0.1
+
+# Near-duplicate detection: candidates share the normalized comuna, a grid cell
+# (two grids offset by half a cell, so pairs across a cell edge are not lost)
+# and a word of the name; words shared by more rows of a block are ignored
+DEDUP_CELL_DEG = 0.01
+DEDUP_MAX_GROUP = 50
+# Pairs farther apart are never duplicates; closer ones lose up to DEDUP_DISTANCE_WEIGHT of the name score
+DEDUP_MAX_DISTANCE_M = 1000
+DEDUP_DISTANCE_WEIGHT = 0.2
+# Pairs registered with different facility types keep this share of their score
+# (well under DEDUP_MIN_CONFIDENCE: a lab and its sampling room are separate facilities)
+DEDUP_TYPE_MISMATCH_FACTOR = 0.5
+DEDUP_MIN_CONFIDENCE = 0.85
+# Columns of the duplicates report (also all the detection needs)
+DEDUP_COLUMNS = [KEY_COLUMN, 'EstablecimientoGlosa', 'TipoEstablecimientoGlosa', 'ComunaGlosa', 'Latitud', 'Longitud']
+# Columns read by the coverage table (spatial.comuna_coverage)
+COVERAGE_COLUMNS = ['RegionGlosa', 'ComunaGlosa', 'TipoUrgencia', 'Latitud', 'Longitud']
+
 def normalize_text(text, capitalize_minor_words=False):
     """
     Normaliza un texto:
@@ -45,7 +135,7 @@ def normalize_text(text, capitalize_minor_words=False):
     text = str(text)
 
     # 1. Normalizar espacios múltiples y trim inicial
-    text = re.sub(r'\s+', ' ', text.strip())
+    text = WHITESPACE_RE.sub(' ', text.strip())
 
     # 2. Corregir "Region" a "Región"
     text = text.replace('Region ', 'Región ')
@@ -53,11 +143,10 @@ def normalize_text(text, capitalize_minor_words=False):
     # 3. Aplicar Capitalización Específica
     words = text.split(' ')
     normalized_words = []
-    minor_words = ['de', 'del', 'la', 'las', 'los', 'y', 'en']
 
     def smart_capitalize(w):
         """Capitaliza respetando prefijos no-alfabéticos como paréntesis."""
-        match = re.match(r'^([^a-zA-ZáéíóúñÁÉÍÓÚÑ]*)(.*)', w)
+        match = ALPHA_SPLIT_RE.match(w)
         if match and match.group(2):
             prefix, rest = match.group(1), match.group(2)
             return prefix + rest.capitalize()
@@ -68,9 +157,9 @@ def normalize_text(text, capitalize_minor_words=False):
             continue
 
         # Strip non-alpha prefix for checks
-        alpha_part = re.sub(r'^[^a-zA-ZáéíóúñÁÉÍÓÚÑ]+', '', word)
+        alpha_part = NON_ALPHA_PREFIX_RE.sub('', word)
         is_acronym = len(alpha_part) >= 2 and alpha_part.isupper()
-        is_minor_word = alpha_part.lower() in minor_words
+        is_minor_word = alpha_part.lower() in MINOR_WORDS
 
         if i == 0:
             normalized_words.append(word if is_acronym else smart_capitalize(word))
@@ -84,13 +173,41 @@ def normalize_text(text, capitalize_minor_words=False):
     text = ' '.join(normalized_words)
 
     # 4. Final check for double spaces (just in case) and strip
-    text = re.sub(r'\s+', ' ', text.strip())
+    text = WHITESPACE_RE.sub(' ', text.strip())
 
     return text
 
-def normalize_columns(df):
+def normalize_values(values, capitalize_minor_words=False):
     """
-    Aplica normalización a columnas específicas del dataframe
+    Normaliza una lista de valores distintos con normalize_text.
+    Función de nivel de módulo para poder enviarla a un pool de procesos.
+    """
+    return [normalize_text(value, capitalize_minor_words) for value in values]
+
+def remap_normalized(codes, normalized, series):
+    """
+    Reconstruye la columna completa a partir de los códigos de pd.factorize
+    y de los valores distintos ya normalizados (código -1 = valor faltante).
+    """
+    lookup = np.array(list(normalized) + [np.nan], dtype=object)
+    return pd.Series(lookup[codes], index=series.index, name=series.name).astype(series.dtype)
+
+def normalize_series(series, capitalize_minor_words=False):
+    """
+    Normaliza una columna aplicando normalize_text solo a sus valores distintos.
+    El resultado es idéntico a series.apply(normalize_text).
+    """
+    codes, uniques = pd.factorize(series)
+    normalized = normalize_values(uniques.tolist(), capitalize_minor_words)
+    return remap_normalized(codes, normalized, series)
+
+def normalize_columns(df, workers=None, verbose=True):
+    """
+    Aplica normalización a columnas específicas del dataframe.
+
+    Cada columna se factoriza y solo sus valores distintos pasan por
+    normalize_text. Con workers > 1 las columnas se reparten en un pool
+    de procesos.
     """
     # Original list of columns that *might* need text normalization
     potential_text_columns = [
@@ -107,18 +224,30 @@ def normalize_columns(df):
 
     region_col_name = 'RegionGlosa'
     total_columns = len(text_columns_to_normalize)
-    processed_count = 0
 
-    for col in text_columns_to_normalize:
-        processed_count += 1
-        print(f"[{processed_count}/{total_columns}] Normalizando columna: {col}")
+    factorized = {col: pd.factorize(df[col]) for col in text_columns_to_normalize}
+    jobs = [
+        (factorized[col][1].tolist(), col == region_col_name)
+        for col in text_columns_to_normalize
+    ]
+
+    if workers and workers > 1 and total_columns > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(normalize_values, *zip(*jobs)))
+    else:
+        results = [normalize_values(values, capitalize) for values, capitalize in jobs]
+
+    for processed_count, (col, normalized) in enumerate(zip(text_columns_to_normalize, results), start=1):
+        codes, uniques = factorized[col]
+        df[col] = remap_normalized(codes, normalized, df[col])
+        if not verbose:
+            continue
+
+        print(f"[{processed_count}/{total_columns}] Normalizando columna: {col} ({len(uniques)} valores distintos)")
 
         # Choose the normalization behavior based on the column
         if col == region_col_name:
             print(f"  Aplicando capitalización total (Title Case) a '{col}'")
-            df[col] = df[col].apply(lambda x: normalize_text(x, capitalize_minor_words=True))
-        else:
-            df[col] = df[col].apply(normalize_text)
 
         # Mostrar algunos ejemplos después de la normalización
         unique_values = df[col].dropna().drop_duplicates().head(3).tolist()
@@ -128,85 +257,1072 @@ def normalize_columns(df):
     return df
 
 
-def add_plaza_edf(df, plazas_file='data/Plazas RM - Hoja 1.csv'):
+def norm_match(s):
+    """
+    Clave de cruce: mayúsculas, sin acentos y con espacios simples.
+    """
+    if pd.isna(s): return ''
+    s = str(s).upper().strip()
+    s = unicodedata.normalize('NFD', s)
+    s = ''.join(c for c in s if unicodedata.category(c) != 'Mn')
+    return WHITESPACE_RE.sub(' ', s)
+
+def apply_distinct(series, func):
+    """
+    Aplica func solo a los valores distintos de la columna y reconstruye el resultado.
+    Los valores faltantes también pasan por func (una sola vez), igual que con series.apply(func).
+    """
+    codes, uniques = pd.factorize(series)
+    # Code -1 (missing) picks the last entry
+    lookup = np.array([func(value) for value in uniques.tolist()] + [func(np.nan)], dtype=object)
+    return pd.Series(lookup[codes], index=series.index, name=series.name, dtype=object)
+
+def split_facility_name(name, comuna=''):
+    """
+    Separa una clave de norm_match en (tipo de establecimiento, nombre propio).
+    - El tipo se reconoce por la frase inicial o su sigla (CESFAM, SAPU, ...).
+    - Se eliminan la puntuación y la mención de la comuna ("DE COLINA", "(PADRE HURTADO)").
+    """
+    name = WHITESPACE_RE.sub(' ', MATCH_PUNCTUATION_RE.sub(' ', name)).strip()
+    comuna = WHITESPACE_RE.sub(' ', MATCH_PUNCTUATION_RE.sub(' ', comuna)).strip()
+
+    facility_type = ''
+    for phrase, abbreviation in FACILITY_TYPE_PREFIXES:
+        if name == phrase or name.startswith(phrase + ' '):
+            facility_type, name = abbreviation, name[len(phrase):].strip()
+            break
+    else:
+        head, _, rest = name.partition(' ')
+        if head in FACILITY_TYPE_ABBREVIATIONS:
+            facility_type, name = head, rest
+
+    if comuna:
+        name = re.sub(rf'(?:\bDE )?\b{re.escape(comuna)}\b', ' ', name)
+
+    return facility_type, WHITESPACE_RE.sub(' ', name).strip()
+
+def name_ngrams(name, n=MATCH_NGRAM):
+    """
+    N-gramas de caracteres del nombre (con bordes) para el índice de candidatos.
+    """
+    if not name:
+        return frozenset()
+    padded = f' {name} '
+    return frozenset(padded[i:i + n] for i in range(len(padded) - n + 1))
+
+def match_score(query_type, query_size, candidate_type, candidate_size, shared):
+    """
+    Similitud entre dos nombres: coeficiente de Dice sobre sus n-gramas
+    (shared = n-gramas en común), más un peso fijo si el tipo de
+    establecimiento coincide.
+    """
+    if not query_size and not candidate_size:
+        similarity = 1.0
+    else:
+        similarity = 2 * shared / (query_size + candidate_size)
+    type_match = 1.0 if query_type == candidate_type else 0.0
+    return MATCH_TYPE_WEIGHT * type_match + (1 - MATCH_TYPE_WEIGHT) * similarity
+
+def build_candidate_index(names, comunas):
+    """
+    Índice de candidatos bloqueado por comuna normalizada.
+    Cada bloque guarda, por clave distinta, su tipo y cantidad de n-gramas,
+    y las listas de postings n-grama -> claves que lo contienen.
+
+    Args:
+        names, comunas: claves norm_match distintas (mismo largo).
+    """
+    index = {}
+    for key_id, (name, comuna) in enumerate(zip(names, comunas)):
+        block = index.setdefault(comuna, {'keys': {}, 'postings': {}})
+        facility_type, own_name = split_facility_name(name, comuna)
+        grams = name_ngrams(own_name)
+        block['keys'][key_id] = (facility_type, len(grams))
+        # Names reduced to their type (e.g. "CESFAM COLINA") share a posting
+        for gram in grams or ('',):
+            block['postings'].setdefault(gram, []).append(key_id)
+    return index
+
+def rank_candidates(index, name, comuna):
+    """
+    Candidatos del bloque de la comuna que comparten algún n-grama con el nombre,
+    ordenados por puntaje descendente: [(puntaje, key_id), ...].
+    """
+    block = index.get(comuna)
+    if block is None:
+        return []
+    query_type, own_name = split_facility_name(name, comuna)
+    query_grams = name_ngrams(own_name)
+
+    shared = {}
+    for gram in query_grams:
+        for key_id in block['postings'].get(gram, ()):
+            shared[key_id] = shared.get(key_id, 0) + 1
+    if not query_grams:
+        shared = dict.fromkeys(block['postings'].get('', ()), 0)
+
+    ranked = []
+    for key_id, count in shared.items():
+        candidate_type, candidate_size = block['keys'][key_id]
+        score = match_score(query_type, len(query_grams), candidate_type, candidate_size, count)
+        ranked.append((score, key_id))
+    ranked.sort(key=lambda item: (-item[0], item[1]))
+    return ranked
+
+def plaza_match_keys(names, comunas):
+    """
+    Claves de cruce (nombre, comuna) normalizadas con norm_match.
+    """
+    return pd.MultiIndex.from_arrays([
+        apply_distinct(names, norm_match),
+        apply_distinct(comunas, norm_match),
+    ])
+
+def match_plazas(plazas, estab_uniques, estab_display):
+    """
+    Cruza las plazas con las claves (nombre, comuna) distintas del registro.
+
+    1. Cruce exacto por clave normalizada, vectorizado.
+    2. Las plazas sin cruce exacto buscan candidatos aproximados en su comuna
+       (índice de n-gramas) y se aceptan si superan MATCH_MIN_SCORE con un
+       margen de MATCH_MIN_MARGIN sobre el segundo candidato.
+
+    Args:
+        plazas: dataframe del archivo de Plazas EDF.
+        estab_uniques: pd.MultiIndex de claves distintas (ver plaza_match_keys).
+        estab_display: nombre original de cada clave, para el reporte.
+
+    Returns:
+        (key_matched, key_servicios, report): arreglos alineados con estab_uniques
+        y un dataframe con el tipo de cruce de cada plaza (exacto, aproximado,
+        ambiguo o sin cruce).
+    """
+    plaza_n = apply_distinct(plazas['ESTABLECIMIENTO'], norm_match)
+    plaza_c = apply_distinct(plazas['COMUNA'], norm_match)
+    plaza_keys = pd.MultiIndex.from_arrays([plaza_n, plaza_c])
+    servicios = plazas['SERVICIO DE SALUD'].to_numpy(dtype=object)
+
+    # 1. Exact join; on duplicated plaza keys the last row wins
+    keep = ~plaza_keys.duplicated(keep='last')
+    key_positions = plaza_keys[keep].get_indexer(estab_uniques)
+    key_servicios = np.where(key_positions >= 0, servicios[keep][key_positions], '')
+    key_matched = key_positions >= 0
+
+    # 2. Fuzzy candidates for plazas without an exact key
+    report = plazas[['SERVICIO DE SALUD', 'COMUNA', 'ESTABLECIMIENTO']].copy()
+    report['TipoCruce'] = 'exacto'
+    report['EstablecimientoCruzado'] = ''
+    report['Puntaje'] = 1.0
+    report['SegundoCandidato'] = ''
+    report['PuntajeSegundo'] = np.nan
+
+    exact_plazas = plaza_keys.isin(estab_uniques)
+    estab_names = estab_uniques.get_level_values(0)
+    estab_comunas = estab_uniques.get_level_values(1)
+    report.loc[exact_plazas, 'EstablecimientoCruzado'] = (
+        estab_display[estab_uniques.get_indexer(plaza_keys[exact_plazas])]
+    )
+
+    match_types = report['TipoCruce'].to_numpy(dtype=object, copy=True)
+    matched_names = report['EstablecimientoCruzado'].to_numpy(dtype=object, copy=True)
+    scores = report['Puntaje'].to_numpy(dtype=float, copy=True)
+    second_names = report['SegundoCandidato'].to_numpy(dtype=object, copy=True)
+    second_scores = report['PuntajeSegundo'].to_numpy(dtype=float, copy=True)
+
+    candidate_index = None
+    for i in np.flatnonzero(~exact_plazas):
+        if candidate_index is None:
+            candidate_index = build_candidate_index(estab_names, estab_comunas)
+        ranked = rank_candidates(candidate_index, plaza_n.iloc[i], plaza_c.iloc[i])
+        best_score, best_key = ranked[0] if ranked else (0.0, None)
+        second_score, second_key = ranked[1] if len(ranked) > 1 else (0.0, None)
+
+        if best_key is None or best_score < MATCH_MIN_SCORE:
+            match_types[i] = 'sin cruce'
+        elif best_score - second_score < MATCH_MIN_MARGIN:
+            match_types[i] = 'ambiguo'
+        else:
+            match_types[i] = 'aproximado'
+            if not key_matched[best_key]:
+                key_matched[best_key] = True
+                key_servicios[best_key] = servicios[i]
+
+        scores[i] = round(best_score, 3)
+        if best_key is not None:
+            matched_names[i] = estab_display[best_key]
+        if second_key is not None:
+            second_names[i] = estab_display[second_key]
+            second_scores[i] = round(second_score, 3)
+
+    report['TipoCruce'] = match_types
+    report['EstablecimientoCruzado'] = matched_names
+    report['Puntaje'] = scores
+    report['SegundoCandidato'] = second_names
+    report['PuntajeSegundo'] = second_scores
+
+    return key_matched, key_servicios, report
+
+def summarize_plaza_matches(report, matched, report_file=None):
+    """
+    Imprime el resumen del cruce de Plazas EDF y guarda el reporte si se indica.
+    """
+    print(f"Plazas EDF cruzadas: {matched}/{len(report)}")
+    print(f"Tipos de cruce: {report['TipoCruce'].value_counts().to_dict()}")
+    for _, row in report[report['TipoCruce'].isin(['ambiguo', 'sin cruce'])].iterrows():
+        print(f"  Revisar ({row['TipoCruce']}): {row['ESTABLECIMIENTO']} - {row['COMUNA']}")
+
+    if report_file:
+        report.to_csv(report_file, index=False, encoding='utf-8')
+        print(f"Reporte de cruce guardado en {report_file}")
+
+def add_plaza_edf(df, plazas_file='data/Plazas RM - Hoja 1.csv', report_file=None):
     """
     Cruza los establecimientos con el dataset de Plazas EDF de la RM.
-    Agrega columna booleana PlazaEDF al dataframe.
+    Agrega columna booleana PlazaEDF y el Servicio de Salud de la plaza (ServicioSaludEDF).
+    Si se indica report_file, guarda el reporte de cruce (ver match_plazas).
     """
     if not os.path.exists(plazas_file):
         print(f"Archivo de plazas no encontrado: {plazas_file}, saltando cruce.")
         df['PlazaEDF'] = False
         return df
 
-    def norm_match(s):
-        if pd.isna(s): return ''
-        s = str(s).upper().strip()
-        s = unicodedata.normalize('NFD', s)
-        s = ''.join(c for c in s if unicodedata.category(c) != 'Mn')
-        return re.sub(r'\s+', ' ', s)
-
     plazas = pd.read_csv(plazas_file)
     print(f"\nCruzando con Plazas EDF ({len(plazas)} registros)...")
 
-    plazas['_n'] = plazas['ESTABLECIMIENTO'].apply(norm_match)
-    plazas['_c'] = plazas['COMUNA'].apply(norm_match)
-
-    # Build lookup: (norm_name, norm_comuna) -> servicio de salud
-    plazas_lookup = {}
-    for _, row in plazas.iterrows():
-        plazas_lookup[(row['_n'], row['_c'])] = row['SERVICIO DE SALUD']
-
-    # Manual mappings for names that differ between datasets
-    manual_mappings = {
-        (norm_match('CESFAM la Reina de Colina'), norm_match('Colina')):
-            (norm_match('CENTRO DE SALUD FAMILIAR LA REINA'), norm_match('Colina')),
-        (norm_match('Centro de Salud Familiar Alberto Bachelet Martínez'), norm_match('Conchalí')):
-            (norm_match('CENTRO DE SALUD FAMILIAR ALBERTO BACHELET'), norm_match('Conchalí')),
-        (norm_match('Centro de Salud Familiar Juan Pablo II de Lampa'), norm_match('Lampa')):
-            (norm_match('CENTRO DE SALUD FAMILIAR JUAN PABLO SEGUNDO'), norm_match('Lampa')),
-        (norm_match('Centro de Salud Familiar Irene Frei de Cid'), norm_match('Quilicura')):
-            (norm_match('CENTRO DE SALUD FAMILIAR IRENE FREI'), norm_match('Quilicura')),
-        (norm_match('Centro de Salud Familiar Juan Pablo II ( Padre Hurtado)'), norm_match('Padre Hurtado')):
-            (norm_match('CENTRO DE SALUD FAMILIAR JUAN PABLO II'), norm_match('Padre Hurtado')),
-    }
-    for estab_key, plaza_key in manual_mappings.items():
-        if plaza_key in plazas_lookup:
-            plazas_lookup[estab_key] = plazas_lookup[plaza_key]
-
-    df['_n'] = df['EstablecimientoGlosa'].apply(norm_match)
-    df['_c'] = df['ComunaGlosa'].apply(norm_match)
-
-    def get_servicio(row):
-        key = (row['_n'], row['_c'])
-        return plazas_lookup.get(key, '')
-
-    df['PlazaEDF'] = df.apply(lambda r: (r['_n'], r['_c']) in plazas_lookup, axis=1)
-    df['ServicioSaludEDF'] = df.apply(get_servicio, axis=1)
-    df = df.drop(columns=['_n', '_c'])
-
-    matched = df['PlazaEDF'].sum()
-    print(f"Plazas EDF cruzadas: {matched}/{len(plazas)}")
+    estab_codes, estab_uniques = pd.factorize(plaza_match_keys(df['EstablecimientoGlosa'], df['ComunaGlosa']))
+    # Original spelling of each distinct key, for the report
+    first_rows = pd.Series(range(len(df))).groupby(estab_codes).first().to_numpy()
+    estab_display = df['EstablecimientoGlosa'].to_numpy(dtype=object)[first_rows]
+
+    key_matched, key_servicios, report = match_plazas(plazas, estab_uniques, estab_display)
+
+    df['PlazaEDF'] = key_matched[estab_codes]
+    df['ServicioSaludEDF'] = key_servicios[estab_codes]
+
+    summarize_plaza_matches(report, df['PlazaEDF'].sum(), report_file)
+    return df
+
+
+def group_pairs(groups):
+    """
+    Todos los pares (i, j), i < j, de filas con el mismo grupo.
+
+    Args:
+        groups: id de grupo por fila (-1 = sin grupo).
+    """
+    order = np.argsort(groups, kind='stable')
+    order = order[groups[order] >= 0]
+    sorted_groups = groups[order]
+    if len(order) < 2:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    # Rank inside the group and size of the group, for every sorted row
+    starts = np.flatnonzero(np.r_[True, sorted_groups[1:] != sorted_groups[:-1]])
+    sizes = np.diff(np.r_[starts, len(order)])
+    rank = np.arange(len(order)) - np.repeat(starts, sizes)
+    following = np.repeat(sizes, sizes) - rank - 1
+
+    first = np.repeat(np.arange(len(order)), following)
+    offset = np.arange(len(first)) - np.repeat(np.cumsum(following) - following, following)
+    i, j = order[first], order[first + offset + 1]
+    return np.minimum(i, j), np.maximum(i, j)
+
+
+def name_tokens(name, comuna=''):
+    """
+    Palabras de una clave norm_match, sin puntuación ni la mención de la comuna.
+    """
+    name = WHITESPACE_RE.sub(' ', MATCH_PUNCTUATION_RE.sub(' ', name)).strip()
+    comuna = WHITESPACE_RE.sub(' ', MATCH_PUNCTUATION_RE.sub(' ', comuna)).strip()
+    if comuna:
+        name = re.sub(rf'(?:\bDE )?\b{re.escape(comuna)}\b', ' ', name)
+    return frozenset(name.split())
+
+
+def key_words(key_tokens):
+    """
+    Tabla plana (clave, palabra) ordenada por clave; una clave sin palabras
+    queda con la palabra vacía, así dos nombres vacíos siguen siendo comparables.
+
+    Returns:
+        (clave de cada entrada, código de su palabra)
+    """
+    words = [sorted(tokens) or [''] for tokens in key_tokens]
+    word_keys = np.repeat(np.arange(len(words)), [len(w) for w in words])
+    word_codes = pd.factorize(pd.Series([word for w in words for word in w], dtype=object))[0]
+    return word_keys, word_codes
+
+
+def duplicate_candidates(key_ids, word_keys, word_codes, comuna_codes, lat, lon):
+    """
+    Pares candidatos a duplicado: misma comuna, misma celda de grilla (en
+    alguna de las dos grillas desfasadas) y al menos una palabra del nombre en
+    común. Las palabras que comparten más de DEDUP_MAX_GROUP filas de un
+    bloque no generan pares, así que el trabajo crece linealmente con el registro.
+
+    Args:
+        key_ids: clave (nombre, comuna) distinta de cada fila.
+        word_keys, word_codes: palabras de cada clave (ver key_words).
+        comuna_codes: comuna normalizada de cada fila, codificada.
+        lat, lon: coordenadas por fila (las filas sin coordenadas no se comparan).
+
+    Returns:
+        (i, j) posiciones de fila, i < j, sin repetir.
+    """
+    # One (row, word) pair per word of each row's name
+    row_words = pd.DataFrame({'row': np.arange(len(key_ids)), 'key': key_ids}).merge(
+        pd.DataFrame({'key': word_keys, 'word': word_codes}), on='key'
+    )
+    rows, row_words = row_words['row'].to_numpy(), row_words['word'].to_numpy()
+
+    valid = ~(np.isnan(lat) | np.isnan(lon))
+    pairs = []
+    for shift in (0.0, 0.5):
+        cell_lat = np.floor(np.nan_to_num(lat) / DEDUP_CELL_DEG + shift).astype(np.int64)
+        cell_lon = np.floor(np.nan_to_num(lon) / DEDUP_CELL_DEG + shift).astype(np.int64)
+        blocks = pd.DataFrame({
+            'comuna': comuna_codes[rows], 'lat': cell_lat[rows], 'lon': cell_lon[rows], 'word': row_words,
+        }).groupby(['comuna', 'lat', 'lon', 'word'], sort=False).ngroup().to_numpy()
+        sizes = np.bincount(blocks)
+        blocks = np.where(valid[rows] & (sizes[blocks] <= DEDUP_MAX_GROUP), blocks, -1)
+        i, j = group_pairs(blocks)
+        pairs.append(rows[i] * len(key_ids) + rows[j])
+
+    # Sort + adjacent compare instead of np.unique (same result, faster on large arrays)
+    pairs = np.sort(np.concatenate(pairs))
+    pairs = pairs[np.r_[True, pairs[1:] != pairs[:-1]][:len(pairs)]]
+    return pairs // len(key_ids), pairs % len(key_ids)
+
+
+def token_similarity(a, b, word_keys, word_codes, weights):
+    """
+    Jaccard ponderado por IDF entre las claves a[k] y b[k]: las palabras
+    frecuentes en el registro (LABORATORIO, CENTRO, MEDICO) pesan poco y las
+    distintivas mucho. Vectorizado sobre la tabla de key_words.
+
+    Args:
+        a, b: arreglos de claves a comparar, par a par.
+        weights: peso de cada código de palabra.
+    """
+    n_keys, n_words = word_keys.max() + 1, word_codes.max() + 1
+    starts = np.searchsorted(word_keys, np.arange(n_keys + 1))
+    key_weight = np.bincount(word_keys, weights[word_codes], minlength=n_keys)
+    entries = np.sort(word_keys * n_words + word_codes)
+
+    # Every word of a[k], looked up among the words of b[k]
+    counts = starts[a + 1] - starts[a]
+    pair = np.repeat(np.arange(len(a)), counts)
+    positions = np.repeat(starts[a], counts) + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    wanted = b[pair] * n_words + word_codes[positions]
+    found = entries[np.minimum(np.searchsorted(entries, wanted), len(entries) - 1)] == wanted
+
+    shared = np.bincount(pair, weights[word_codes[positions]] * found, minlength=len(a))
+    union = key_weight[a] + key_weight[b] - shared
+    return np.divide(shared, union, out=np.ones(len(a)), where=union > 0)
+
+
+def duplicate_groups(n_rows, i, j):
+    """
+    Componente conexa de cada fila según los pares (i, j): etiqueta = menor posición del grupo.
+    """
+    labels = np.arange(n_rows)
+    while True:
+        low = np.minimum(labels[i], labels[j])
+        merged = labels.copy()
+        np.minimum.at(merged, i, low)
+        np.minimum.at(merged, j, low)
+        merged = merged[merged]
+        if np.array_equal(merged, labels):
+            return labels
+        labels = merged
+
+
+def find_duplicates(df, min_confidence=DEDUP_MIN_CONFIDENCE):
+    """
+    Detecta establecimientos casi duplicados (mismo centro con otra ortografía,
+    mayúsculas o texto entre paréntesis).
+
+    Los candidatos salen de duplicate_candidates; cada par se puntúa con la
+    similitud de sus palabras ponderada por IDF (ver token_similarity),
+    descontada según la distancia entre ambos y reducida por
+    DEDUP_TYPE_MISMATCH_FACTOR si ambos tienen tipo de establecimiento y no
+    coincide (un tipo faltante no penaliza). Los pares con confianza >=
+    min_confidence se agrupan por componentes conexas, y en cada grupo la fila canónica es la más completa (la primera
+    del archivo en caso de empate).
+
+    Returns:
+        DataFrame con una fila por establecimiento agrupado: 'Grupo', 'Fila'
+        (posición en df), 'Canonico', 'Confianza' (mejor par de la fila) y
+        'DistanciaM' al canónico.
+    """
+    from spatial import haversine_km
+
+    # Missing names and comunas are compared as empty text
+    names = apply_distinct(df['EstablecimientoGlosa'], norm_match).fillna('').to_numpy(dtype=object)
+    comunas = apply_distinct(df['ComunaGlosa'], norm_match).fillna('').to_numpy(dtype=object)
+    lat = pd.to_numeric(df['Latitud'], errors='coerce').to_numpy(dtype=float)
+    lon = pd.to_numeric(df['Longitud'], errors='coerce').to_numpy(dtype=float)
+    columns = ['Grupo', 'Fila', 'Canonico', 'Confianza', 'DistanciaM']
+
+    key_ids, keys = pd.factorize(pd.MultiIndex.from_arrays([names, comunas]))
+    word_keys, word_codes = key_words([name_tokens(name, comuna) for name, comuna in keys])
+    i, j = duplicate_candidates(key_ids, word_keys, word_codes, pd.factorize(comunas)[0], lat, lon)
+    distances = haversine_km(lat[i], lon[i], lat[j], lon[j]) * 1000
+    near = distances <= DEDUP_MAX_DISTANCE_M
+    i, j, distances = i[near], j[near], distances[near]
+    if not len(i):
+        return pd.DataFrame(columns=columns)
+
+    # IDF of each word over the rows of the registry
+    frequency = np.bincount(word_codes, np.bincount(key_ids, minlength=len(keys))[word_keys])
+    weights = np.log(len(df) / frequency) + 1
+    name_scores = token_similarity(key_ids[i], key_ids[j], word_keys, word_codes, weights)
+
+    confidence = name_scores * (1 - DEDUP_DISTANCE_WEIGHT * distances / DEDUP_MAX_DISTANCE_M)
+    if 'TipoEstablecimientoGlosa' in df.columns:
+        types = apply_distinct(df['TipoEstablecimientoGlosa'], norm_match).fillna('').to_numpy(dtype=object)
+        mismatch = (types[i] != '') & (types[j] != '') & (types[i] != types[j])
+        confidence = np.where(mismatch, confidence * DEDUP_TYPE_MISMATCH_FACTOR, confidence)
+    accepted = confidence >= min_confidence
+    i, j, confidence = i[accepted], j[accepted], confidence[accepted]
+    if not len(i):
+        return pd.DataFrame(columns=columns)
+
+    labels = duplicate_groups(len(df), i, j)
+    rows = np.flatnonzero(np.bincount(labels, minlength=len(df))[labels] > 1)
+    best = np.zeros(len(df))
+    np.maximum.at(best, i, confidence)
+    np.maximum.at(best, j, confidence)
+
+    report = pd.DataFrame({
+        'Grupo': labels[rows],
+        'Fila': rows,
+        'Completitud': df.iloc[rows].notna().sum(axis=1).to_numpy(),
+        'Confianza': best[rows].round(3),
+    })
+    # Most complete row first, then file order
+    report = report.sort_values(['Grupo', 'Completitud', 'Fila'], ascending=[True, False, True], ignore_index=True)
+    report['Canonico'] = ~report['Grupo'].duplicated()
+    canonical = report.loc[report['Canonico']].set_index('Grupo')['Fila'].reindex(report['Grupo']).to_numpy()
+    report['DistanciaM'] = (haversine_km(lat[report['Fila']], lon[report['Fila']], lat[canonical], lon[canonical]) * 1000).round(1)
+    report['Grupo'] = pd.factorize(report['Grupo'])[0] + 1
+    return report[columns]
+
+
+def dedupe_facilities(df, report_file=None, collapse=False):
+    """
+    Detecta duplicados (ver find_duplicates), imprime el resumen y guarda el
+    reporte de grupos si se indica. Con collapse=True deja solo la fila
+    canónica de cada grupo.
+    """
+    if not all(col in df.columns for col in ['EstablecimientoGlosa', 'ComunaGlosa', 'Latitud', 'Longitud']):
+        print("Faltan nombre, comuna o coordenadas, se omite la detección de duplicados.")
+        return df
+
+    groups = find_duplicates(df)
+    print(f"\nPosibles duplicados: {groups['Grupo'].nunique()} grupos, {len(groups)} filas")
+
+    if report_file:
+        report_columns = [col for col in DEDUP_COLUMNS if col in df.columns]
+        report = pd.concat([groups.reset_index(drop=True),
+                            df.iloc[groups['Fila']][report_columns].reset_index(drop=True)], axis=1)
+        report.drop(columns='Fila').to_csv(report_file, sep=';', index=False, encoding='utf-8')
+        print(f"Reporte de duplicados guardado en {report_file}")
+
+    if collapse and len(groups):
+        drop = groups.loc[~groups['Canonico'], 'Fila'].to_numpy()
+        df = df.drop(index=df.index[drop]).reset_index(drop=True)
+        print(f"Duplicados colapsados: {len(drop)} filas eliminadas")
+    return df
+
+
+def columns_of_type(kind):
+    """
+    Columnas de COLUMNS_TO_KEEP declaradas con el tipo indicado en RAW_COLUMN_TYPES.
+    """
+    return [col for col in COLUMNS_TO_KEEP if RAW_COLUMN_TYPES.get(col) == kind]
+
+
+def year_column(date_col):
+    """
+    Nombre de la columna de año derivada de una columna de fecha
+    (FechaInicioFuncionamientoEstab -> AnioInicioFuncionamientoEstab).
+    """
+    return 'Anio' + date_col.removeprefix('Fecha')
+
+
+def add_year_columns(df):
+    """
+    Agrega, junto a cada columna de fecha, su año como entero (vacío si la
+    fecha falta o no es válida). El texto de la fecha se conserva tal cual.
+    """
+    for col in columns_of_type('date'):
+        if col in df.columns:
+            years = pd.to_datetime(df[col], format=DATE_FORMAT, errors='coerce').dt.year.astype('Int16')
+            df = df.drop(columns=year_column(col), errors='ignore')
+            df.insert(df.columns.get_loc(col) + 1, year_column(col), years)
+    return df
+
+
+def to_typed_frame(df, categories=None):
+    """
+    Convierte el dataframe limpio a tipos compactos para el artefacto columnar:
+    - Columnas de baja cardinalidad como categóricas.
+    - Latitud/Longitud como float32.
+    - PlazaEDF como booleano.
+    - FechaInicioFuncionamientoEstab como fecha real y su año como entero.
+
+    Args:
+        categories (dict): categorías fijas por columna. La escritura por bloques
+                           las usa para que todos los bloques compartan diccionario.
+    """
+    typed = df.copy()
+    categories = categories or {}
+
+    for col in CATEGORICAL_COLUMNS:
+        if col in typed.columns:
+            # Empty strings become missing values, same as a CSV round-trip
+            values = typed[col].replace('', pd.NA)
+            if col in categories:
+                typed[col] = values.astype(pd.CategoricalDtype(categories[col]))
+            else:
+                typed[col] = values.astype('category')
+
+    for col in columns_of_type('decimal'):
+        if col in typed.columns:
+            typed[col] = pd.to_numeric(typed[col], errors='coerce').astype('float32')
+
+    if 'PlazaEDF' in typed.columns:
+        typed['PlazaEDF'] = typed['PlazaEDF'].astype(bool)
+
+    for col in columns_of_type('date'):
+        if col in typed.columns:
+            typed[col] = pd.to_datetime(typed[col], format=DATE_FORMAT, errors='coerce')
+        if year_column(col) in typed.columns:
+            typed[year_column(col)] = pd.to_numeric(typed[year_column(col)], errors='coerce').astype('Int16')
+
+    return typed
+
+
+def save_columnar(df, output_file):
+    """
+    Guarda el dataframe tipado en formato Parquet.
+    Retorna False (sin fallar) si pyarrow no está instalado.
+    """
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        print(f"pyarrow no está instalado, no se genera {output_file}.")
+        return False
+
+    df.to_parquet(output_file, index=False)
+    return True
+
+
+def save_coverage_table(clean_file, coverage_file):
+    """
+    Materializa la tabla de cobertura de urgencias por comuna (ver
+    spatial.comuna_coverage) a partir del archivo limpio, o de un frame con
+    sus COVERAGE_COLUMNS.
+    Retorna False (sin fallar) si scipy no está instalado.
+    """
+    try:
+        from spatial import comuna_coverage
+    except ImportError:
+        print(f"scipy no está instalado, no se genera {coverage_file}.")
+        return False
+
+    if isinstance(clean_file, pd.DataFrame):
+        df = clean_file[COVERAGE_COLUMNS]
+    else:
+        df = pd.read_csv(clean_file, sep=';', encoding='utf-8', usecols=COVERAGE_COLUMNS)
+    # Distances rounded to the meter
+    comuna_coverage(df).round(3).to_csv(coverage_file, sep=';', index=False, encoding='utf-8')
+    return True
+
+
+def clean_rows(df, workers=None, verbose=True):
+    """
+    Limpieza por fila de un dataframe crudo (sin el cruce de Plazas EDF):
+    columnas decimales a numérico, columnas SI/NO estandarizadas y
+    normalización de texto.
+    """
+    # Convert decimal-comma columns to numeric after loading as string (handle potential errors)
+    for col in columns_of_type('decimal'):
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col].str.replace(RAW_DECIMAL, '.'), errors='coerce')
+
+    if verbose and 'RegionGlosa' in df.columns:
+        print("\nEjemplos de regiones ANTES de normalización:")
+        print(df['RegionGlosa'].drop_duplicates().head(10).tolist())
+
+    # Standardize SI/NO values (TieneServicioUrgencia)
+    urgencia_map = {'SI': 'SI', 'Si': 'SI', 'si': 'SI', 'NO': 'NO', 'No': 'NO', 'no': 'NO'}
+    for col in columns_of_type('flag'):
+        if col in df.columns:
+            df[col] = df[col].map(urgencia_map).fillna(df[col])
+            if verbose:
+                print(f"\n{col} estandarizado: {df[col].value_counts().to_dict()}")
+
+    if verbose:
+        print("\nAplicando normalización a los datos...")
+    df = normalize_columns(df, workers=workers, verbose=verbose)
+
+    if verbose and 'RegionGlosa' in df.columns:
+        print("\nEjemplos de regiones DESPUÉS de normalización:")
+        print(df['RegionGlosa'].drop_duplicates().head(10).tolist())
+
+    return df
+
+
+def content_hashes(df):
+    """
+    Hash por fila del contenido crudo de COLUMNS_TO_KEEP (uint64), usado para
+    detectar filas modificadas entre snapshots.
+    """
+    columns = [col for col in COLUMNS_TO_KEEP if col in df.columns]
+    return pd.util.hash_pandas_object(df[columns], index=False).to_numpy()
+
+
+def diff_snapshots(codes, hashes, previous_manifest):
+    """
+    Compara un snapshot nuevo con el manifiesto (código, hash) del anterior.
+
+    Returns:
+        pd.DataFrame con columnas EstablecimientoCodigo y Cambio
+        ('agregado', 'eliminado', 'modificado' o 'sin cambios').
+    """
+    current = pd.DataFrame({KEY_COLUMN: codes, 'HashContenido': hashes})
+    merged = current.merge(
+        previous_manifest, on=KEY_COLUMN, how='outer', suffixes=('', 'Anterior'), indicator=True
+    )
+    merged['Cambio'] = np.select(
+        [
+            merged['_merge'] == 'left_only',
+            merged['_merge'] == 'right_only',
+            merged['HashContenido'] != merged['HashContenidoAnterior'],
+        ],
+        ['agregado', 'eliminado', 'modificado'],
+        default='sin cambios',
+    )
+    return merged[[KEY_COLUMN, 'Cambio']]
+
+
+def clean_incremental(raw, previous_clean, previous_manifest, workers=None):
+    """
+    Limpia solo las filas agregadas o modificadas respecto del snapshot anterior
+    y las combina con las filas ya limpias que no cambiaron.
+    Las filas quedan en el orden del snapshot nuevo, igual que en una limpieza completa.
+
+    Returns:
+        (dataframe limpio sin columnas de Plazas EDF, dataframe de cambios)
+    """
+    changes = diff_snapshots(raw[KEY_COLUMN], content_hashes(raw), previous_manifest)
+    to_clean = changes.loc[changes['Cambio'].isin(['agregado', 'modificado']), KEY_COLUMN]
+    unchanged = changes.loc[changes['Cambio'] == 'sin cambios', KEY_COLUMN]
+    print(f"Cambios respecto del snapshot anterior: {changes['Cambio'].value_counts().to_dict()}")
+
+    cleaned = raw[raw[KEY_COLUMN].isin(to_clean)].copy()
+    if not cleaned.empty:
+        cleaned = clean_rows(cleaned, workers=workers)
+
+    kept = previous_clean[previous_clean[KEY_COLUMN].isin(unchanged)]
+    kept = kept[[col for col in raw.columns]]
+
+    merged = pd.concat([kept, cleaned]).set_index(KEY_COLUMN).reindex(raw[KEY_COLUMN]).reset_index()
+    return merged[raw.columns], changes[changes['Cambio'] != 'sin cambios']
+
+
+def read_previous_clean(output_file, manifest_file):
+    """
+    Lee la salida limpia y el manifiesto de hashes del snapshot anterior.
+    Retorna (None, None) si no existen o no incluyen KEY_COLUMN.
+    """
+    if not (os.path.exists(output_file) and os.path.exists(manifest_file)):
+        return None, None
+    previous_clean = pd.read_csv(
+        output_file, sep=';', encoding='utf-8',
+        dtype={col: str for col in COLUMNS_TO_KEEP if col not in ('Latitud', 'Longitud')},
+        float_precision='round_trip',
+    )
+    if KEY_COLUMN not in previous_clean.columns:
+        return None, None
+    previous_manifest = pd.read_csv(manifest_file, sep=';', dtype={KEY_COLUMN: str, 'HashContenido': 'uint64'})
+    return previous_clean.drop(columns=['PlazaEDF', 'ServicioSaludEDF'], errors='ignore'), previous_manifest
+
+
+def detect_encoding(input_file, encodings=RAW_ENCODINGS, block_size=1024 * 1024):
+    """
+    Primera codificación de la lista que decodifica el archivo completo.
+    Lee por bloques, sin cargar el archivo en memoria.
+    """
+    for encoding in encodings:
+        decoder = codecs.getincrementaldecoder(encoding)()
+        try:
+            with open(input_file, 'rb') as f:
+                while True:
+                    block = f.read(block_size)
+                    if not block:
+                        break
+                    decoder.decode(block)
+                decoder.decode(b'', final=True)
+            return encoding
+        except UnicodeDecodeError:
+            continue
+    raise ValueError(f"No se pudo decodificar {input_file} con {encodings}")
+
+
+def read_raw_chunks(input_file, columns=None, encoding=None, block_size=STREAM_BLOCK_SIZE):
+    """
+    Lee el snapshot crudo en bloques de tamaño acotado como dataframes de texto.
+    Usa el lector CSV en streaming de pyarrow si está instalado; si no,
+    pandas con chunksize.
+
+    Args:
+        columns (list): columnas a leer (default COLUMNS_TO_KEEP), en el orden del archivo.
+        encoding (str): codificación; si es None se detecta con detect_encoding.
+        block_size (int): bytes por bloque para el lector de pyarrow.
+    """
+    columns = columns or COLUMNS_TO_KEEP
+    encoding = encoding or detect_encoding(input_file)
+
+    with open(input_file, encoding=encoding) as f:
+        header = [name.strip().strip('"').lstrip('\ufeff') for name in f.readline().rstrip('\r\n').split(RAW_SEPARATOR)]
+    missing = [col for col in columns if col not in header]
+    if missing:
+        raise ValueError(f"'usecols' do not match columns, columns expected but not found: {missing}")
+    ordered = [col for col in header if col in columns]
+
+    try:
+        import pyarrow as pa
+        import pyarrow.csv as pacsv
+    except ImportError:
+        pacsv = None
+
+    if pacsv is None:
+        yield from pd.read_csv(
+            input_file, sep=RAW_SEPARATOR, encoding=encoding, dtype=str,
+            usecols=ordered, chunksize=STREAM_CHUNK_ROWS
+        )
+        return
+
+    reader = pacsv.open_csv(
+        input_file,
+        read_options=pacsv.ReadOptions(encoding=encoding, block_size=block_size),
+        parse_options=pacsv.ParseOptions(delimiter=RAW_SEPARATOR, newlines_in_values=True),
+        convert_options=pacsv.ConvertOptions(
+            include_columns=ordered,
+            column_types={col: pa.string() for col in ordered},
+            strings_can_be_null=True,
+            null_values=RAW_NA_VALUES,
+        ),
+    )
+    for batch in reader:
+        if batch.num_rows:
+            yield batch.to_pandas()
+
+
+def scan_snapshot(input_file, encoding, plaza_comunas, block_size=STREAM_BLOCK_SIZE):
+    """
+    Primera pasada del modo streaming, solo sobre las columnas de texto necesarias:
+    - claves (nombre, comuna) de establecimientos en comunas con plazas, para el cruce EDF;
+    - categorías de las columnas de CATEGORICAL_COLUMNS, para el artefacto columnar.
+    La memoria depende de las comunas con plazas y de la cardinalidad de las
+    categóricas, no del tamaño del archivo.
+
+    Returns:
+        (dict clave -> nombre original, dict columna -> set de categorías)
+    """
+    columns = ['EstablecimientoGlosa', 'ComunaGlosa'] + [
+        col for col in CATEGORICAL_COLUMNS if col in COLUMNS_TO_KEEP and col not in ('ComunaGlosa',)
+    ]
+    estab_keys = {}
+    categories = {col: set() for col in columns if col in CATEGORICAL_COLUMNS}
+
+    for chunk in read_raw_chunks(input_file, columns=columns, encoding=encoding, block_size=block_size):
+        chunk = clean_rows(chunk, verbose=False)
+        for col in categories:
+            values = chunk[col].dropna()
+            categories[col].update(values[values != ''].unique().tolist())
+
+        keys = plaza_match_keys(chunk['EstablecimientoGlosa'], chunk['ComunaGlosa'])
+        in_plaza_comunas = keys.get_level_values(1).isin(plaza_comunas)
+        names = chunk['EstablecimientoGlosa'].to_numpy(dtype=object)[in_plaza_comunas]
+        for key, name in zip(keys[in_plaza_comunas], names):
+            estab_keys.setdefault(key, name)
+
+    return estab_keys, categories
+
+
+def apply_plaza_matches(df, matched_keys, matched_servicios):
+    """
+    Agrega PlazaEDF y ServicioSaludEDF a un bloque a partir de las claves ya cruzadas.
+    """
+    positions = matched_keys.get_indexer(plaza_match_keys(df['EstablecimientoGlosa'], df['ComunaGlosa']))
+    df['PlazaEDF'] = positions >= 0
+    if len(matched_keys):
+        df['ServicioSaludEDF'] = np.where(positions >= 0, matched_servicios[positions], '')
+    else:
+        df['ServicioSaludEDF'] = ''
     return df
 
 
-def main():
-    input_file = 'data/establecimientos_20260310.csv'
-    output_file = 'data/establecimientos_cleaned.csv'
+def clean_stream(input_file, output_file, columnar_output_file, manifest_file,
+                 plazas_file='data/Plazas RM - Hoja 1.csv', report_file=None,
+                 block_size=STREAM_BLOCK_SIZE, keep_columns=()):
+    """
+    Limpieza completa en streaming, con memoria acotada:
+    1. scan_snapshot resuelve el cruce de Plazas EDF y las categorías.
+    2. Cada bloque pasa por clean_rows y apply_plaza_matches y se agrega
+       a la salida CSV, al manifiesto de hashes y al Parquet.
+    El resultado es idéntico al de la limpieza en memoria.
+
+    Cada bloque se valida además con las reglas de quality.py al escribirlo.
+
+    Args:
+        keep_columns (list): columnas limpias que se conservan de todos los
+                             bloques (p. ej. para duplicados y cobertura), con
+                             los valores que tendrían al releer el CSV. Solo
+                             ellas crecen con el tamaño del registro.
+
+    Returns:
+        (filas escritas, DataFrame con keep_columns de todas las filas,
+         reporte de calidad del archivo completo)
+    """
+    # Imported here: quality builds on this module
+    from quality import merge_reports, validate
+
+    encoding = detect_encoding(input_file)
+    print(f"Codificación detectada: {encoding}")
+
+    plazas = pd.read_csv(plazas_file) if os.path.exists(plazas_file) else None
+    if plazas is None:
+        print(f"Archivo de plazas no encontrado: {plazas_file}, saltando cruce.")
+        plaza_comunas = []
+    else:
+        plaza_comunas = apply_distinct(plazas['COMUNA'], norm_match).unique()
+
+    print("Primera pasada: claves de cruce y categorías...")
+    estab_keys, categories = scan_snapshot(input_file, encoding, plaza_comunas, block_size)
+
+    matched_keys, matched_servicios = None, None
+    if plazas is not None:
+        print(f"\nCruzando con Plazas EDF ({len(plazas)} registros)...")
+        if estab_keys:
+            estab_uniques = pd.MultiIndex.from_tuples(list(estab_keys))
+        else:
+            estab_uniques = pd.MultiIndex.from_arrays([[], []])
+        estab_display = np.array(list(estab_keys.values()), dtype=object)
+        key_matched, key_servicios, report = match_plazas(plazas, estab_uniques, estab_display)
+        matched_keys = estab_uniques[key_matched]
+        matched_servicios = key_servicios[key_matched]
+        categories['ServicioSaludEDF'] = {s for s in matched_servicios if isinstance(s, str) and s}
+    categories = {col: sorted(values) for col, values in categories.items()}
+
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        print(f"pyarrow no está instalado, no se genera {columnar_output_file}.")
+        pq = None
+
+    print("Segunda pasada: limpieza y escritura por bloques...")
+    rows, matched, writer, kept, reports = 0, 0, None, [], []
+    try:
+        for chunk in read_raw_chunks(input_file, encoding=encoding, block_size=block_size):
+            manifest = pd.DataFrame({KEY_COLUMN: chunk[KEY_COLUMN], 'HashContenido': content_hashes(chunk)})
+            chunk = add_year_columns(clean_rows(chunk, verbose=False))
+            if matched_keys is not None:
+                chunk = apply_plaza_matches(chunk, matched_keys, matched_servicios)
+                matched += int(chunk['PlazaEDF'].sum())
+            else:
+                chunk['PlazaEDF'] = False
+
+            first = rows == 0
+            chunk.to_csv(output_file, sep=';', index=False, encoding='utf-8', mode='w' if first else 'a', header=first)
+            manifest.to_csv(manifest_file, sep=';', index=False, encoding='utf-8', mode='w' if first else 'a', header=first)
+
+            if pq is not None:
+                table = pa.Table.from_pandas(to_typed_frame(chunk, categories), preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(columnar_output_file, table.schema)
+                writer.write_table(table.cast(writer.schema))
+
+            reports.append(validate(chunk))
+            if keep_columns:
+                # Empty text is read back from the CSV as missing
+                kept.append(chunk[list(keep_columns)].replace('', np.nan))
+            rows += len(chunk)
+            print(f"  {rows} filas procesadas")
+    finally:
+        if writer is not None:
+            writer.close()
+
+    if plazas is not None:
+        summarize_plaza_matches(report, matched, report_file)
+
+    kept = pd.concat(kept, ignore_index=True) if kept else pd.DataFrame(columns=list(keep_columns))
+    return rows, kept, merge_reports(reports)
+
+
+def validate_clean(df, report_file, max_fraction=None):
+    """
+    Aplica las reglas de calidad (quality.py) al frame limpio y guarda el reporte JSON.
+
+    Args:
+        df: frame limpio, o reporte ya calculado por bloques (ver clean_stream).
+
+    Returns:
+        True si ninguna regla supera max_fraction (siempre True sin umbral).
+    """
+    # Imported here: quality builds on this module
+    from quality import check_quality, check_report
+
+    if isinstance(df, dict):
+        _, failed = check_report(df, report_file, max_fraction)
+    else:
+        _, failed = check_quality(df, report_file, max_fraction)
+    return not failed
+
+
+def staging_path(path):
+    # Outputs are written next to their final path and renamed once complete
+    return f'{path}.tmp'
+
+
+def replace_outputs(paths):
+    """
+    Reemplaza cada salida por su versión escrita en staging_path (os.replace,
+    atómico por archivo). Las que no se escribieron quedan como estaban.
+    """
+    for path in paths:
+        if os.path.exists(staging_path(path)):
+            os.replace(staging_path(path), path)
+
+
+def discard_outputs(paths):
+    for path in paths:
+        if os.path.exists(staging_path(path)):
+            os.remove(staging_path(path))
+
+
+def publish_shared(columnar_file, output_dir):
+    """
+    Publica el artefacto columnar y sus índices como nueva versión compartida
+    (<output-dir>/compartido) que los procesos del servidor mapean en memoria.
+    """
+    # Imported here: shared_store builds on dataset.py, which is not needed for cleaning
+    from shared_store import SHARED_DIR, publish
+
+    shared_dir = os.path.join(output_dir, SHARED_DIR)
+    print(f"Publicando dataset compartido en {shared_dir}...")
+    version = publish(pd.read_parquet(columnar_file), shared_dir)
+    print(f"Versión vigente: {version}")
+
+
+def add_to_store(input_file, clean_file, output_dir):
+    """
+    Agrega el snapshot recién limpiado al almacén histórico de output_dir.
+    Solo se guardan las filas nuevas o modificadas respecto del snapshot anterior.
+    """
+    # Imported here: snapshot_store builds on this module
+    from snapshot_store import STORE_DIR, SnapshotStore, read_clean, snapshot_date_from_name
+
+    snapshot = snapshot_date_from_name(input_file)
+    if snapshot is None or pd.isna(snapshot):
+        raise ValueError(f"No se pudo inferir la fecha del snapshot desde {input_file} (se espera AAAAMMDD en el nombre)")
+    store_dir = os.path.join(output_dir, STORE_DIR)
+    print(f"Agregando snapshot {snapshot:%Y-%m-%d} al almacén histórico {store_dir}...")
+    summary = SnapshotStore(store_dir).append(read_clean(clean_file), snapshot, input_file)
+    print(f"Altas: {summary['Altas']}, modificaciones: {summary['Modificaciones']}, "
+          f"bajas: {summary['Bajas']}, sin cambios: {summary['SinCambios']}")
+
+
+def main(argv=None):
+    # Imported here: dataset builds on this module (through search.py)
+    from dataset import DATA_DIR
+
+    parser = argparse.ArgumentParser(description="Limpieza del registro de establecimientos de salud (MINSAL).")
+    parser.add_argument('input_file', nargs='?', default='data/establecimientos_20260310.csv',
+                        help="Snapshot crudo (CSV separado por ';')")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Re-limpia solo las filas agregadas o modificadas respecto de la salida anterior")
+    parser.add_argument('--stream', action='store_true',
+                        help="Procesa el archivo por bloques con memoria acotada (archivos grandes)")
+    parser.add_argument('--chunk-mb', type=int, default=STREAM_BLOCK_SIZE // (1024 * 1024),
+                        help="Tamaño de bloque en MB para --stream (default: %(default)s)")
+    parser.add_argument('--output-dir', default=DATA_DIR,
+                        help="Directorio de los archivos limpios, p. ej. para datos sintéticos (default: %(default)s)")
+    parser.add_argument('--store', action='store_true',
+                        help="Agrega el snapshot limpio al almacén histórico (<output-dir>/historico); "
+                             "la fecha se toma del nombre del archivo (AAAAMMDD)")
+    parser.add_argument('--collapse-duplicates', action='store_true',
+                        help="Deja solo la fila canónica de cada grupo de establecimientos casi duplicados")
+    parser.add_argument('--max-violations', type=float,
+                        help="Fracción máxima de filas con violaciones por regla de calidad; sobre ella el "
+                             "proceso termina con código 1 sin reemplazar la salida anterior")
+    parser.add_argument('--publish', action='store_true',
+                        help="Publica el resultado como nueva versión compartida en memoria (<output-dir>/compartido) "
+                             "para los procesos del servidor")
+    args = parser.parse_args(argv)
+    if args.stream and args.incremental:
+        parser.error("--stream y --incremental no se pueden combinar")
+    if args.stream and args.collapse_duplicates:
+        parser.error("--stream y --collapse-duplicates no se pueden combinar")
+
+    input_file = args.input_file
+    output_dir = args.output_dir
+    output_file = os.path.join(output_dir, 'establecimientos_cleaned.csv')
+    columnar_output_file = os.path.join(output_dir, 'establecimientos_cleaned.parquet')
+    plazas_report_file = os.path.join(output_dir, 'plazas_edf_match_report.csv')
+    manifest_file = os.path.join(output_dir, 'establecimientos_hashes.csv')
+    changes_file = os.path.join(output_dir, 'establecimientos_changes.csv')
+    coverage_file = os.path.join(output_dir, 'cobertura_urgencia_comunas.csv')
+    duplicates_file = os.path.join(output_dir, 'establecimientos_duplicados.csv')
+    quality_file = os.path.join(output_dir, 'calidad_datos.json')
 
     if not os.path.exists(input_file):
         print(f"Error: El archivo {input_file} no existe.")
         sys.exit(1)
+    os.makedirs(output_dir, exist_ok=True)
 
     print(f"Iniciando proceso de limpieza: {datetime.now().strftime('%H:%M:%S')}")
     print(f"Columnas a mantener: {COLUMNS_TO_KEEP}")
 
+    # Written to staging files and renamed only after the quality gate passes,
+    # so a failed or interrupted refresh keeps the previous output
+    staged_outputs = [output_file, columnar_output_file, manifest_file, plazas_report_file]
+    discard_outputs(staged_outputs)
     try:
+        if args.stream:
+            # Duplicates and coverage are computed from these columns, kept
+            # from every block, instead of reading the written output back
+            rows, kept, quality_report = clean_stream(
+                input_file, staging_path(output_file), staging_path(columnar_output_file), staging_path(manifest_file),
+                report_file=staging_path(plazas_report_file), block_size=args.chunk_mb * 1024 * 1024,
+                keep_columns=list(dict.fromkeys(DEDUP_COLUMNS + COVERAGE_COLUMNS)),
+            )
+            if not validate_clean(quality_report, quality_file, args.max_violations):
+                sys.exit(1)
+            replace_outputs(staged_outputs)
+
+            print(f"Guardando cobertura de urgencias por comuna en {coverage_file}...")
+            save_coverage_table(kept, coverage_file)
+            # Report only: the written output is not rewritten in stream mode
+            dedupe_facilities(kept[DEDUP_COLUMNS], report_file=duplicates_file)
+            if args.store:
+                add_to_store(input_file, output_file, output_dir)
+            if args.publish:
+                publish_shared(columnar_output_file, output_dir)
+            print(f"Proceso completado: {datetime.now().strftime('%H:%M:%S')}")
+            print(f"Archivo guardado como '{output_file}' con {rows} filas.")
+            return
+
         print("Leyendo archivo CSV (solo columnas necesarias)...")
         # Use usecols to load only necessary data
         df = pd.read_csv(
             input_file,
-            sep=';',
-            encoding='utf-8',
+            sep=RAW_SEPARATOR,
+            encoding=detect_encoding(input_file),
             dtype=str, # Read all as string initially to handle mixed types
             low_memory=False,
             usecols=COLUMNS_TO_KEEP
@@ -215,32 +1331,58 @@ def main():
         print(f"Filas leídas: {len(df)}")
         print(f"Columnas cargadas: {df.columns.tolist()}")
 
-        # Convert Lat/Lon to numeric after loading as string (handle potential errors)
-        for col in ['Latitud', 'Longitud']:
-            if col in df.columns:
-                df[col] = pd.to_numeric(df[col].str.replace(',', '.'), errors='coerce')
+        manifest = pd.DataFrame({KEY_COLUMN: df[KEY_COLUMN], 'HashContenido': content_hashes(df)})
 
-        if 'RegionGlosa' in df.columns:
-            print("\nEjemplos de regiones ANTES de normalización:")
-            print(df['RegionGlosa'].drop_duplicates().head(10).tolist())
+        previous_clean, previous_manifest = (None, None)
+        if args.incremental:
+            previous_clean, previous_manifest = read_previous_clean(output_file, manifest_file)
+            if previous_clean is None:
+                print("No hay salida anterior con manifiesto de hashes, se hace limpieza completa.")
+            elif df[KEY_COLUMN].duplicated().any():
+                print(f"{KEY_COLUMN} tiene duplicados en el snapshot, se hace limpieza completa.")
+                previous_clean = None
 
-        # Standardize TieneServicioUrgencia values
-        if 'TieneServicioUrgencia' in df.columns:
-            urgencia_map = {'SI': 'SI', 'Si': 'SI', 'si': 'SI', 'NO': 'NO', 'No': 'NO', 'no': 'NO'}
-            df['TieneServicioUrgencia'] = df['TieneServicioUrgencia'].map(urgencia_map).fillna(df['TieneServicioUrgencia'])
-            print(f"\nTieneServicioUrgencia estandarizado: {df['TieneServicioUrgencia'].value_counts().to_dict()}")
+        changes = None
+        if previous_clean is not None:
+            df, changes = clean_incremental(df, previous_clean, previous_manifest)
+            changes.insert(0, 'Snapshot', os.path.basename(input_file))
+        else:
+            df = clean_rows(df)
+        df = add_year_columns(df)
 
-        print("\nAplicando normalización a los datos...")
-        df = normalize_columns(df)
+        # Gate before anything is written; the changes log is appended only once the output is replaced
+        if not validate_clean(df, quality_file, args.max_violations):
+            sys.exit(1)
 
-        if 'RegionGlosa' in df.columns:
-            print("\nEjemplos de regiones DESPUÉS de normalización:")
-            print(df['RegionGlosa'].drop_duplicates().head(10).tolist())
+        df = dedupe_facilities(df, report_file=duplicates_file, collapse=args.collapse_duplicates)
+        if args.collapse_duplicates:
+            # Collapsed rows leave the manifest too, so an incremental run never reuses them
+            manifest = manifest[manifest[KEY_COLUMN].isin(df[KEY_COLUMN])]
 
-        df = add_plaza_edf(df)
+        # Plaza matches depend on the whole registry (a changed row can take or
+        # release a plaza), so the vectorized join always runs on the full frame
+        df = add_plaza_edf(df, report_file=staging_path(plazas_report_file))
 
         print(f"\nGuardando archivo limpio en {output_file}...")
-        df.to_csv(output_file, sep=';', index=False, encoding='utf-8')
+        df.to_csv(staging_path(output_file), sep=';', index=False, encoding='utf-8')
+        manifest.to_csv(staging_path(manifest_file), sep=';', index=False, encoding='utf-8')
+
+        print(f"Guardando artefacto columnar en {columnar_output_file}...")
+        save_columnar(to_typed_frame(df), staging_path(columnar_output_file))
+        replace_outputs(staged_outputs)
+
+        if changes is not None:
+            changes.to_csv(changes_file, sep=';', index=False, encoding='utf-8',
+                           mode='a', header=not os.path.exists(changes_file))
+            print(f"Cambios registrados en {changes_file}")
+
+        print(f"Guardando cobertura de urgencias por comuna en {coverage_file}...")
+        save_coverage_table(output_file, coverage_file)
+
+        if args.store:
+            add_to_store(input_file, output_file, output_dir)
+        if args.publish:
+            publish_shared(columnar_output_file, output_dir)
 
         print(f"Proceso completado: {datetime.now().strftime('%H:%M:%S')}")
         print(f"Archivo guardado como '{output_file}' con {len(df.columns)} columnas.")
@@ -255,6 +1397,8 @@ def main():
     except Exception as e:
         print(f"Error durante el procesamiento: {str(e)}")
         sys.exit(1)
+    finally:
+        discard_outputs(staged_outputs)
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
@@ -0,0 +1,503 @@
+import os
+import threading
+from functools import cached_property
+
+import numpy as np
+import pandas as pd
+
+from search import SEARCH_LIMIT, build_search_index, search_positions
+from spatial import build_facility_index, comuna_coverage, nearest_facilities, urgency_distances
+
+# Directory written by clean_data.py (--output-dir); overridable to serve e.g. synthetic data
+DATA_DIR = os.environ.get('ESTABLECIMIENTOS_DATA_DIR', 'data')
+DATA_PATH = os.path.join(DATA_DIR, 'establecimientos_cleaned.csv')
+COLUMNAR_DATA_PATH = os.path.join(DATA_DIR, 'establecimientos_cleaned.parquet')
+COVERAGE_DATA_PATH = os.path.join(DATA_DIR, 'cobertura_urgencia_comunas.csv')
+
+COL_REGION = "RegionGlosa"
+COL_TIPO_ESTAB = "TipoEstablecimientoGlosa"
+COL_SISTEMA = "TipoSistemaSaludGlosa"
+COL_ESTADO = "EstadoFuncionamiento"
+COL_URGENCIA = "TieneServicioUrgencia"
+COL_NIVEL_ATENCION = "NivelAtencionEstabglosa"
+COL_NIVEL_COMPLEJIDAD = "NivelComplejidadEstabGlosa"
+COL_FECHA_INICIO = "FechaInicioFuncionamientoEstab"
+COL_ANIO_INICIO = "AnioInicioFuncionamientoEstab"
+COL_LAT = "Latitud"
+COL_LON = "Longitud"
+COL_NOMBRE = "EstablecimientoGlosa"
+COL_COMUNA = "ComunaGlosa"
+COL_DEPENDENCIA = "DependenciaAdministrativa"
+COL_TIPO_ATENCION = "TipoAtencionEstabGlosa"
+COL_TIPO_URGENCIA = "TipoUrgencia"
+COL_PLAZA_EDF = "PlazaEDF"
+COL_SERVICIO_EDF = "ServicioSaludEDF"
+
+FILTER_COLUMNS = [
+    COL_REGION, COL_TIPO_ESTAB, COL_SISTEMA, COL_ESTADO,
+    COL_DEPENDENCIA, COL_PLAZA_EDF, COL_SERVICIO_EDF,
+]
+
+# Dimensions of the count cube: filter columns plus every column a KPI or chart slices by
+CUBE_COLUMNS = FILTER_COLUMNS + [
+    COL_COMUNA, COL_TIPO_URGENCIA, COL_URGENCIA, COL_NIVEL_ATENCION, COL_NIVEL_COMPLEJIDAD,
+]
+# Dimensions of the opening-year series cube (plus the year itself)
+SERIES_COLUMNS = FILTER_COLUMNS + [COL_NIVEL_COMPLEJIDAD]
+
+# Derived classes used by KPIs and charts
+SYSTEM_CLASSES = ['Público', 'Privado', 'Otros']
+DEPENDENCY_CLASSES = ['Municipal', 'Privado', 'Servicio de Salud', 'Otro']
+COMPLEXITY_LEVELS = ['Alta Complejidad', 'Mediana Complejidad', 'Baja Complejidad']
+# Main urgency types; other actual services are grouped as 'Otros'
+URGENCY_TYPES = [
+    'Urgencia Hospitalaria (UEH)',
+    'Urgencia Ambulatoria (SAPU)',
+    'Urgencia Ambulatoria (SAR)',
+    'Urgencia Ambulatoria (SUR)',
+]
+URGENCY_CLASSES = URGENCY_TYPES + ['Otros']
+
+# Datasets shared by every session of the process (see shared_dataset)
+_SHARED_DATASETS = {}
+_SHARED_DATASETS_LOCK = threading.Lock()
+
+
+def load_data(path=DATA_PATH, columnar_path=COLUMNAR_DATA_PATH):
+    """
+    Lee los datos limpios, prefiriendo el artefacto Parquet de clean_data.py.
+
+    Returns:
+        (DataFrame, None) o (None, mensaje de error).
+    """
+    try:
+        if columnar_path and os.path.exists(columnar_path):
+            try:
+                return pd.read_parquet(columnar_path), None
+            except ImportError:
+                pass
+        try:
+            df = pd.read_csv(path, sep=';', encoding='utf-8')
+        except UnicodeDecodeError:
+            df = pd.read_csv(path, sep=';', encoding='latin1')
+        return df, None
+    except Exception as e:
+        return None, str(e)
+
+
+def load_coverage_table(path=COVERAGE_DATA_PATH):
+    """
+    Tabla de cobertura por comuna materializada por clean_data.py (datos sin filtrar).
+    None si no existe.
+    """
+    if os.path.exists(path):
+        return pd.read_csv(path, sep=';')
+    return None
+
+
+def count_values(series):
+    # value_counts() on a categorical also lists categories with zero rows
+    counts = series.value_counts()
+    return counts[counts > 0]
+
+
+def classify_sistema(val):
+    return val if val in ('Público', 'Privado') else 'Otros'
+
+
+def simplify_dependency(val):
+    if val in ('Municipal', 'Privado', 'Servicio de Salud'):
+        return val
+    return 'Otro'
+
+
+def build_filter_index(df):
+    # One packed bitmap (1 bit per row) per distinct value of each filter column
+    n_rows = len(df)
+    bitmaps, options = {}, {}
+    for column in FILTER_COLUMNS:
+        if column not in df.columns:
+            continue
+        codes, uniques = pd.factorize(df[column])
+        values = uniques.tolist()
+        bitmaps[column] = {
+            value: np.packbits(codes == code) for code, value in enumerate(values)
+        }
+        options[column] = sorted(values)
+    return {'n_rows': n_rows, 'bitmaps': bitmaps, 'options': options}
+
+
+def resolve_filters(filter_index, filters):
+    """Row ids matching the filters: OR within a column, AND across columns.
+
+    Returns None when no filter is active.
+    """
+    selection = None
+    for column, selected_values in filters.items():
+        if not selected_values or column not in filter_index['bitmaps']:
+            continue
+        column_bitmaps = filter_index['bitmaps'][column]
+        column_selection = np.zeros((filter_index['n_rows'] + 7) // 8, dtype=np.uint8)
+        for value in selected_values:
+            bitmap = column_bitmaps.get(value)
+            if bitmap is not None:
+                np.bitwise_or(column_selection, bitmap, out=column_selection)
+        if selection is None:
+            selection = column_selection
+        else:
+            np.bitwise_and(selection, column_selection, out=selection)
+    if selection is None:
+        return None
+    return np.flatnonzero(np.unpackbits(selection, count=filter_index['n_rows']))
+
+
+def apply_filters(df, filters, filter_index=None):
+    if filter_index is None:
+        filter_index = build_filter_index(df)
+    rows = resolve_filters(filter_index, filters)
+    if rows is None:
+        return df
+    return df.iloc[rows]
+
+
+def build_count_cube(df):
+    # One row per distinct combination of the cube dimensions with its row count 'n';
+    # derived classes (_sistema, _dep, _ambulatoria, _urgencia) are computed once here
+    dims = df[[col for col in CUBE_COLUMNS if col in df.columns]].copy()
+    if COL_SISTEMA in df.columns:
+        dims['_sistema'] = df[COL_SISTEMA].map(classify_sistema)
+    if COL_DEPENDENCIA in df.columns:
+        dims['_dep'] = df[COL_DEPENDENCIA].apply(simplify_dependency)
+    if COL_TIPO_ATENCION in df.columns:
+        dims['_ambulatoria'] = df[COL_TIPO_ATENCION].str.contains('Abierta', case=False, na=False)
+    if COL_TIPO_URGENCIA in df.columns:
+        # Main urgency types as-is, other actual services as 'Otros', the rest NA
+        is_main = df[COL_TIPO_URGENCIA].isin(URGENCY_TYPES)
+        is_minor = (
+            (~is_main) &
+            (df[COL_TIPO_URGENCIA] != 'No Aplica') &
+            (df[COL_TIPO_URGENCIA] != 'SIN DATO') &
+            (df[COL_TIPO_URGENCIA].notna())
+        )
+        dims['_urgencia'] = df[COL_TIPO_URGENCIA].astype(object).where(is_main, np.where(is_minor, 'Otros', None))
+
+    return dims.groupby(list(dims.columns), observed=True, dropna=False).size().rename('n').reset_index()
+
+
+def slice_cube(cube, filters):
+    # Same selection as apply_filters(), over cube cells instead of rows
+    mask = np.ones(len(cube), dtype=bool)
+    for col, values in filters.items():
+        if len(values) > 0 and col in cube.columns:
+            mask &= cube[col].isin(values).to_numpy()
+    return cube[mask]
+
+
+def cube_counts(cube, column):
+    # Same counts as count_values() on the filtered rows; ties keep label order
+    counts = cube.groupby(column, observed=True)['n'].sum().sort_values(ascending=False, kind='stable')
+    return counts[counts > 0]
+
+
+def crosstab_cube(cube, index, columns):
+    # Same counts as pd.crosstab() on the filtered rows
+    return cube.groupby([index, columns], observed=True)['n'].sum().unstack(fill_value=0)
+
+
+def cube_kpis(cube):
+    """
+    Indicadores del encabezado a partir de un cubo de conteos (ya filtrado).
+
+    Returns:
+        dict de enteros; None para los indicadores cuya columna no existe.
+    """
+    def total(mask):
+        return int(cube.loc[mask, 'n'].sum())
+
+    kpis = {'total': int(cube['n'].sum())}
+    kpis['urgencias'] = None
+    if COL_TIPO_URGENCIA in cube.columns:
+        kpis['urgencias'] = total(cube[COL_TIPO_URGENCIA].isin(URGENCY_TYPES))
+        if kpis['urgencias'] == 0 and COL_URGENCIA in cube.columns:
+            kpis['urgencias'] = total(cube[COL_URGENCIA] == "SI")
+    kpis['publico'] = total(cube[COL_SISTEMA] == "Público") if COL_SISTEMA in cube.columns else None
+    kpis['ambulatoria'] = total(cube['_ambulatoria']) if '_ambulatoria' in cube.columns else None
+    kpis['municipal'] = total(cube[COL_DEPENDENCIA] == 'Municipal') if COL_DEPENDENCIA in cube.columns else None
+    kpis['comunas'], kpis['comunas_con_urgencia'] = None, None
+    if COL_COMUNA in cube.columns and COL_URGENCIA in cube.columns:
+        kpis['comunas'] = int(cube[COL_COMUNA].nunique())
+        kpis['comunas_con_urgencia'] = int(cube.loc[cube[COL_URGENCIA] == 'SI', COL_COMUNA].nunique())
+    return kpis
+
+
+def urgency_kpis(cube):
+    """
+    Indicadores de la red de urgencias a partir de un cubo de conteos (ya filtrado).
+    """
+    cube_urg = cube[cube['_urgencia'].notna()]
+    return {
+        'servicios': int(cube_urg['n'].sum()),
+        'comunas': int(cube[COL_COMUNA].nunique()),
+        'comunas_con_urgencia': int(cube.loc[cube[COL_URGENCIA] == 'SI', COL_COMUNA].nunique()),
+        'ueh': int(cube_urg.loc[cube_urg['_urgencia'] == 'Urgencia Hospitalaria (UEH)', 'n'].sum()),
+        'sapu': int(cube_urg.loc[cube_urg['_urgencia'] == 'Urgencia Ambulatoria (SAPU)', 'n'].sum()),
+    }
+
+
+def start_years(df):
+    # Integer year written by clean_data.py; artifacts without it fall back to the date
+    if COL_ANIO_INICIO in df.columns:
+        return pd.to_numeric(df[COL_ANIO_INICIO], errors='coerce')
+    return pd.to_datetime(df[COL_FECHA_INICIO], errors='coerce', dayfirst=True).dt.year
+
+
+def build_series_cube(df):
+    # Openings per (filter columns, complexity, year) cell with their count 'n';
+    # rows without a valid start year are left out, as in the historical chart
+    years = start_years(df)
+    valid = years.notna().to_numpy()
+    dims = df.loc[valid, [col for col in SERIES_COLUMNS if col in df.columns]]
+    dims = dims.assign(_anio=years[valid].astype(int).to_numpy())
+    return dims.groupby(list(dims.columns), observed=True, dropna=False).size().rename('n').reset_index()
+
+
+def series_prefix_sums(series_cube):
+    # Dense year x complexity counts of a sliced series cube, accumulated along the years
+    # with a leading zero row; the last column holds openings of any other complexity
+    if series_cube.empty:
+        return None
+    levels = list(COMPLEXITY_LEVELS)
+    first_year = int(series_cube['_anio'].min())
+    n_years = int(series_cube['_anio'].max()) - first_year + 1
+
+    level_pos = series_cube[COL_NIVEL_COMPLEJIDAD].astype(object).map({lvl: i for i, lvl in enumerate(levels)})
+    level_pos = level_pos.fillna(len(levels)).astype(int).to_numpy()
+    counts = np.zeros((n_years, len(levels) + 1), dtype=np.int64)
+    np.add.at(counts, (series_cube['_anio'].to_numpy() - first_year, level_pos), series_cube['n'].to_numpy())
+
+    prefix = np.zeros((n_years + 1, len(levels) + 1), dtype=np.int64)
+    np.cumsum(counts, axis=0, out=prefix[1:])
+    return {'first_year': first_year, 'last_year': first_year + n_years - 1, 'levels': levels, 'prefix': prefix}
+
+
+def series_window(series, first_year, last_year, cumulative=False):
+    # Per-level openings in each year of the range, or running totals since first_year;
+    # every value is a difference of two prefix rows, whatever the length of the range
+    first_year = max(first_year, series['first_year'])
+    last_year = min(last_year, series['last_year'])
+    lo, hi = first_year - series['first_year'], last_year - series['first_year'] + 1
+    prefix = series['prefix'][:, :len(series['levels'])]
+
+    annual = prefix[lo + 1:hi + 1] - prefix[lo:hi]
+    values = prefix[lo + 1:hi + 1] - prefix[lo] if cumulative else annual
+    years = pd.Index(np.arange(first_year, last_year + 1), name='Año')
+    return (
+        pd.DataFrame(values, index=years, columns=series['levels']),
+        pd.DataFrame(annual > 0, index=years, columns=series['levels']),
+    )
+
+
+class FacilityDataset:
+    """
+    Registro de establecimientos cargado una vez, con sus índices en memoria.
+    No depende de Streamlit: lo usan la aplicación, query_service.py y los scripts.
+
+    Los filtros son dicts {columna de FILTER_COLUMNS: [valores]} (OR dentro de
+    una columna, AND entre columnas; listas vacías se ignoran). Los índices
+    derivados se construyen la primera vez que se usan (o todos con warm()) y
+    luego son de solo lectura, así que una instancia se puede compartir entre hilos.
+    """
+
+    def __init__(self, df, coverage_path=COVERAGE_DATA_PATH, indexes=None, version=None):
+        """
+        Args:
+            indexes (dict): índices ya construidos por nombre de propiedad
+                (p. ej. mapeados desde una versión publicada, ver shared_store.py).
+            version (str): versión publicada de la que viene df; None si se leyó de los archivos limpios.
+        """
+        self.df = df
+        self.coverage_path = coverage_path
+        self.version = version
+        # Pre-built indexes take the place of the cached properties below
+        self.__dict__.update(indexes or {})
+
+    @classmethod
+    def load(cls, path=DATA_PATH, columnar_path=COLUMNAR_DATA_PATH, coverage_path=COVERAGE_DATA_PATH):
+        df, error = load_data(path, columnar_path)
+        if error:
+            raise ValueError(f"No se pudieron cargar los datos: {error}")
+        return cls(df, coverage_path)
+
+    def warm(self):
+        """
+        Construye todos los índices de inmediato (antes de atender consultas concurrentes).
+        """
+        for name in ('filter_index', 'count_cube', 'series_cube', 'facility_index', 'service_distances', 'search_index', 'coverage_table'):
+            getattr(self, name)
+        return self
+
+    @cached_property
+    def filter_index(self):
+        return build_filter_index(self.df)
+
+    @cached_property
+    def count_cube(self):
+        return build_count_cube(self.df)
+
+    @cached_property
+    def series_cube(self):
+        if not any(col in self.df.columns for col in [COL_ANIO_INICIO, COL_FECHA_INICIO]):
+            return None
+        return build_series_cube(self.df)
+
+    @cached_property
+    def facility_index(self):
+        if not all(col in self.df.columns for col in [COL_LAT, COL_LON]):
+            return None
+        return build_facility_index(self.df)
+
+    @cached_property
+    def service_distances(self):
+        # Per facility, distance to the urgency services of the whole registry
+        if not all(col in self.df.columns for col in [COL_LAT, COL_LON, COL_TIPO_URGENCIA]):
+            return None
+        return urgency_distances(self.df)
+
+    @cached_property
+    def search_index(self):
+        return build_search_index(self.df, COL_NOMBRE, COL_COMUNA)
+
+    @cached_property
+    def coverage_table(self):
+        return load_coverage_table(self.coverage_path)
+
+    def options(self):
+        """Valores disponibles por columna filtrable."""
+        return self.filter_index['options']
+
+    def filter(self, filters=None):
+        """Filas que cumplen los filtros."""
+        return apply_filters(self.df, filters or {}, self.filter_index)
+
+    def cube(self, filters=None):
+        """Celdas del cubo de conteos que cumplen los filtros."""
+        return slice_cube(self.count_cube, filters or {})
+
+    def kpis(self, filters=None):
+        return cube_kpis(self.cube(filters))
+
+    def urgency_kpis(self, filters=None):
+        return urgency_kpis(self.cube(filters))
+
+    def counts(self, column, filters=None):
+        """Conteo de establecimientos por valor de una dimensión del cubo, de mayor a menor."""
+        cube = self.cube(filters)
+        if column not in cube.columns:
+            raise ValueError(f"Columna desconocida: {column}")
+        return cube_counts(cube, column)
+
+    def crosstab(self, index, columns, filters=None):
+        """Tabla de conteos entre dos dimensiones del cubo."""
+        cube = self.cube(filters)
+        for column in (index, columns):
+            if column not in cube.columns:
+                raise ValueError(f"Columna desconocida: {column}")
+        return crosstab_cube(cube, index, columns)
+
+    def series(self, filters=None):
+        """Sumas prefijas por año y complejidad (ver series_prefix_sums); None sin fechas."""
+        if self.series_cube is None:
+            return None
+        return series_prefix_sums(slice_cube(self.series_cube, filters or {}))
+
+    def openings(self, filters=None, first_year=None, last_year=None, cumulative=False):
+        """
+        Aperturas por año y nivel de complejidad (o acumuladas desde first_year).
+
+        Returns:
+            DataFrame con índice 'Año' y una columna por nivel; vacío si no hay fechas.
+        """
+        series = self.series(filters)
+        if series is None:
+            return pd.DataFrame(columns=COMPLEXITY_LEVELS, index=pd.Index([], name='Año'), dtype='int64')
+        values, _ = series_window(
+            series,
+            series['first_year'] if first_year is None else first_year,
+            series['last_year'] if last_year is None else last_year,
+            cumulative=cumulative,
+        )
+        return values
+
+    def coverage(self, filters=None):
+        """
+        Brechas de cobertura de urgencia por comuna (ver spatial.comuna_coverage).
+        Los filtros eligen los establecimientos de origen; la urgencia más
+        cercana se busca siempre entre todos los servicios del registro.
+        """
+        active = {col: values for col, values in (filters or {}).items() if len(values)}
+        if not active and self.coverage_table is not None:
+            return self.coverage_table
+        rows = resolve_filters(self.filter_index, active)
+        df = self.df if rows is None else self.df.iloc[rows]
+        if df.empty:
+            return pd.DataFrame()
+        distances = self.service_distances
+        if distances is not None and rows is not None:
+            distances = distances.iloc[rows]
+        return comuna_coverage(df, distances=distances)
+
+    def nearest(self, lat, lon, k=5, restrictions=None):
+        """Los k establecimientos más cercanos a un punto (ver spatial.nearest_facilities)."""
+        if self.facility_index is None:
+            raise ValueError("No hay coordenadas disponibles para la búsqueda.")
+        return nearest_facilities(self.facility_index, lat, lon, k=k, filters=restrictions)
+
+    def search(self, query, filters=None, limit=SEARCH_LIMIT):
+        """
+        Establecimientos cuyo nombre o comuna se parece a query, entre los que
+        cumplen los filtros (ver search.search_positions).
+
+        Returns:
+            DataFrame con las filas encontradas, de mayor a menor 'Puntaje'.
+        """
+        rows = resolve_filters(self.filter_index, filters or {})
+        positions, scores = search_positions(self.search_index, query, rows=rows, limit=limit)
+        result = self.df.iloc[positions].copy()
+        result['Puntaje'] = scores
+        return result
+
+
+def shared_dataset(path=DATA_PATH, columnar_path=COLUMNAR_DATA_PATH, coverage_path=COVERAGE_DATA_PATH, warm=False):
+    """
+    FacilityDataset único por proceso para estos archivos. Lo carga quien lo
+    pida primero (warmup.py al arrancar el servidor o la primera sesión); las
+    llamadas concurrentes esperan esa carga, y con warm=True también la
+    construcción de los índices, en vez de repetirla.
+
+    Si el directorio de datos tiene una versión publicada (shared_store.py),
+    el dataset y sus índices se mapean desde ella, compartidos con los demás
+    procesos del host, y cuando se publica otra versión la siguiente llamada
+    cambia a la nueva.
+    ValueError si los datos no se pueden cargar; OSError si no se puede
+    mapear la versión publicada.
+    """
+    # Imported here: shared_store builds on this module
+    from shared_store import SHARED_DIR, attach, current_version
+
+    shared_path = os.path.join(os.path.dirname(path), SHARED_DIR)
+    version = current_version(shared_path)
+    key = (path, columnar_path, coverage_path)
+    with _SHARED_DATASETS_LOCK:
+        if key not in _SHARED_DATASETS or _SHARED_DATASETS[key].version != version:
+            if version is not None:
+                try:
+                    _SHARED_DATASETS[key] = attach(shared_path, version, coverage_path)
+                except FileNotFoundError:
+                    # Pruned by a publish after ACTUAL was read: retry once with the version now in force
+                    version = current_version(shared_path)
+                    _SHARED_DATASETS[key] = attach(shared_path, version, coverage_path)
+            else:
+                _SHARED_DATASETS[key] = FacilityDataset.load(path, columnar_path, coverage_path)
+        if warm:
+            _SHARED_DATASETS[key].warm()
+        return _SHARED_DATASETS[key]
@@ -0,0 +1,122 @@
+import codecs
+import io
+import json
+
+import numpy as np
+import pandas as pd
+
+# Rows serialized per chunk; bounds the temporary memory of each format
+EXPORT_CHUNK_ROWS = 10000
+# Decimals of GeoJSON coordinates (~10 cm, RFC 7946 recommendation)
+GEOJSON_COORD_DECIMALS = 6
+
+# Export format -> (MIME type, file extension)
+EXPORT_FORMATS = {
+    "CSV": ("text/csv", ".csv"),
+    "Parquet": ("application/vnd.apache.parquet", ".parquet"),
+    "GeoJSON": ("application/geo+json", ".geojson"),
+}
+
+
+def iter_chunks(df, chunk_rows=EXPORT_CHUNK_ROWS):
+    """
+    Bloques consecutivos de a lo más chunk_rows filas.
+    """
+    for start in range(0, len(df), chunk_rows):
+        yield df.iloc[start:start + chunk_rows]
+
+
+def iter_csv(df, chunk_rows=EXPORT_CHUNK_ROWS):
+    """
+    CSV en UTF-8 con BOM (se abre bien en Excel), por bloques.
+    Los bloques concatenados son idénticos a df.to_csv(index=False).
+    """
+    yield codecs.BOM_UTF8
+    if df.empty:
+        yield df.to_csv(index=False).encode('utf-8')
+    for i, chunk in enumerate(iter_chunks(df, chunk_rows)):
+        yield chunk.to_csv(index=False, header=i == 0).encode('utf-8')
+
+
+def iter_parquet(df, chunk_rows=EXPORT_CHUNK_ROWS):
+    """
+    Parquet con un row group por bloque; entrega los bytes a medida que se escriben.
+    Requiere pyarrow.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    sink = io.BytesIO()
+    schema = pa.Schema.from_pandas(df, preserve_index=False)
+    with pq.ParquetWriter(sink, schema) as writer:
+        for chunk in iter_chunks(df, chunk_rows):
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+            yield sink.getvalue()
+            sink.seek(0)
+            sink.truncate()
+        if df.empty:
+            writer.write_table(schema.empty_table())
+    yield sink.getvalue()
+
+
+def iter_geojson(df, lat_col='Latitud', lon_col='Longitud', chunk_rows=EXPORT_CHUNK_ROWS):
+    """
+    FeatureCollection GeoJSON con un punto por fila (geometría nula si faltan
+    coordenadas); las demás columnas van como propiedades.
+    """
+    yield b'{"type":"FeatureCollection","features":['
+    first = True
+    for chunk in iter_chunks(df, chunk_rows):
+        lat = np.round(pd.to_numeric(chunk[lat_col], errors='coerce').to_numpy(dtype=float), GEOJSON_COORD_DECIMALS)
+        lon = np.round(pd.to_numeric(chunk[lon_col], errors='coerce').to_numpy(dtype=float), GEOJSON_COORD_DECIMALS)
+        properties = chunk.drop(columns=[lat_col, lon_col]).to_json(
+            orient='records', lines=True, date_format='iso', force_ascii=False
+        ).splitlines()
+
+        features = []
+        for y, x, props in zip(lat, lon, properties):
+            if np.isnan(y) or np.isnan(x):
+                geometry = 'null'
+            else:
+                geometry = f'{{"type":"Point","coordinates":[{json.dumps(float(x))},{json.dumps(float(y))}]}}'
+            features.append(f'{{"type":"Feature","geometry":{geometry},"properties":{props}}}')
+
+        yield (('' if first else ',') + ','.join(features)).encode('utf-8')
+        first = False
+    yield b']}'
+
+
+def iter_export(df, fmt, chunk_rows=EXPORT_CHUNK_ROWS):
+    """
+    Bloques de bytes del formato pedido (una clave de EXPORT_FORMATS).
+    """
+    if fmt == "CSV":
+        return iter_csv(df, chunk_rows)
+    if fmt == "Parquet":
+        return iter_parquet(df, chunk_rows)
+    if fmt == "GeoJSON":
+        return iter_geojson(df, chunk_rows=chunk_rows)
+    raise ValueError(f"Formato de exportación desconocido: {fmt}")
+
+
+def export_bytes(df, fmt, chunk_rows=EXPORT_CHUNK_ROWS):
+    """
+    Archivo completo en el formato pedido.
+    """
+    return b''.join(iter_export(df, fmt, chunk_rows))
+
+
+def available_formats(columns):
+    """
+    Formatos que se pueden generar: Parquet solo con pyarrow instalado y
+    GeoJSON solo si hay columnas Latitud/Longitud.
+    """
+    formats = ["CSV"]
+    try:
+        import pyarrow  # noqa: F401
+        formats.append("Parquet")
+    except ImportError:
+        pass
+    if 'Latitud' in columns and 'Longitud' in columns:
+        formats.append("GeoJSON")
+    return formats
@@ -0,0 +1,276 @@
+import json
+
+import threading
+import weakref
+
+import numpy as np
+import pandas as pd
+# folium is imported inside the layer builders: importing this module for its
+# constants or the spatial index does not load it
+
+from dataset import COL_COMUNA, COL_LAT, COL_LON, COL_NOMBRE, COL_REGION, COL_SISTEMA, COL_TIPO_ESTAB, classify_sistema
+
+SYSTEM_COLORS = {'Público': '#27ae60', 'Privado': '#c0392b', 'Otros': '#7f8c8d'}
+# Coordinates are shipped to the browser rounded to ~1 m
+MAP_COORD_DECIMALS = 5
+MAP_CENTER = [-35.5, -71.5]
+MAP_ZOOM = 5
+# Below MAP_DETAIL_ZOOM the map shows precomputed grid clusters; from it on, individual facilities
+MAP_DETAIL_ZOOM = 12
+# Aggregation cells are 1/2**MAP_CELL_SHIFT of a 256 px tile (~64 px on screen)
+MAP_CELL_SHIFT = 2
+# Facilities/clusters within the view plus this fraction of it on each side are sent
+MAP_BOUNDS_PADDING = 0.5
+# Zoom the map flies to for a facility picked in the search, and the half-size (degrees)
+# of the view assumed around it until the map reports its actual bounds
+MAP_FOCUS_ZOOM = 15
+MAP_FOCUS_SPAN = 0.02
+
+# Spatial indexes shared by every session, keyed by dataset (see shared_spatial_index);
+# the index of a dataset replaced by a newer published version goes away with it
+_SPATIAL_INDEXES = weakref.WeakKeyDictionary()
+_SPATIAL_INDEXES_LOCK = threading.Lock()
+
+
+def build_spatial_index(df):
+    # Web Mercator grid at MAP_DETAIL_ZOOM + MAP_CELL_SHIFT; the cell of a point at zoom z
+    # is (x, y) >> (MAP_DETAIL_ZOOM - z), so every zoom level is a bit shift of the same grid
+    lat = pd.to_numeric(df[COL_LAT], errors='coerce').to_numpy(dtype=float)
+    lon = pd.to_numeric(df[COL_LON], errors='coerce').to_numpy(dtype=float)
+    valid = ~(np.isnan(lat) | np.isnan(lon))
+
+    scale = 2 ** (MAP_DETAIL_ZOOM + MAP_CELL_SHIFT)
+    sin_lat = np.sin(np.radians(np.clip(np.nan_to_num(lat), -85.0511, 85.0511)))
+    x = (np.nan_to_num(lon) + 180) / 360 * scale
+    y = (0.5 - np.log((1 + sin_lat) / (1 - sin_lat)) / (4 * np.pi)) * scale
+
+    if COL_SISTEMA in df.columns:
+        sistema = df[COL_SISTEMA].map(classify_sistema)
+    else:
+        sistema = pd.Series('Otros', index=df.index)
+    sistema_codes = sistema.map({name: i for i, name in enumerate(SYSTEM_COLORS)}).to_numpy(dtype=np.int64)
+
+    spatial_index = {
+        'labels': df.index,
+        'valid': valid,
+        'x': np.clip(x, 0, scale - 1).astype(np.int64),
+        'y': np.clip(y, 0, scale - 1).astype(np.int64),
+        'lat': lat,
+        'lon': lon,
+        'sistema': sistema_codes,
+    }
+    # Clusters of the unfiltered data for every aggregated zoom level
+    all_rows = np.arange(len(df))
+    spatial_index['levels'] = {zoom: aggregate_cells(spatial_index, all_rows, zoom) for zoom in range(MAP_DETAIL_ZOOM)}
+    return spatial_index
+
+
+def shared_spatial_index(dataset):
+    """
+    Índice espacial único por proceso para un FacilityDataset, construido la
+    primera vez (por warmup.py al arrancar o por la primera sesión).
+    """
+    with _SPATIAL_INDEXES_LOCK:
+        if dataset not in _SPATIAL_INDEXES:
+            _SPATIAL_INDEXES[dataset] = build_spatial_index(dataset.df)
+        return _SPATIAL_INDEXES[dataset]
+
+
+def aggregate_cells(spatial_index, rows, zoom):
+    rows = rows[spatial_index['valid'][rows]]
+    shift = MAP_DETAIL_ZOOM - zoom
+    keys = (spatial_index['x'][rows] >> shift) << 32 | (spatial_index['y'][rows] >> shift)
+    cells, inverse = np.unique(keys, return_inverse=True)
+
+    n_classes = len(SYSTEM_COLORS)
+    counts = np.bincount(
+        inverse * n_classes + spatial_index['sistema'][rows], minlength=len(cells) * n_classes
+    ).reshape(-1, n_classes)
+    total = counts.sum(axis=1)
+    result = pd.DataFrame({
+        COL_LAT: np.bincount(inverse, weights=spatial_index['lat'][rows], minlength=len(cells)) / np.maximum(total, 1),
+        COL_LON: np.bincount(inverse, weights=spatial_index['lon'][rows], minlength=len(cells)) / np.maximum(total, 1),
+        'total': total,
+    })
+    for i, name in enumerate(SYSTEM_COLORS):
+        result[name] = counts[:, i]
+    return result
+
+
+def within_bounds(data, bounds):
+    # Leaflet bounds as returned by st_folium, padded by MAP_BOUNDS_PADDING on each side
+    south_west, north_east = (bounds or {}).get('_southWest'), (bounds or {}).get('_northEast')
+    if not south_west or not north_east or south_west.get('lat') is None or north_east.get('lat') is None:
+        return data
+    pad_lat = (north_east['lat'] - south_west['lat']) * MAP_BOUNDS_PADDING
+    pad_lon = (north_east['lng'] - south_west['lng']) * MAP_BOUNDS_PADDING
+    lat, lon = data[COL_LAT].astype(float), data[COL_LON].astype(float)
+    inside = (
+        lat.between(south_west['lat'] - pad_lat, north_east['lat'] + pad_lat)
+        & lon.between(south_west['lng'] - pad_lon, north_east['lng'] + pad_lon)
+    )
+    return data[inside]
+
+
+def facility_marker_layer(map_data_valid):
+    from folium.plugins import FastMarkerCluster
+
+    if COL_SISTEMA in map_data_valid.columns:
+        map_data_valid = map_data_valid.assign(_sistema=map_data_valid[COL_SISTEMA].map(classify_sistema))
+    else:
+        map_data_valid = map_data_valid.assign(_sistema='Otros')
+
+    # Tooltip lines, dictionary-encoded: one lookup table per line, one index per row
+    tooltip_parts = []
+    if COL_NOMBRE in map_data_valid.columns:
+        tooltip_parts.append('<b>' + map_data_valid[COL_NOMBRE].astype(str) + '</b>')
+    if COL_TIPO_ESTAB in map_data_valid.columns:
+        tooltip_parts.append(map_data_valid[COL_TIPO_ESTAB].astype(str))
+    if COL_COMUNA in map_data_valid.columns and COL_REGION in map_data_valid.columns:
+        tooltip_parts.append(map_data_valid[COL_COMUNA].astype(str) + ', ' + map_data_valid[COL_REGION].astype(str))
+    tooltip_codes, tooltip_tables = [], []
+    for part in tooltip_parts:
+        codes, uniques = pd.factorize(part)
+        tooltip_codes.append(codes.tolist())
+        tooltip_tables.append(uniques.tolist())
+
+    # Compact rows [lat, lon, color index, tooltip indices...]; markers are created in the browser
+    palette = list(SYSTEM_COLORS.values())
+    color_codes = map_data_valid['_sistema'].map({name: i for i, name in enumerate(SYSTEM_COLORS)})
+    rows = [
+        list(row) for row in zip(
+            map_data_valid[COL_LAT].astype(float).round(MAP_COORD_DECIMALS).tolist(),
+            map_data_valid[COL_LON].astype(float).round(MAP_COORD_DECIMALS).tolist(),
+            color_codes.astype(int).tolist(),
+            *tooltip_codes,
+        )
+    ]
+
+    # Same CircleMarker styling as before, built client-side from each row
+    callback = f"""(function () {{
+        var palette = {json.dumps(palette)};
+        var tooltips = {json.dumps(tooltip_tables, ensure_ascii=False)};
+        return function (row) {{
+            var marker = L.circleMarker(new L.LatLng(row[0], row[1]), {{
+                radius: 7, color: 'white', weight: 1.5,
+                fill: true, fillColor: palette[row[2]], fillOpacity: 0.85
+            }});
+            if (tooltips.length) {{
+                marker.bindTooltip(tooltips.map(function (table, k) {{ return table[row[3 + k]]; }}).join('<br>'));
+            }}
+            return marker;
+        }};
+    }})()"""
+
+    # Leaflet.markercluster styling (green→yellow→orange→red), clustered in the browser
+    return FastMarkerCluster(
+        rows,
+        callback=callback,
+        options={
+            'maxClusterRadius': 50,
+            'spiderfyOnMaxZoom': True,
+            'showCoverageOnHover': True,
+            'zoomToBoundsOnClick': True,
+        },
+    )
+
+
+def focus_bounds(lat, lon, span=MAP_FOCUS_SPAN):
+    # Leaflet-style bounds around a point, in the format within_bounds() expects
+    return {
+        '_southWest': {'lat': lat - span, 'lng': lon - span},
+        '_northEast': {'lat': lat + span, 'lng': lon + span},
+    }
+
+
+def focus_marker(lat, lon, label):
+    import folium
+
+    return folium.Marker(
+        location=[lat, lon], tooltip=label, icon=folium.Icon(color='blue', icon='plus-sign'),
+    )
+
+
+def cell_cluster_layer(cells):
+    # One marker per grid cell: size by count, ring split by sistema share
+    import folium
+
+    layer = folium.FeatureGroup(name='Clusters')
+    for cell in cells.itertuples(index=False):
+        cell = cell._asdict()
+        total = cell['total']
+        stops, start = [], 0.0
+        for name, color in SYSTEM_COLORS.items():
+            end = start + 100 * cell[name] / total
+            stops.append(f"{color} {start:.1f}% {end:.1f}%")
+            start = end
+        size = int(26 + 6 * np.log10(total))
+        html = (
+            f'<div style="width:{size}px;height:{size}px;border-radius:50%;'
+            f'background:conic-gradient({",".join(stops)});border:2px solid white;'
+            'box-shadow:0 0 3px rgba(0,0,0,0.4);display:flex;align-items:center;justify-content:center;'
+            'font:600 12px Roboto,sans-serif;color:white;text-shadow:0 0 2px rgba(0,0,0,0.7);">'
+            f'{total:,}</div>'
+        )
+        tooltip = f"<b>{total:,} establecimientos</b><br>" + '<br>'.join(
+            f"{name}: {cell[name]:,}" for name in SYSTEM_COLORS if cell[name]
+        )
+        folium.Marker(
+            location=[cell[COL_LAT], cell[COL_LON]],
+            icon=folium.DivIcon(html=html, icon_size=(size, size), icon_anchor=(size // 2, size // 2)),
+            tooltip=tooltip,
+        ).add_to(layer)
+    return layer
+
+
+def data_layer(map_data, map_data_valid, spatial_index, zoom, bounds=None):
+    # Grid clusters below MAP_DETAIL_ZOOM (precomputed for the unfiltered data), individual
+    # facilities from it on; either way only what falls around the current view
+    import folium
+
+    layer = folium.FeatureGroup(name='Establecimientos')
+    if spatial_index is None or zoom >= MAP_DETAIL_ZOOM:
+        facility_marker_layer(within_bounds(map_data_valid, bounds)).add_to(layer)
+    else:
+        if len(map_data) == len(spatial_index['labels']):
+            cells = spatial_index['levels'][zoom]
+        else:
+            rows = spatial_index['labels'].get_indexer(map_data.index)
+            cells = aggregate_cells(spatial_index, rows, zoom)
+        cell_cluster_layer(within_bounds(cells, bounds)).add_to(layer)
+    return layer
+
+
+def base_map():
+    import folium
+    from folium.plugins import MarkerCluster
+
+    m = folium.Map(
+        location=MAP_CENTER,
+        zoom_start=MAP_ZOOM,
+        tiles='OpenStreetMap',
+        control_scale=True,
+    )
+    # Empty cluster so the base map loads Leaflet.markercluster; the data layer is swapped in later
+    MarkerCluster(control=False).add_to(m)
+
+    # Floating legend on the map
+    legend_html = '''
+    <div style="position:fixed;bottom:30px;right:30px;z-index:1000;
+        background:white;padding:10px 15px;border-radius:8px;
+        box-shadow:0 2px 10px rgba(0,0,0,0.15);font-size:13px;
+        font-family:Roboto,sans-serif;line-height:1.8;">
+        <b>Sistema de Salud</b><br>
+        <span style="display:inline-block;width:11px;height:11px;border-radius:50%;
+            background:#27ae60;border:1.5px solid white;box-shadow:0 0 2px rgba(0,0,0,0.3);
+            vertical-align:middle;margin-right:5px;"></span>Público<br>
+        <span style="display:inline-block;width:11px;height:11px;border-radius:50%;
+            background:#c0392b;border:1.5px solid white;box-shadow:0 0 2px rgba(0,0,0,0.3);
+            vertical-align:middle;margin-right:5px;"></span>Privado<br>
+        <span style="display:inline-block;width:11px;height:11px;border-radius:50%;
+            background:#7f8c8d;border:1.5px solid white;box-shadow:0 0 2px rgba(0,0,0,0.3);
+            vertical-align:middle;margin-right:5px;"></span>Otros
+    </div>
+    '''
+    m.get_root().html.add_child(folium.Element(legend_html))
+    return m
@@ -0,0 +1,293 @@
+import json
+import math
+import os
+import threading
+import time
+import tracemalloc
+import weakref
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+# APP_PROFILE=1 shows the debug panel for every session and traces memory; ?debug=1 shows the
+# panel for one session, timings only (tracemalloc slows down the whole process)
+PROFILE_ENV = 'APP_PROFILE'
+# Path of a JSON Lines file receiving one record per rerun
+PROFILE_LOG_ENV = 'APP_PROFILE_LOG'
+# Path of a Prometheus text file (node_exporter textfile collector) rewritten after each rerun
+PROFILE_METRICS_ENV = 'APP_PROFILE_METRICS'
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Records kept per profiler for the debug panel
+HISTORY_SIZE = 200
+
+# Profilers with memory tracing on; tracemalloc is stopped when the last one goes away
+_memory_users = set()
+_memory_lock = threading.Lock()
+_memory_owned = False
+
+
+def env_flag(name):
+    return os.environ.get(name, '').strip().lower() in ('1', 'true', 'si', 'sí', 'yes')
+
+
+def sinks_requested():
+    return bool(os.environ.get(PROFILE_LOG_ENV) or os.environ.get(PROFILE_METRICS_ENV))
+
+
+def acquire_memory_tracing(user):
+    global _memory_owned
+    with _memory_lock:
+        if not _memory_users and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _memory_owned = True
+        _memory_users.add(user)
+
+
+def release_memory_tracing(user):
+    # Tracing started outside this module (python -X tracemalloc) is left running
+    global _memory_owned
+    with _memory_lock:
+        _memory_users.discard(user)
+        if not _memory_users and _memory_owned:
+            tracemalloc.stop()
+            _memory_owned = False
+
+
+def append_json_log(path, record, lock=threading.Lock()):
+    """
+    Agrega un registro como una línea JSON al final de path.
+    """
+    line = json.dumps(record, ensure_ascii=False, default=str)
+    with lock, open(path, 'a', encoding='utf-8') as f:
+        f.write(line + '\n')
+
+
+def percentile(values, q):
+    """
+    Percentil q (0-100) por rango más cercano; None si no hay valores.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(math.ceil(q / 100 * len(ordered)) - 1, 0)]
+
+
+def prometheus_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class SpanMetrics:
+    """
+    Histogramas de latencia por tipo de registro (rerun, fragmento, exportación)
+    y por sección, acumulados en el proceso y exportables en formato de texto
+    de Prometheus. Seguro entre hilos.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        self.histograms = {'app_rerun_seconds': {}, 'app_span_seconds': {}}
+
+    def observe(self, record):
+        with self.lock:
+            self._observe('app_rerun_seconds', ('kind', record['kind']), record['total_ms'] / 1e3)
+            for span in record['spans']:
+                self._observe('app_span_seconds', ('span', span['name']), span['ms'] / 1e3)
+
+    def _observe(self, metric, label, seconds):
+        histogram = self.histograms[metric].setdefault(label, {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0})
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                histogram['counts'][i] += 1
+        histogram['sum'] += seconds
+        histogram['count'] += 1
+
+    def prometheus_text(self):
+        """
+        Histogramas en el formato de exposición de texto de Prometheus.
+        """
+        help_text = {
+            'app_rerun_seconds': "Duración total de cada ejecución de streamlit_app.py, por tipo.",
+            'app_span_seconds': "Duración de cada sección instrumentada de streamlit_app.py.",
+        }
+        lines = []
+        with self.lock:
+            for metric, histograms in self.histograms.items():
+                lines += [f'# HELP {metric} {help_text[metric]}', f'# TYPE {metric} histogram']
+                for (label, value), histogram in sorted(histograms.items()):
+                    selector = f'{label}="{prometheus_label(value)}"'
+                    for bound, count in zip(self.buckets, histogram['counts']):
+                        lines.append(f'{metric}_bucket{{{selector},le="{bound}"}} {count}')
+                    lines.append(f'{metric}_bucket{{{selector},le="+Inf"}} {histogram["count"]}')
+                    lines.append(f'{metric}_sum{{{selector}}} {histogram["sum"]:.6f}')
+                    lines.append(f'{metric}_count{{{selector}}} {histogram["count"]}')
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, path):
+        # Written to a temporary file and renamed, so a scraper never reads half a file
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp_path, path)
+
+
+class RerunProfiler:
+    """
+    Mide tiempo y memoria de las secciones de una ejecución del script.
+
+    start() abre el registro de la ejecución, section() cierra la sección
+    anterior y abre la siguiente, span() mide un bloque anidado y finish()
+    cierra el registro, lo guarda en history y lo entrega a los sinks
+    (funciones que reciben el registro). Un span() sin registro abierto en
+    el hilo actual (p. ej. el rerun de un fragmento o una descarga diferida)
+    forma su propio registro con su nombre como tipo.
+
+    Con enabled=False todo es un no-op. Con memory=True se activa tracemalloc
+    y cada span registra su pico de memoria sobre la del inicio. tracemalloc
+    es global al proceso: el pico incluye lo que asignan en paralelo las demás
+    sesiones y cada span de cualquier sesión reinicia el pico de todas, así que
+    con ejecuciones concurrentes los valores son aproximados. El trazado se
+    detiene cuando ningún profiler lo usa (configure(memory=False) o el
+    profiler se libera al terminar su sesión).
+    """
+
+    def __init__(self, sinks=(), history_size=HISTORY_SIZE):
+        self.sinks = list(sinks)
+        self.history = deque(maxlen=history_size)
+        self.enabled = False
+        self.memory = False
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        # Releases the tracing also when the session state holding the profiler is dropped
+        weakref.finalize(self, release_memory_tracing, id(self))
+
+    def configure(self, enabled, memory=False):
+        memory = enabled and memory
+        if memory and not self.memory:
+            acquire_memory_tracing(id(self))
+        elif self.memory and not memory:
+            release_memory_tracing(id(self))
+        self.enabled = enabled
+        self.memory = memory
+        return self
+
+    def start(self, kind='rerun', **labels):
+        self.local.record = None
+        if not self.enabled:
+            return
+        self.local.record = {
+            'timestamp': datetime.now().isoformat(timespec='milliseconds'),
+            'kind': kind,
+            'labels': labels,
+            'spans': [],
+        }
+        self.local.started = time.perf_counter()
+        self.local.stack = []
+
+    def label(self, **labels):
+        record = getattr(self.local, 'record', None)
+        if record is not None:
+            record['labels'].update(labels)
+
+    def section(self, name):
+        """
+        Cierra la sección de primer nivel en curso y abre name.
+        """
+        if getattr(self.local, 'record', None) is None:
+            return
+        while self.local.stack:
+            self._exit()
+        self._enter(name)
+
+    @contextmanager
+    def span(self, name):
+        if not self.enabled:
+            yield
+            return
+        standalone = getattr(self.local, 'record', None) is None
+        if standalone:
+            self.start(name)
+        self._enter(name)
+        try:
+            yield
+        finally:
+            self._exit()
+            if standalone:
+                self.finish()
+
+    def finish(self):
+        record = getattr(self.local, 'record', None)
+        if record is None:
+            return None
+        while self.local.stack:
+            self._exit()
+        record['total_ms'] = round((time.perf_counter() - self.local.started) * 1e3, 3)
+        self.local.record = None
+        with self.lock:
+            self.history.append(record)
+        for sink in self.sinks:
+            sink(record)
+        return record
+
+    def _enter(self, name):
+        stack = self.local.stack
+        entry = {'name': name, 'depth': len(stack), 'started': time.perf_counter()}
+        if self.memory and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            if stack:
+                stack[-1]['peak'] = max(stack[-1]['peak'], peak)
+            tracemalloc.reset_peak()
+            entry['memory'] = current
+            entry['peak'] = current
+        stack.append(entry)
+        self.local.record['spans'].append(entry)
+
+    def _exit(self):
+        stack = self.local.stack
+        entry = stack.pop()
+        entry['ms'] = round((time.perf_counter() - entry.pop('started')) * 1e3, 3)
+        if 'memory' in entry and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            peak = max(entry.pop('peak'), peak)
+            if stack:
+                stack[-1]['peak'] = max(stack[-1]['peak'], peak)
+            start = entry.pop('memory')
+            entry['alloc_mb'] = round((current - start) / 2 ** 20, 3)
+            entry['peak_mb'] = round((peak - start) / 2 ** 20, 3)
+
+    def recent(self, kind=None):
+        with self.lock:
+            return [record for record in self.history if kind is None or record['kind'] == kind]
+
+    def summary(self, kind='rerun'):
+        """
+        Por sección: ejecuciones, p50, p95 y máximo en ms sobre el historial.
+        """
+        durations = {}
+        for record in self.recent(kind):
+            for span in record['spans']:
+                durations.setdefault(span['name'], []).append(span['ms'])
+        return [
+            {'name': name, 'n': len(values), 'p50_ms': percentile(values, 50),
+             'p95_ms': percentile(values, 95), 'max_ms': max(values)}
+            for name, values in durations.items()
+        ]
+
+
+def configured_sinks(metrics=None, log_path=None, metrics_path=None):
+    """
+    Sinks según el entorno: log JSON (APP_PROFILE_LOG) y, si se entrega
+    metrics, histogramas (y archivo de texto en APP_PROFILE_METRICS).
+    """
+    log_path = log_path or os.environ.get(PROFILE_LOG_ENV)
+    metrics_path = metrics_path or os.environ.get(PROFILE_METRICS_ENV)
+    sinks = []
+    if log_path:
+        sinks.append(lambda record: append_json_log(log_path, record))
+    if metrics is not None:
+        sinks.append(metrics.observe)
+        if metrics_path:
+            sinks.append(lambda record: metrics.write_textfile(metrics_path))
+    return sinks
@@ -0,0 +1,199 @@
+import argparse
+import json
+import sys
+
+import numpy as np
+import pandas as pd
+
+from clean_data import DATE_FORMAT, KEY_COLUMN
+
+# Bounding boxes (lat min, lat max, lon min, lon max) of continental Chile and its inhabited islands
+CHILE_BOUNDS = {
+    "Continental": (-56.0, -17.4, -76.0, -66.3),
+    "Rapa Nui": (-27.3, -27.0, -109.5, -109.2),
+    "Juan Fernández": (-34.0, -33.5, -81.0, -78.7),
+}
+# TipoUrgencia values meaning "no urgency service" (same exclusions as dataset.build_count_cube)
+NO_URGENCY_TYPES = frozenset(['No Aplica', 'SIN DATO'])
+# Row ids listed per rule in the printed summary (the JSON report has all of them)
+SUMMARY_IDS = 5
+
+
+def value_mask(series, predicate, missing=False):
+    """
+    Evalúa predicate (vectorizado, sobre una Series) solo en los valores
+    distintos de la columna y lo expande a una máscara por fila.
+
+    Args:
+        missing (bool): resultado para los valores faltantes.
+    """
+    codes, uniques = pd.factorize(series)
+    flags = np.append(np.asarray(predicate(pd.Series(uniques, dtype=object)), dtype=bool), missing)
+    return flags[codes]
+
+
+def inside_chile(lat, lon):
+    inside = np.zeros(len(lat), dtype=bool)
+    for lat_min, lat_max, lon_min, lon_max in CHILE_BOUNDS.values():
+        inside |= (lat >= lat_min) & (lat <= lat_max) & (lon >= lon_min) & (lon <= lon_max)
+    return inside
+
+
+def rule_inputs(df):
+    """
+    Columnas que usan las reglas, convertidas una sola vez para todo el frame.
+    """
+    lat = pd.to_numeric(df['Latitud'], errors='coerce').to_numpy(dtype=float)
+    lon = pd.to_numeric(df['Longitud'], errors='coerce').to_numpy(dtype=float)
+    located = ~(np.isnan(lat) | np.isnan(lon))
+    dates = df['FechaInicioFuncionamientoEstab']
+    if pd.api.types.is_datetime64_any_dtype(dates):
+        # Typed artifact: the text was already parsed (unparseable values became NaT)
+        date_invalid = np.zeros(len(df), dtype=bool)
+    else:
+        date_invalid = value_mask(dates, lambda values: values.astype(str).str.strip().ne('') &
+                                  pd.to_datetime(values, format=DATE_FORMAT, errors='coerce').isna())
+    return {
+        'located': located,
+        'inside': located & inside_chile(lat, lon),
+        'inside_swapped': located & inside_chile(lon, lat),
+        'date_invalid': date_invalid,
+        'urgency_type': value_mask(df['TipoUrgencia'], lambda values: ~values.isin(NO_URGENCY_TYPES)),
+        'urgency_flag': value_mask(df['TieneServicioUrgencia'], lambda values: values.eq('SI')),
+    }
+
+
+# Rule name -> (description, violating rows as a vectorized expression over rule_inputs)
+QUALITY_RULES = {
+    'coordenadas_fuera_de_chile': (
+        "Latitud/Longitud fuera de Chile continental, Rapa Nui y Juan Fernández",
+        lambda c: c['located'] & ~c['inside'] & ~c['inside_swapped'],
+    ),
+    'coordenadas_invertidas': (
+        "Latitud y Longitud intercambiadas (quedan dentro de Chile al invertirlas)",
+        lambda c: c['located'] & ~c['inside'] & c['inside_swapped'],
+    ),
+    'fecha_inicio_invalida': (
+        f"FechaInicioFuncionamientoEstab presente pero no es una fecha {DATE_FORMAT}",
+        lambda c: c['date_invalid'],
+    ),
+    'urgencia_inconsistente': (
+        "TipoUrgencia indica un servicio de urgencia y TieneServicioUrgencia no es SI, o al revés",
+        lambda c: c['urgency_type'] != c['urgency_flag'],
+    ),
+}
+
+
+def validate(df, rules=QUALITY_RULES):
+    """
+    Evalúa cada regla sobre el frame completo (CSV limpio o artefacto tipado).
+
+    Returns:
+        dict serializable a JSON: filas evaluadas y, por regla, descripción,
+        cantidad y fracción de violaciones e ids de las filas (EstablecimientoCodigo,
+        o la posición si el frame no lo tiene).
+    """
+    inputs = rule_inputs(df)
+    # Ids are looked up only for the violating rows
+    ids = df[KEY_COLUMN] if KEY_COLUMN in df.columns else pd.Series(np.arange(len(df)))
+    report = {'filas': len(df), 'reglas': {}}
+    for name, (description, rule) in rules.items():
+        violations = np.flatnonzero(rule(inputs))
+        report['reglas'][name] = {
+            'descripcion': description,
+            'violaciones': len(violations),
+            'fraccion': len(violations) / len(df) if len(df) else 0.0,
+            'filas': ids.take(violations).tolist(),
+        }
+    return report
+
+
+def merge_reports(reports, rules=QUALITY_RULES):
+    """
+    Reporte de validate del frame completo a partir de los reportes de sus
+    bloques consecutivos (la limpieza por bloques valida cada uno al escribirlo).
+    Los ids son EstablecimientoCodigo: las posiciones se reinician en cada bloque.
+    """
+    rows = sum(report['filas'] for report in reports)
+    merged = {'filas': rows, 'reglas': {}}
+    for name, (description, _) in rules.items():
+        ids = [row for report in reports for row in report['reglas'][name]['filas']]
+        merged['reglas'][name] = {
+            'descripcion': description,
+            'violaciones': len(ids),
+            'fraccion': len(ids) / rows if rows else 0.0,
+            'filas': ids,
+        }
+    return merged
+
+
+def failed_rules(report, max_fraction):
+    """
+    Reglas cuya fracción de filas con violaciones supera max_fraction.
+    """
+    return [name for name, result in report['reglas'].items() if result['fraccion'] > max_fraction]
+
+
+def save_report(report, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+def check_quality(df, report_file=None, max_fraction=None):
+    """
+    Valida df, imprime el resumen por regla y guarda el reporte JSON si se indica.
+
+    Args:
+        max_fraction (float): umbral de fracción de violaciones por regla; None = solo reportar.
+
+    Returns:
+        (reporte, lista de reglas sobre el umbral)
+    """
+    return check_report(validate(df), report_file, max_fraction)
+
+
+def check_report(report, report_file=None, max_fraction=None):
+    """
+    Igual que check_quality, sobre un reporte ya calculado (p. ej. con merge_reports).
+    """
+    failed = failed_rules(report, max_fraction) if max_fraction is not None else []
+    report['umbral'] = max_fraction
+    report['aprobado'] = not failed
+
+    print(f"\nValidación de calidad ({report['filas']} filas):")
+    for name, result in report['reglas'].items():
+        ids = ', '.join(str(row) for row in result['filas'][:SUMMARY_IDS])
+        more = '...' if result['violaciones'] > SUMMARY_IDS else ''
+        print(f"  {name}: {result['violaciones']}" + (f" ({ids}{more})" if ids else ''))
+    if report_file:
+        save_report(report, report_file)
+        print(f"Reporte de calidad guardado en {report_file}")
+    if failed:
+        print(f"Reglas sobre el umbral de {max_fraction:.2%}: {', '.join(failed)}")
+    return report, failed
+
+
+def read_frame(path):
+    if path.endswith('.parquet'):
+        return pd.read_parquet(path)
+    return pd.read_csv(path, sep=';', encoding='utf-8', dtype={KEY_COLUMN: str, 'FechaInicioFuncionamientoEstab': str})
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Validación de calidad del registro limpio de establecimientos.")
+    parser.add_argument('input_file', nargs='?', default='data/establecimientos_cleaned.csv',
+                        help="CSV o Parquet limpio (default: %(default)s)")
+    parser.add_argument('--output', help="Reporte JSON (default: en pantalla)")
+    parser.add_argument('--max-violations', type=float,
+                        help="Fracción máxima de filas con violaciones por regla; sobre ella termina con código 1")
+    args = parser.parse_args(argv)
+
+    report, failed = check_quality(read_frame(args.input_file), args.output, args.max_violations)
+    if not args.output:
+        print(json.dumps(report, ensure_ascii=False))
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
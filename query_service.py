@@ -0,0 +1,162 @@
+import argparse
+import json
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from dataset import (
+    COLUMNAR_DATA_PATH, COVERAGE_DATA_PATH, COL_PLAZA_EDF, DATA_PATH, FILTER_COLUMNS, FacilityDataset,
+)
+from export import EXPORT_FORMATS, export_bytes
+from spatial import KNN_FILTER_COLUMNS
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+
+# GET routes answered with JSON by run_query(); /export returns a file
+QUERY_ROUTES = ('/health', '/options', '/kpis', '/urgency', '/counts', '/crosstab', '/series', '/coverage', '/nearest', '/search')
+
+
+def parse_filters(query, columns=FILTER_COLUMNS):
+    """
+    Filtros {columna: [valores]} desde los parámetros de la URL
+    (?RegionGlosa=A&RegionGlosa=B); PlazaEDF acepta true/false.
+    """
+    filters = {}
+    for col in columns:
+        values = query.get(col, [])
+        if col == COL_PLAZA_EDF:
+            values = [value.lower() in ('1', 'true', 'si', 'sí') for value in values]
+        filters[col] = values
+    return filters
+
+
+def first_value(query, name, default=None, cast=str):
+    values = query.get(name)
+    if not values:
+        if default is None:
+            raise ValueError(f"Falta el parámetro '{name}'")
+        return default
+    try:
+        return cast(values[0])
+    except ValueError:
+        raise ValueError(f"Valor inválido para '{name}': {values[0]}")
+
+
+def frame_records(df):
+    # NaN -> null and dates as ISO strings, via pandas' own JSON writer
+    return json.loads(df.to_json(orient='records', force_ascii=False, date_format='iso'))
+
+
+def run_query(dataset, path, query):
+    """
+    Resuelve una ruta de QUERY_ROUTES sobre el dataset.
+
+    Returns:
+        objeto serializable a JSON. ValueError si faltan parámetros o son inválidos.
+    """
+    filters = parse_filters(query)
+
+    if path == '/health':
+        return {'rows': len(dataset.df)}
+    if path == '/options':
+        return dataset.options()
+    if path == '/kpis':
+        return dataset.kpis(filters)
+    if path == '/urgency':
+        return dataset.urgency_kpis(filters)
+    if path == '/counts':
+        counts = dataset.counts(first_value(query, 'column'), filters)
+        return [{'value': value, 'n': int(n)} for value, n in counts.items()]
+    if path == '/crosstab':
+        table = dataset.crosstab(first_value(query, 'index'), first_value(query, 'columns'), filters)
+        return {str(index): {str(col): int(n) for col, n in row.items()} for index, row in table.iterrows()}
+    if path == '/series':
+        cumulative = first_value(query, 'cumulative', 'false').lower() in ('1', 'true')
+        first_year = first_value(query, 'from', 0, int) or None
+        last_year = first_value(query, 'to', 0, int) or None
+        values = dataset.openings(filters, first_year, last_year, cumulative=cumulative)
+        return {'years': values.index.tolist(), 'levels': {col: values[col].tolist() for col in values.columns}}
+    if path == '/coverage':
+        coverage = dataset.coverage(filters)
+        limit = first_value(query, 'limit', 0, int)
+        return frame_records(coverage.head(limit) if limit else coverage)
+    if path == '/nearest':
+        restrictions = {col: query.get(col, []) for col in KNN_FILTER_COLUMNS}
+        nearest = dataset.nearest(
+            first_value(query, 'lat', cast=float), first_value(query, 'lon', cast=float),
+            k=first_value(query, 'k', 5, int), restrictions=restrictions,
+        )
+        return frame_records(nearest)
+    if path == '/search':
+        return frame_records(dataset.search(first_value(query, 'q'), filters, limit=first_value(query, 'limit', 10, int)))
+    raise ValueError(f"Ruta desconocida: {path}")
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    # The dataset is shared by all request threads (see FacilityDataset.warm)
+    dataset = None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        try:
+            if url.path == '/export':
+                fmt = first_value(query, 'format', 'CSV')
+                if fmt not in EXPORT_FORMATS:
+                    raise ValueError(f"Formato de exportación desconocido: {fmt}")
+                mime, extension = EXPORT_FORMATS[fmt]
+                body = export_bytes(self.dataset.filter(parse_filters(query)), fmt)
+                self.send_body(200, body, mime, f'establecimientos_salud_filtrados{extension}')
+                return
+            if url.path not in QUERY_ROUTES:
+                self.send_json(404, {'error': f"Ruta desconocida: {url.path}"})
+                return
+            result = run_query(self.dataset, url.path, query)
+        except ValueError as e:
+            self.send_json(400, {'error': str(e)})
+            return
+        self.send_json(200, result)
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_body(status, body, 'application/json; charset=utf-8')
+
+    def send_body(self, status, body, content_type, file_name=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        if file_name:
+            self.send_header('Content-Disposition', f'attachment; filename="{file_name}"')
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def serve(dataset, host=DEFAULT_HOST, port=DEFAULT_PORT):
+    """
+    Atiende la API JSON sobre un dataset ya cargado hasta que se interrumpa.
+    """
+    handler = type('BoundQueryHandler', (QueryHandler,), {'dataset': dataset.warm()})
+    server = ThreadingHTTPServer((host, port), handler)
+    print(f"Sirviendo {len(dataset.df):,} establecimientos en http://{host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Servicio HTTP/JSON de consultas sobre el registro de establecimientos.")
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--data', default=DATA_PATH, help="CSV limpio (default: %(default)s)")
+    parser.add_argument('--columnar', default=COLUMNAR_DATA_PATH, help="Parquet limpio (default: %(default)s)")
+    parser.add_argument('--coverage', default=COVERAGE_DATA_PATH, help="Tabla de cobertura (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    serve(FacilityDataset.load(args.data, args.columnar, args.coverage), args.host, args.port)
+
+
+if __name__ == "__main__":
+    main()
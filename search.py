@@ -0,0 +1,142 @@
+import sys
+import unicodedata
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from clean_data import WHITESPACE_RE, norm_match
+
+# Padding before the text so word starts have their own trigrams ("  H", " HO")
+SEARCH_PAD = '  '
+# Byte that separates documents in the trigram buffer (never part of a folded name)
+DOC_SEPARATOR = ord('\n')
+# Share of the query trigrams a document must contain to be returned
+MIN_COVERAGE = 0.5
+# Weight of query coverage against Dice similarity in the ranking score
+COVERAGE_WEIGHT = 0.75
+SEARCH_LIMIT = 10
+
+
+@lru_cache(maxsize=None)
+def combining_marks():
+    # str.translate table deleting every nonspacing mark (what norm_match filters out)
+    return {cp: None for cp in range(sys.maxunicode + 1) if unicodedata.category(chr(cp)) == 'Mn'}
+
+
+def fold_text(values):
+    """
+    Mismo resultado que norm_match (mayúsculas, sin acentos, espacios simples),
+    con métodos de texto vectorizados sobre los valores distintos.
+    """
+    codes, uniques = pd.factorize(pd.Series(values, dtype=object).fillna(''))
+    folded = (
+        pd.Series(uniques, dtype=object).astype(str).str.upper().str.strip()
+        .str.normalize('NFD').str.translate(combining_marks())
+        .str.replace(WHITESPACE_RE, ' ', regex=True)
+    )
+    return folded.to_numpy(dtype=object)[codes] if len(codes) else np.array([], dtype=object)
+
+
+def text_trigrams(texts):
+    """
+    Trigramas (enteros de 24 bits) de cada texto, sin cruzar de un texto a otro.
+
+    Returns:
+        (trigramas, índice del texto de cada trigrama).
+    """
+    texts = [SEARCH_PAD + text for text in texts]
+    buffer = np.frombuffer(('\n'.join(texts) + '\n').encode('ascii', 'replace'), dtype=np.uint8)
+    owner = np.repeat(np.arange(len(texts), dtype=np.int64), [len(text) + 1 for text in texts])
+    if len(buffer) < 3:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    first, second, third = buffer[:-2], buffer[1:-1], buffer[2:]
+    inside = (first != DOC_SEPARATOR) & (second != DOC_SEPARATOR) & (third != DOC_SEPARATOR)
+    trigrams = (first.astype(np.int64) << 16) | (second.astype(np.int64) << 8) | third
+    return trigrams[inside], owner[:-2][inside]
+
+
+def build_search_index(df, name_col='EstablecimientoGlosa', comuna_col='ComunaGlosa'):
+    """
+    Índice de trigramas sobre nombre y comuna, normalizados como norm_match.
+
+    Las filas con el mismo texto comparten documento, y cada trigrama guarda
+    la lista ordenada de documentos que lo contienen (arreglos planos, sin
+    objetos por fila), así que una consulta solo recorre las listas de sus
+    propios trigramas.
+
+    Returns:
+        dict con el documento de cada fila, los trigramas ordenados, el inicio
+        de la lista de cada trigrama, las listas concatenadas y la cantidad de
+        trigramas distintos de cada documento.
+    """
+    text = fold_text(df[name_col]) if name_col in df.columns else np.full(len(df), '', dtype=object)
+    if comuna_col in df.columns:
+        text = text + ' ' + fold_text(df[comuna_col])
+    row_docs, docs = pd.factorize(pd.Series(text, dtype=object))
+
+    trigrams, owners = text_trigrams(docs.tolist())
+    # Unique (trigram, document) pairs, sorted by trigram and then document
+    # (sort + adjacent compare: much faster than np.unique on tens of millions of pairs)
+    pairs = np.sort((trigrams << 32) | owners)
+    pairs = pairs[np.r_[True, pairs[1:] != pairs[:-1]][:len(pairs)]]
+    pair_trigrams = pairs >> 32
+    starts = np.flatnonzero(np.r_[True, pair_trigrams[1:] != pair_trigrams[:-1]][:len(pairs)])
+    keys = pair_trigrams[starts]
+
+    return {
+        'row_docs': row_docs.astype(np.int32),
+        'keys': keys,
+        'starts': np.append(starts, len(pairs)),
+        'postings': (pairs & 0xFFFFFFFF).astype(np.int32),
+        'doc_trigrams': np.bincount((pairs & 0xFFFFFFFF), minlength=len(docs)),
+    }
+
+
+def search_positions(index, query, rows=None, limit=SEARCH_LIMIT, min_coverage=MIN_COVERAGE):
+    """
+    Núcleo de la búsqueda, sin construir dataframes.
+
+    El puntaje combina la fracción de trigramas de la consulta presentes en el
+    documento (tolera errores de tipeo) con su similitud de Dice (prefiere
+    textos cortos). La consulta no se cierra con espacio, así que la última
+    palabra también coincide como prefijo mientras se escribe.
+
+    Args:
+        query (str): texto buscado; acentos y mayúsculas se ignoran.
+        rows (array): posiciones de fila admitidas (p. ej. las de los filtros); None = todas.
+        limit (int): cantidad máxima de resultados.
+
+    Returns:
+        (posiciones de fila, puntajes en [0, 1]), de mayor a menor puntaje.
+    """
+    empty = np.empty(0, dtype=np.int64), np.empty(0)
+    folded = norm_match(query)
+    query_trigrams = np.unique(text_trigrams([folded])[0]) if folded else []
+    if len(query_trigrams) == 0:
+        return empty
+
+    slots = np.searchsorted(index['keys'], query_trigrams)
+    found = slots < len(index['keys'])
+    found[found] = index['keys'][slots[found]] == query_trigrams[found]
+    if not found.any():
+        return empty
+    postings = np.concatenate([
+        index['postings'][index['starts'][slot]:index['starts'][slot + 1]] for slot in slots[found]
+    ])
+
+    shared = np.bincount(postings, minlength=len(index['doc_trigrams']))
+    coverage = shared / len(query_trigrams)
+    dice = 2 * shared / (len(query_trigrams) + index['doc_trigrams'])
+    doc_scores = np.where(coverage >= min_coverage, COVERAGE_WEIGHT * coverage + (1 - COVERAGE_WEIGHT) * dice, 0.0)
+
+    candidates = np.flatnonzero(doc_scores[index['row_docs']] > 0)
+    if rows is not None:
+        candidates = np.intersect1d(candidates, rows, assume_unique=True)
+    scores = doc_scores[index['row_docs'][candidates]]
+    if len(candidates) > limit:
+        best = np.argpartition(-scores, limit - 1)[:limit]
+        candidates, scores = candidates[best], scores[best]
+    order = np.lexsort((candidates, -scores))
+    return candidates[order], scores[order]
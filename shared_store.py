@@ -0,0 +1,245 @@
+import argparse
+import json
+import os
+import shutil
+from datetime import datetime
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from dataset import COLUMNAR_DATA_PATH, COVERAGE_DATA_PATH, DATA_DIR, FacilityDataset
+
+# Published versions live next to the cleaned files of the data directory
+SHARED_DIR = 'compartido'
+SHARED_PATH = os.path.join(DATA_DIR, SHARED_DIR)
+# Text file with the name of the current version, replaced atomically on publish
+CURRENT_FILE = 'ACTUAL'
+# Versions kept on disk (the current one included); older ones are removed on publish
+KEEP_VERSIONS = 2
+VERSION_FORMAT = '%Y%m%dT%H%M%S%f'
+
+FRAME_FILE = 'establecimientos.arrow'
+# FacilityDataset index -> file; cubes are frames, the other indexes flat arrays
+CUBE_FILES = {'count_cube': 'cubo_conteos.arrow', 'series_cube': 'cubo_series.arrow'}
+FILTER_INDEX_FILE = 'indice_filtros.arrow'
+SEARCH_INDEX_FILE = 'indice_busqueda.arrow'
+# Schema metadata key holding the JSON description of an array bundle
+ARRAYS_METADATA_KEY = b'indice'
+
+
+def write_table(table, path):
+    # Uncompressed IPC file: readers map the buffers straight from the page cache
+    import pyarrow as pa
+
+    with pa.OSFile(path, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+
+
+def map_table(path):
+    """
+    Tabla Arrow cuyos buffers apuntan al archivo mapeado (sin copiar ni leer el
+    archivo completo). Las páginas las comparte el caché del sistema operativo
+    entre todos los procesos que mapean el mismo archivo.
+    """
+    import pyarrow as pa
+
+    return pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+
+
+def write_frame(df, path):
+    import pyarrow as pa
+
+    write_table(pa.Table.from_pandas(df, preserve_index=False), path)
+
+
+@lru_cache(maxsize=None)
+def copies_text():
+    # pandas < 3 turns Arrow text into object arrays (one Python str per value)
+    import pyarrow as pa
+
+    return pa.table({'texto': ['']}).to_pandas()['texto'].dtype == object
+
+
+def arrow_text_type(arrow_type):
+    import pyarrow as pa
+
+    if pa.types.is_string(arrow_type) or pa.types.is_large_string(arrow_type):
+        return pd.ArrowDtype(arrow_type)
+    return None
+
+
+def map_frame(path):
+    """
+    DataFrame sobre un archivo de write_frame. Las columnas de texto, float y
+    fecha quedan sobre los buffers mapeados; los códigos de las categóricas,
+    los booleanos y los enteros con nulos se convierten a pandas (son chicos).
+    El texto ya es Arrow en pandas 3; en versiones anteriores se mapea como
+    pd.ArrowDtype (faltantes como <NA>) para no copiarlo.
+    """
+    table = map_table(path)
+    if copies_text():
+        return table.to_pandas(types_mapper=arrow_text_type)
+    return table.to_pandas()
+
+
+def write_arrays(arrays, path, metadata=None):
+    """
+    Guarda arreglos numpy de distinto largo y tipo en un archivo IPC: una fila
+    con una columna lista por arreglo, más metadata JSON en el esquema.
+    """
+    import pyarrow as pa
+
+    columns = {
+        name: pa.LargeListArray.from_arrays(pa.array([0, len(values)], pa.int64()), pa.array(values))
+        for name, values in arrays.items()
+    }
+    table = pa.table(columns).replace_schema_metadata({ARRAYS_METADATA_KEY: json.dumps(metadata or {})})
+    write_table(table, path)
+
+
+def map_arrays(path):
+    """
+    Arreglos guardados con write_arrays, como vistas numpy de solo lectura sobre el archivo mapeado.
+
+    Returns:
+        (dict nombre -> arreglo, metadata)
+    """
+    table = map_table(path)
+    arrays = {
+        name: table.column(name).chunk(0).flatten().to_numpy(zero_copy_only=True)
+        for name in table.column_names
+    }
+    return arrays, json.loads(table.schema.metadata[ARRAYS_METADATA_KEY])
+
+
+def pack_filter_index(filter_index):
+    # The bitmaps of a column have the same length: one flat array per column,
+    # values (in bitmap order) and options as JSON metadata
+    arrays, values = {}, {}
+    for column, bitmaps in filter_index['bitmaps'].items():
+        values[column] = list(bitmaps.keys())
+        arrays[column] = np.concatenate(list(bitmaps.values())) if bitmaps else np.empty(0, dtype=np.uint8)
+    metadata = {'n_rows': filter_index['n_rows'], 'values': values, 'options': filter_index['options']}
+    return arrays, metadata
+
+
+def unpack_filter_index(arrays, metadata):
+    size = (metadata['n_rows'] + 7) // 8
+    bitmaps = {
+        column: {value: arrays[column][i * size:(i + 1) * size] for i, value in enumerate(values)}
+        for column, values in metadata['values'].items()
+    }
+    return {'n_rows': metadata['n_rows'], 'bitmaps': bitmaps, 'options': metadata['options']}
+
+
+def current_version(root=SHARED_PATH):
+    """
+    Versión publicada vigente, o None si no hay ninguna.
+    """
+    try:
+        with open(os.path.join(root, CURRENT_FILE), encoding='utf-8') as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def published_versions(root=SHARED_PATH):
+    if not os.path.isdir(root):
+        return []
+    return sorted(name for name in os.listdir(root) if not name.startswith('.') and os.path.isdir(os.path.join(root, name)))
+
+
+def publish(df, root=SHARED_PATH, version=None):
+    """
+    Publica el dataset limpio tipado y sus índices derivados (filtros, cubos
+    de conteos y series, búsqueda) como archivos Arrow IPC sin comprimir en
+    root/<versión>/.
+
+    La versión se escribe completa en un directorio temporal, se renombra y
+    recién entonces se apunta desde root/ACTUAL (os.replace, atómico), así que
+    un lector ve la versión anterior o la nueva completa, nunca una a medias.
+    Las versiones más antiguas que KEEP_VERSIONS se borran; los procesos que
+    aún las tienen mapeadas siguen leyéndolas hasta soltarlas.
+
+    Returns:
+        nombre de la versión publicada.
+    """
+    dataset = FacilityDataset(df)
+    version = version or datetime.now().strftime(VERSION_FORMAT)
+    os.makedirs(root, exist_ok=True)
+    target = os.path.join(root, version)
+    if os.path.exists(target):
+        raise ValueError(f"La versión {version} ya existe en {root}")
+
+    staging = os.path.join(root, f'.{version}.tmp')
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    write_frame(df, os.path.join(staging, FRAME_FILE))
+    for name, file_name in CUBE_FILES.items():
+        cube = getattr(dataset, name)
+        if cube is not None:
+            write_frame(cube, os.path.join(staging, file_name))
+    bitmaps, metadata = pack_filter_index(dataset.filter_index)
+    write_arrays(bitmaps, os.path.join(staging, FILTER_INDEX_FILE), metadata)
+    write_arrays(dataset.search_index, os.path.join(staging, SEARCH_INDEX_FILE))
+    os.replace(staging, target)
+
+    pointer = os.path.join(root, f'.{CURRENT_FILE}.tmp')
+    with open(pointer, 'w', encoding='utf-8') as f:
+        f.write(version)
+    os.replace(pointer, os.path.join(root, CURRENT_FILE))
+
+    for old in published_versions(root)[:-KEEP_VERSIONS]:
+        if old != version:
+            shutil.rmtree(os.path.join(root, old), ignore_errors=True)
+    return version
+
+
+def attach(root=SHARED_PATH, version=None, coverage_path=COVERAGE_DATA_PATH):
+    """
+    FacilityDataset sobre una versión publicada (la vigente por defecto), con
+    el dataset y los índices mapeados de solo lectura en vez de leídos y
+    reconstruidos. El KD-tree de vecinos se sigue construyendo por proceso la
+    primera vez que se usa.
+    ValueError si no hay versión publicada.
+    """
+    version = version or current_version(root)
+    if version is None:
+        raise ValueError(f"No hay un dataset publicado en {root}")
+    folder = os.path.join(root, version)
+
+    indexes = {
+        'filter_index': unpack_filter_index(*map_arrays(os.path.join(folder, FILTER_INDEX_FILE))),
+        'search_index': map_arrays(os.path.join(folder, SEARCH_INDEX_FILE))[0],
+    }
+    for name, file_name in CUBE_FILES.items():
+        path = os.path.join(folder, file_name)
+        indexes[name] = map_frame(path) if os.path.exists(path) else None
+    return FacilityDataset(map_frame(os.path.join(folder, FRAME_FILE)), coverage_path, indexes=indexes, version=version)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Dataset limpio e índices publicados como archivos Arrow mapeados en memoria, "
+                    "compartidos por los procesos del servidor en un mismo host."
+    )
+    parser.add_argument('--root', default=SHARED_PATH, help="Directorio de versiones publicadas (default: %(default)s)")
+    commands = parser.add_subparsers(dest='command', required=True)
+    publish_command = commands.add_parser('publish', help="Publica una nueva versión y la deja vigente")
+    publish_command.add_argument('columnar_file', nargs='?', default=COLUMNAR_DATA_PATH,
+                                 help="Artefacto Parquet de clean_data.py (default: %(default)s)")
+    commands.add_parser('list', help="Lista las versiones publicadas")
+    args = parser.parse_args(argv)
+
+    if args.command == 'publish':
+        version = publish(pd.read_parquet(args.columnar_file), args.root)
+        print(f"Versión {version} publicada en {args.root}")
+    else:
+        current = current_version(args.root)
+        for version in published_versions(args.root):
+            print(f"{version}{' (vigente)' if version == current else ''}")
+
+
+if __name__ == "__main__":
+    main()
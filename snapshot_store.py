@@ -0,0 +1,335 @@
+import argparse
+import os
+import re
+import sys
+
+import numpy as np
+import pandas as pd
+
+from clean_data import KEY_COLUMN, to_typed_frame
+from dataset import DATA_DIR
+
+# Store directory, next to the cleaned files of the data directory
+STORE_DIR = 'historico'
+STORE_PATH = os.path.join(DATA_DIR, STORE_DIR)
+MANIFEST_FILE = 'snapshots.csv'
+VERSIONS_DIR = 'versiones'
+PARQUET_COMPRESSION = 'zstd'
+# Snapshot date embedded in the raw file name (establecimientos_20260310.csv)
+SNAPSHOT_DATE_RE = re.compile(r'(\d{8})')
+
+# Operation recorded for a facility in a snapshot partition; unchanged rows are not stored
+OP_ADDED = 'alta'
+OP_CHANGED = 'modificacion'
+OP_REMOVED = 'baja'
+
+
+def snapshot_date_from_name(path):
+    """
+    Fecha del snapshot a partir del nombre del archivo (AAAAMMDD), o None.
+    """
+    match = SNAPSHOT_DATE_RE.search(os.path.basename(path))
+    if not match:
+        return None
+    return pd.to_datetime(match.group(1), format='%Y%m%d', errors='coerce')
+
+
+def row_hashes(typed):
+    """
+    Hash por fila de todas las columnas del dataframe tipado; las categóricas
+    se comparan por valor, así que no dependen del diccionario de cada partición.
+    """
+    values = typed.drop(columns=KEY_COLUMN).astype(
+        {col: object for col in typed.columns if isinstance(typed[col].dtype, pd.CategoricalDtype)}
+    )
+    return pd.util.hash_pandas_object(values, index=False).to_numpy()
+
+
+class SnapshotStore:
+    """
+    Almacén append-only de snapshots limpios.
+
+    Cada snapshot agregado escribe una partición Parquet (versiones/snapshot=AAAA-MM-DD.parquet)
+    solo con las filas nuevas o modificadas respecto del estado anterior, más una fila
+    'baja' por cada establecimiento que desaparece, y una línea en snapshots.csv
+    (que se escribe al final: una partición sin línea en el manifiesto se ignora).
+    Las particiones no se reescriben nunca.
+
+    La vigencia de cada versión va desde su snapshot hasta el siguiente evento
+    del mismo EstablecimientoCodigo; se calcula leyendo solo las columnas de
+    clave, operación y hash de cada partición, y las filas completas se leen
+    únicamente de las particiones que contienen versiones pedidas.
+    """
+
+    def __init__(self, root=STORE_PATH):
+        self.root = root
+        self._versions = {}
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.root, MANIFEST_FILE)
+
+    def partition_path(self, snapshot):
+        return os.path.join(self.root, VERSIONS_DIR, f"snapshot={pd.Timestamp(snapshot):%Y-%m-%d}.parquet")
+
+    def snapshots(self):
+        """
+        Manifiesto: una fila por snapshot con su fecha, archivo de origen y conteos.
+        """
+        if not os.path.exists(self.manifest_path):
+            return pd.DataFrame(columns=['Snapshot', 'Archivo', 'Filas', 'Altas', 'Modificaciones', 'Bajas'])
+        return pd.read_csv(self.manifest_path, sep=';', parse_dates=['Snapshot'])
+
+    def versions(self, columns=()):
+        """
+        Una fila por versión: clave, Snapshot, Operacion, HashContenido,
+        ValidoDesde y ValidoHasta (excluido; NaT si sigue vigente), más las
+        columnas de datos pedidas. Se recalcula solo si cambió el manifiesto.
+        """
+        columns = tuple(columns)
+        manifest = self.snapshots()
+        cache_key = (columns, len(manifest), tuple(manifest['Snapshot']))
+        if cache_key in self._versions:
+            return self._versions[cache_key]
+
+        read_columns = [KEY_COLUMN, 'Operacion', 'HashContenido', *columns]
+        parts = []
+        for snapshot in manifest['Snapshot']:
+            part = pd.read_parquet(self.partition_path(snapshot), columns=read_columns)
+            part.insert(1, 'Snapshot', snapshot)
+            parts.append(part)
+        if parts:
+            versions = pd.concat(parts, ignore_index=True)
+        else:
+            versions = pd.DataFrame(columns=[KEY_COLUMN, 'Snapshot', 'Operacion', 'HashContenido', *columns])
+        versions = versions.sort_values([KEY_COLUMN, 'Snapshot'], kind='stable', ignore_index=True)
+        versions['ValidoDesde'] = versions['Snapshot']
+        next_event = versions.groupby(KEY_COLUMN, sort=False)['Snapshot'].shift(-1)
+        versions['ValidoHasta'] = next_event
+
+        self._versions = {cache_key: versions}
+        return versions
+
+    def _state(self, when):
+        # Version in force at `when` for each facility (removed ones excluded)
+        versions = self.versions()
+        when = pd.Timestamp(when)
+        current = (versions['ValidoDesde'] <= when) & (versions['ValidoHasta'].isna() | (versions['ValidoHasta'] > when))
+        return versions[current & (versions['Operacion'] != OP_REMOVED)]
+
+    def _read_rows(self, events, columns=None):
+        # Full rows of the given versions, reading only the partitions that hold them.
+        # Rows are filtered in Arrow and converted to pandas once for all partitions.
+        import pyarrow as pa
+        import pyarrow.compute as pc
+        import pyarrow.parquet as pq
+
+        tables, snapshots = [], []
+        for snapshot, group in events.groupby('Snapshot', sort=True):
+            table = pq.read_table(self.partition_path(snapshot), columns=columns)
+            wanted = pc.and_(
+                pc.is_in(table[KEY_COLUMN], value_set=pa.array(group[KEY_COLUMN].astype(str).tolist())),
+                pc.not_equal(table['Operacion'], OP_REMOVED),
+            )
+            table = table.filter(wanted).drop_columns(['Operacion', 'HashContenido'])
+            tables.append(table.replace_schema_metadata())
+            snapshots.append(np.repeat(np.datetime64(snapshot, 'ns'), table.num_rows))
+        if not tables:
+            return pd.DataFrame(columns=[KEY_COLUMN, 'Snapshot'])
+        rows = pa.concat_tables(tables, promote_options='permissive').to_pandas()
+        rows.insert(1, 'Snapshot', np.concatenate(snapshots))
+        # Tombstones and per-partition dictionaries widen some dtypes; restore the typed layout
+        return to_typed_frame(rows)
+
+    def as_of(self, when, columns=None):
+        """
+        Registro tal como estaba en la fecha when (según el último snapshot
+        anterior o igual a ella). columns limita las columnas leídas.
+        """
+        if columns is not None:
+            columns = list(dict.fromkeys([KEY_COLUMN, *columns, 'Operacion', 'HashContenido']))
+        state = self._state(when)
+        rows = self._read_rows(state, columns).drop(columns='Snapshot')
+        return rows.sort_values(KEY_COLUMN, ignore_index=True)
+
+    def changes(self, start, end, columns=()):
+        """
+        Cambios netos entre las fechas start y end.
+
+        Args:
+            columns (list): columnas de datos a agregar, con el valor en end
+                            (o en start para las bajas).
+
+        Returns:
+            DataFrame con la clave, Cambio ('alta', 'baja' o 'modificacion') y,
+            para las modificaciones, ColumnasModificadas (separadas por coma).
+        """
+        before = self._state(start).set_index(KEY_COLUMN)
+        after = self._state(end).set_index(KEY_COLUMN)
+        added = after.index.difference(before.index)
+        removed = before.index.difference(after.index)
+        common = after.index.intersection(before.index)
+        modified = common[before.loc[common, 'HashContenido'].to_numpy() != after.loc[common, 'HashContenido'].to_numpy()]
+
+        changed_columns = pd.Series('', index=modified, dtype=object)
+        if len(modified):
+            old = self._read_rows(before.loc[modified].reset_index()).set_index(KEY_COLUMN).loc[modified]
+            new = self._read_rows(after.loc[modified].reset_index()).set_index(KEY_COLUMN).loc[modified]
+            shared = [col for col in new.columns if col in old.columns and col != 'Snapshot']
+            old, new = old[shared].astype(object), new[shared].astype(object)
+            differs = (old != new) & ~(old.isna() & new.isna())
+            changed_columns = differs.apply(lambda row: ', '.join(row.index[row.to_numpy()]), axis=1)
+
+        result = pd.concat([
+            pd.DataFrame({KEY_COLUMN: added, 'Cambio': OP_ADDED, 'ColumnasModificadas': ''}),
+            pd.DataFrame({KEY_COLUMN: removed, 'Cambio': OP_REMOVED, 'ColumnasModificadas': ''}),
+            pd.DataFrame({KEY_COLUMN: modified, 'Cambio': OP_CHANGED, 'ColumnasModificadas': changed_columns.to_numpy()}),
+        ], ignore_index=True)
+        if columns:
+            values = pd.concat([self.as_of(end, columns), self.as_of(start, columns)]).drop_duplicates(KEY_COLUMN)
+            result = result.merge(values, on=KEY_COLUMN, how='left')
+        return result.sort_values(KEY_COLUMN, ignore_index=True)
+
+    def history(self, code):
+        """
+        Todas las versiones de un establecimiento, con su vigencia.
+        """
+        versions = self.versions()
+        events = versions[versions[KEY_COLUMN] == str(code)]
+        rows = self._read_rows(events)
+        info = events[[KEY_COLUMN, 'Snapshot', 'Operacion', 'ValidoDesde', 'ValidoHasta']]
+        return info.merge(rows, on=[KEY_COLUMN, 'Snapshot'], how='left').drop(columns='Snapshot')
+
+    def event_counts(self, column=None):
+        """
+        Por snapshot: altas, bajas, modificaciones y, si se indica column,
+        cuántas modificaciones cambiaron el valor de esa columna.
+        """
+        versions = self.versions([column] if column else ())
+        # Snapshots without events (identical to the previous one) are listed with zeros
+        snapshots = pd.Index(self.snapshots()['Snapshot'], name='Snapshot')
+        counts = pd.crosstab(versions['Snapshot'], versions['Operacion']).reindex(
+            index=snapshots, columns=[OP_ADDED, OP_REMOVED, OP_CHANGED], fill_value=0
+        )
+        counts.columns = ['Altas', 'Bajas', 'Modificaciones']
+        if column:
+            values = versions[column].astype(object)
+            previous = values.groupby(versions[KEY_COLUMN], sort=False).shift(1)
+            changed = (versions['Operacion'] == OP_CHANGED) & (values != previous) & ~(values.isna() & previous.isna())
+            counts[f'Cambios {column}'] = changed.groupby(versions['Snapshot']).sum().reindex(counts.index, fill_value=0)
+        return counts
+
+    def append(self, df, snapshot, source=''):
+        """
+        Agrega un snapshot limpio (salida de clean_data.py). Solo se guardan las
+        filas nuevas o modificadas y las bajas; snapshot debe ser posterior al último.
+
+        Returns:
+            dict con los conteos de altas, modificaciones, bajas y filas sin cambios.
+        """
+        snapshot = pd.Timestamp(snapshot).normalize()
+        manifest = self.snapshots()
+        if len(manifest) and snapshot <= manifest['Snapshot'].max():
+            raise ValueError(
+                f"El snapshot {snapshot:%Y-%m-%d} no es posterior al último del almacén "
+                f"({manifest['Snapshot'].max():%Y-%m-%d})"
+            )
+        if KEY_COLUMN not in df.columns:
+            raise ValueError(f"Falta la columna {KEY_COLUMN}")
+        typed = to_typed_frame(df).reset_index(drop=True)
+        typed[KEY_COLUMN] = typed[KEY_COLUMN].astype(str)
+        if typed[KEY_COLUMN].duplicated().any():
+            raise ValueError(f"{KEY_COLUMN} tiene duplicados en el snapshot")
+
+        hashes = row_hashes(typed)
+        previous = self._state(snapshot).set_index(KEY_COLUMN)['HashContenido']
+        previous_hash = previous.reindex(typed[KEY_COLUMN]).to_numpy()
+        is_new = ~typed[KEY_COLUMN].isin(previous.index).to_numpy()
+        is_changed = ~is_new & (previous_hash != hashes)
+        removed = previous.index.difference(pd.Index(typed[KEY_COLUMN]))
+
+        stored = typed[is_new | is_changed].copy()
+        stored['Operacion'] = np.where(is_new[is_new | is_changed], OP_ADDED, OP_CHANGED)
+        stored['HashContenido'] = hashes[is_new | is_changed]
+        tombstones = pd.DataFrame({KEY_COLUMN: removed, 'Operacion': OP_REMOVED, 'HashContenido': np.uint64(0)})
+        partition = pd.concat([stored, tombstones], ignore_index=True) if len(removed) else stored
+        partition['HashContenido'] = partition['HashContenido'].astype('uint64')
+
+        os.makedirs(os.path.join(self.root, VERSIONS_DIR), exist_ok=True)
+        path = self.partition_path(snapshot)
+        partition.to_parquet(f'{path}.tmp', index=False, compression=PARQUET_COMPRESSION)
+        os.replace(f'{path}.tmp', path)
+
+        summary = {
+            'Snapshot': f'{snapshot:%Y-%m-%d}',
+            'Archivo': os.path.basename(source),
+            'Filas': len(typed),
+            'Altas': int(is_new.sum()),
+            'Modificaciones': int(is_changed.sum()),
+            'Bajas': len(removed),
+        }
+        pd.DataFrame([summary]).to_csv(
+            self.manifest_path, sep=';', index=False, mode='a', header=not os.path.exists(self.manifest_path)
+        )
+        summary['SinCambios'] = len(typed) - summary['Altas'] - summary['Modificaciones']
+        return summary
+
+
+def read_clean(path):
+    if path.endswith('.parquet'):
+        return pd.read_parquet(path)
+    return pd.read_csv(path, sep=';', encoding='utf-8', dtype={KEY_COLUMN: str})
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Almacén versionado de snapshots limpios del registro de establecimientos.")
+    parser.add_argument('--store', default=STORE_PATH, help="Directorio del almacén (default: %(default)s)")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    add = commands.add_parser('add', help="Agrega un snapshot limpio (CSV o Parquet de clean_data.py)")
+    add.add_argument('clean_file')
+    add.add_argument('--date', help="Fecha del snapshot (AAAA-MM-DD); por defecto se toma de --source o del nombre del archivo")
+    add.add_argument('--source', default='', help="Snapshot crudo de origen, registrado en el manifiesto")
+
+    commands.add_parser('list', help="Lista los snapshots del almacén")
+
+    as_of = commands.add_parser('as-of', help="Registro vigente en una fecha")
+    as_of.add_argument('date')
+    as_of.add_argument('--output', help="CSV de salida (default: resumen en pantalla)")
+
+    changes = commands.add_parser('changes', help="Altas, bajas y modificaciones entre dos fechas")
+    changes.add_argument('start')
+    changes.add_argument('end')
+    changes.add_argument('--output', help="CSV de salida (default: resumen en pantalla)")
+
+    args = parser.parse_args(argv)
+    store = SnapshotStore(args.store)
+
+    try:
+        if args.command == 'add':
+            date = args.date
+            for name in (args.source, args.clean_file):
+                if date is None or pd.isna(date):
+                    date = snapshot_date_from_name(name)
+            if date is None or pd.isna(date):
+                parser.error("No se pudo inferir la fecha del snapshot; usa --date")
+            summary = store.append(read_clean(args.clean_file), date, args.source or args.clean_file)
+            print(f"Snapshot {summary['Snapshot']} agregado: {summary}")
+        elif args.command == 'list':
+            print(store.snapshots().to_string(index=False))
+        else:
+            result = store.as_of(args.date) if args.command == 'as-of' else store.changes(args.start, args.end)
+            if args.output:
+                result.to_csv(args.output, sep=';', index=False, encoding='utf-8')
+                print(f"{len(result)} filas guardadas en {args.output}")
+            elif args.command == 'as-of':
+                print(f"{len(result)} establecimientos vigentes al {args.date}")
+            else:
+                print(result['Cambio'].value_counts().to_string())
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+import numpy as np
+import pandas as pd
+
+# Mean Earth radius (IUGG), in km
+EARTH_RADIUS_KM = 6371.0088
+
+# Columns a nearest-facility query can be restricted by
+KNN_FILTER_COLUMNS = ["TipoUrgencia", "NivelComplejidadEstabGlosa", "TipoSistemaSaludGlosa"]
+
+# Urgency services measured by the coverage stage (short name -> TipoUrgencia value)
+URGENCY_SERVICES = {
+    "UEH": "Urgencia Hospitalaria (UEH)",
+    "SAPU": "Urgencia Ambulatoria (SAPU)",
+    "SAR": "Urgencia Ambulatoria (SAR)",
+    "SUR": "Urgencia Ambulatoria (SUR)",
+}
+# Per-comuna aggregates of the coverage table (pandas aggregation -> column suffix)
+COVERAGE_STATS = {"min": "Min", "median": "Mediana", "max": "Max"}
+
+
+def to_unit_vectors(lat, lon):
+    """
+    Convierte latitud/longitud en grados a vectores unitarios 3D.
+    La distancia euclidiana (cuerda) entre vectores crece con la distancia
+    sobre la esfera, así que un KD-tree sobre ellos entrega los mismos
+    vecinos que la distancia de gran círculo.
+    """
+    lat = np.radians(np.asarray(lat, dtype=float))
+    lon = np.radians(np.asarray(lon, dtype=float))
+    cos_lat = np.cos(lat)
+    return np.column_stack([cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)])
+
+
+def chord_to_km(chord):
+    """
+    Distancia de gran círculo (km) a partir de la cuerda entre vectores unitarios.
+    """
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.clip(np.asarray(chord, dtype=float) / 2, 0, 1))
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """
+    Distancia de gran círculo (km) entre pares de puntos, vectorizada.
+    """
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(v, dtype=float)) for v in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+def build_facility_index(df, lat_col='Latitud', lon_col='Longitud'):
+    """
+    Construye el índice espacial de establecimientos (una sola vez por dataset).
+
+    Returns:
+        dict con el dataframe, las posiciones de filas con coordenadas, sus
+        vectores unitarios y un caché de árboles por restricción.
+    """
+    # scipy is imported on first use, so importing this module stays cheap
+    from scipy.spatial import cKDTree
+
+    lat = pd.to_numeric(df[lat_col], errors='coerce').to_numpy(dtype=float)
+    lon = pd.to_numeric(df[lon_col], errors='coerce').to_numpy(dtype=float)
+    positions = np.flatnonzero(~(np.isnan(lat) | np.isnan(lon)))
+    vectors = to_unit_vectors(lat[positions], lon[positions])
+
+    return {
+        'frame': df,
+        'positions': positions,
+        'vectors': vectors,
+        # Trees keyed by restriction; the unrestricted one is built eagerly
+        'trees': {(): (cKDTree(vectors), positions)},
+    }
+
+
+def restriction_key(filters):
+    """
+    Clave hashable de un dict {columna: [valores]}; ignora columnas sin valores.
+    """
+    return tuple(sorted(
+        (col, tuple(sorted(map(str, values)))) for col, values in (filters or {}).items() if len(values)
+    ))
+
+
+def facility_tree(index, filters=None):
+    """
+    KD-tree sobre los establecimientos que cumplen filters ({columna: [valores]}).
+    Cada combinación de filtros construye su árbol una sola vez.
+
+    Returns:
+        (cKDTree o None, posiciones de fila en index['frame'])
+    """
+    key = restriction_key(filters)
+    if key not in index['trees']:
+        from scipy.spatial import cKDTree
+
+        df = index['frame']
+        mask = np.ones(len(index['positions']), dtype=bool)
+        for col, values in key:
+            if col not in df.columns:
+                raise ValueError(f"Columna desconocida para restringir la búsqueda: {col}")
+            column = df[col].iloc[index['positions']].astype(str)
+            mask &= column.isin(values).to_numpy()
+        positions = index['positions'][mask]
+        tree = cKDTree(index['vectors'][mask]) if mask.any() else None
+        index['trees'][key] = (tree, positions)
+    return index['trees'][key]
+
+
+def nearest_positions(index, lat, lon, k=5, filters=None):
+    """
+    Núcleo de la consulta kNN, sin construir dataframes (apto para consultas masivas).
+
+    Args:
+        lat, lon: escalares o arreglos de puntos de origen (grados).
+        k (int): cantidad de vecinos por origen.
+        filters (dict): restricción {columna: [valores]}.
+
+    Returns:
+        (posiciones de fila, distancias en km), ambos de forma (n_origenes, k');
+        k' = min(k, establecimientos disponibles).
+    """
+    tree, positions = facility_tree(index, filters)
+    n_origins = np.atleast_1d(np.asarray(lat, dtype=float)).shape[0]
+    k = min(k, len(positions))
+    if tree is None or k <= 0:
+        return np.empty((n_origins, 0), dtype=np.int64), np.empty((n_origins, 0))
+
+    chord, neighbors = tree.query(to_unit_vectors(np.atleast_1d(lat), np.atleast_1d(lon)), k=k)
+    chord = np.asarray(chord).reshape(n_origins, k)
+    neighbors = np.asarray(neighbors).reshape(n_origins, k)
+    return positions[neighbors], chord_to_km(chord)
+
+
+def nearest_facilities(index, lat, lon, k=5, filters=None):
+    """
+    Los k establecimientos más cercanos a uno o varios puntos, con distancia de gran círculo.
+
+    Args:
+        lat, lon: escalares o arreglos de puntos de origen (grados).
+        k (int): cantidad de vecinos por origen.
+        filters (dict): restricción {columna: [valores]}, p. ej.
+                        {'TipoUrgencia': ['Urgencia Hospitalaria (UEH)']}.
+
+    Returns:
+        DataFrame con las filas de los establecimientos más 'Origen' (índice del
+        punto de origen), 'Rango' (1 = más cercano) y 'DistanciaKm'.
+    """
+    rows, distances = nearest_positions(index, lat, lon, k=k, filters=filters)
+    n_origins, k = rows.shape
+
+    result = index['frame'].iloc[rows.ravel()].reset_index(drop=True)
+    result.insert(0, 'Origen', np.repeat(np.arange(n_origins), k))
+    result.insert(1, 'Rango', np.tile(np.arange(1, k + 1), n_origins))
+    result['DistanciaKm'] = distances.ravel()
+    return result
+
+
+def distance_to_nearest(origin_lat, origin_lon, target_lat, target_lon):
+    """
+    Distancia de gran círculo (km) de cada origen al objetivo más cercano.
+    NaN si no hay objetivos.
+    """
+    from scipy.spatial import cKDTree
+
+    origins = to_unit_vectors(origin_lat, origin_lon)
+    if len(target_lat) == 0:
+        return np.full(len(origins), np.nan)
+    chord, _ = cKDTree(to_unit_vectors(target_lat, target_lon)).query(origins, k=1)
+    return chord_to_km(chord)
+
+
+def urgency_distances(df, lat_col='Latitud', lon_col='Longitud', type_col='TipoUrgencia'):
+    """
+    Para cada establecimiento, distancia (km) al servicio más cercano de cada
+    tipo de URGENCY_SERVICES y a cualquiera de ellos. Los servicios
+    considerados son los del mismo dataframe.
+
+    Returns:
+        DataFrame con el índice de df y columnas 'Distancia<tipo>' y
+        'DistanciaUrgencia'; NaN para filas sin coordenadas.
+    """
+    lat = pd.to_numeric(df[lat_col], errors='coerce').to_numpy(dtype=float)
+    lon = pd.to_numeric(df[lon_col], errors='coerce').to_numpy(dtype=float)
+    valid = ~(np.isnan(lat) | np.isnan(lon))
+    types = df[type_col].astype(str).to_numpy()
+
+    result = pd.DataFrame(index=df.index)
+    for short, value in URGENCY_SERVICES.items():
+        distances = np.full(len(df), np.nan)
+        targets = valid & (types == value)
+        distances[valid] = distance_to_nearest(lat[valid], lon[valid], lat[targets], lon[targets])
+        result[f'Distancia{short}'] = distances
+
+    any_service = result[[f'Distancia{short}' for short in URGENCY_SERVICES]]
+    result['DistanciaUrgencia'] = any_service.min(axis=1, skipna=True)
+    return result
+
+
+def comuna_coverage(df, comuna_col='ComunaGlosa', region_col='RegionGlosa', type_col='TipoUrgencia',
+                    distances=None, **kwargs):
+    """
+    Tabla de cobertura por comuna: mínimo, mediana y máximo de la distancia de
+    sus establecimientos a la urgencia más cercana (en general y por tipo),
+    ordenada de mayor a menor brecha (mediana de 'DistanciaUrgencia').
+
+    Args:
+        distances (DataFrame): urgency_distances ya calculadas con el índice de
+                               df, p. ej. las filas filtradas de las del registro
+                               completo (los servicios fuera del filtro siguen
+                               contando). Por defecto se calculan sobre df.
+
+    Returns:
+        DataFrame con región, comuna, 'Establecimientos', 'UrgenciasPropias'
+        y columnas '<Distancia...>Min', '<Distancia...>Mediana', '<Distancia...>Max'.
+    """
+    if distances is None:
+        distances = urgency_distances(df, type_col=type_col, **kwargs)
+    else:
+        distances = distances.copy()
+    distances[region_col] = df[region_col].astype(str)
+    distances[comuna_col] = df[comuna_col].astype(str)
+    distances['_servicio'] = df[type_col].isin(list(URGENCY_SERVICES.values())).to_numpy()
+
+    grouped = distances.groupby([region_col, comuna_col], sort=False)
+    stats = grouped[[col for col in distances.columns if col.startswith('Distancia')]].agg(list(COVERAGE_STATS))
+    stats.columns = [f"{col}{COVERAGE_STATS[stat]}" for col, stat in stats.columns]
+
+    table = pd.concat([
+        grouped.size().rename('Establecimientos'),
+        grouped['_servicio'].sum().astype(int).rename('UrgenciasPropias'),
+        stats,
+    ], axis=1).reset_index()
+    return table.sort_values(
+        ['DistanciaUrgenciaMediana', region_col, comuna_col], ascending=[False, True, True], na_position='last'
+    ).reset_index(drop=True)
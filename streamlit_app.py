@@ -1,32 +1,36 @@
+import json
+import hashlib
+import os
+import threading
+from collections import OrderedDict
 import streamlit as st
-import pandas as pd
-import plotly.express as px
 import plotly.graph_objects as go
-import folium
-from folium.plugins import MarkerCluster
-from streamlit_folium import st_folium
+from plotly.colors import qualitative, sequential
+from spatial import KNN_FILTER_COLUMNS
+from dataset import (
+    COLUMNAR_DATA_PATH, DATA_PATH,
+    COL_COMUNA, COL_DEPENDENCIA, COL_ESTADO, COL_FECHA_INICIO, COL_LAT, COL_LON,
+    COL_NIVEL_ATENCION, COL_NIVEL_COMPLEJIDAD, COL_NOMBRE, COL_PLAZA_EDF, COL_REGION,
+    COL_SERVICIO_EDF, COL_SISTEMA, COL_TIPO_ATENCION, COL_TIPO_ESTAB, COL_TIPO_URGENCIA, COL_URGENCIA,
+    apply_filters, count_values, crosstab_cube, cube_counts, series_window, shared_dataset,
+)
+from map_layers import (
+    MAP_FOCUS_ZOOM, MAP_ZOOM, SYSTEM_COLORS, base_map, data_layer, focus_bounds, focus_marker, shared_spatial_index,
+)
+from export import EXPORT_FORMATS, available_formats, export_bytes
+from profiling import PROFILE_ENV, RerunProfiler, SpanMetrics, configured_sinks, env_flag, sinks_requested
+from snapshot_store import STORE_PATH, SnapshotStore
 
 # --- Constants ---
-DATA_PATH = 'data/establecimientos_cleaned.csv'
-COL_REGION = "RegionGlosa"
-COL_TIPO_ESTAB = "TipoEstablecimientoGlosa"
-COL_SISTEMA = "TipoSistemaSaludGlosa"
-COL_ESTADO = "EstadoFuncionamiento"
-COL_URGENCIA = "TieneServicioUrgencia"
-COL_NIVEL_ATENCION = "NivelAtencionEstabglosa"
-COL_NIVEL_COMPLEJIDAD = "NivelComplejidadEstabGlosa"
-COL_FECHA_INICIO = "FechaInicioFuncionamientoEstab"
-COL_LAT = "Latitud"
-COL_LON = "Longitud"
-COL_NOMBRE = "EstablecimientoGlosa"
-COL_COMUNA = "ComunaGlosa"
-COL_DEPENDENCIA = "DependenciaAdministrativa"
-COL_TIPO_ATENCION = "TipoAtencionEstabGlosa"
-COL_TIPO_URGENCIA = "TipoUrgencia"
-COL_PLAZA_EDF = "PlazaEDF"
-COL_SERVICIO_EDF = "ServicioSaludEDF"
-
-SYSTEM_COLORS = {'Público': '#27ae60', 'Privado': '#c0392b', 'Otros': '#7f8c8d'}
+# Earliest year offered by the "Evolución Histórica" slider
+HIST_MIN_YEAR = 2000
+
+# Session-state key of the map component (last reported zoom and bounds)
+MAP_KEY = 'mapa_establecimientos'
+# Session-state key of the facility picked in the explorer search ({'lat', 'lon', 'nombre'})
+MAP_FOCUS_KEY = 'mapa_foco'
+# Results listed by the explorer search
+SEARCH_RESULTS = 20
 COMPLEXITY_COLORS = {
     'Alta Complejidad': '#e74c3c',
     'Mediana Complejidad': '#f39c12',
@@ -45,7 +49,12 @@ DEPENDENCY_COLORS = {
     'Servicio de Salud': '#2ecc71',
     'Otro': '#95a5a6',
 }
-DEFAULT_PLOTLY_COLORS = px.colors.qualitative.Pastel
+DEFAULT_PLOTLY_COLORS = qualitative.Pastel
+
+# Built figures kept across reruns and sessions (least recently used evicted first)
+FIGURE_CACHE_SIZE = 64
+# Export payloads kept across sessions, bounded by total size (least recently used evicted first)
+EXPORT_CACHE_BYTES = 64 * 1024 * 1024
 
 # --- Page Configuration ---
 st.set_page_config(
@@ -55,6 +64,24 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+# Per-section timing for every rerun when a log/metrics sink is configured;
+# the debug panel is shown with ?debug=1 or APP_PROFILE=1. Memory tracing is
+# process-wide, so only the server-side APP_PROFILE=1 turns it on
+memory_tracing = env_flag(PROFILE_ENV)
+debug_panel = st.query_params.get('debug') == '1' or memory_tracing
+
+
+@st.cache_resource
+def load_span_metrics():
+    # Latency histograms shared by every session
+    return SpanMetrics()
+
+
+if '_profiler' not in st.session_state:
+    st.session_state['_profiler'] = RerunProfiler(configured_sinks(load_span_metrics()))
+profiler = st.session_state['_profiler'].configure(debug_panel or sinks_requested(), memory=memory_tracing)
+profiler.start('rerun')
+
 # --- Custom CSS ---
 st.markdown("""
 <style>
@@ -68,24 +95,29 @@ st.markdown("""
 
 # --- Helper Functions ---
 
-@st.cache_data
-def load_data(path=DATA_PATH):
+def load_dataset(path=DATA_PATH, columnar_path=COLUMNAR_DATA_PATH):
+    # One dataset with its indexes (filters, cubes, KD-tree) shared by every session;
+    # already loaded and indexed when the server was started through warmup.py
     try:
-        try:
-            df = pd.read_csv(path, sep=';', encoding='utf-8')
-        except UnicodeDecodeError:
-            df = pd.read_csv(path, sep=';', encoding='latin1')
-        return df, None
-    except Exception as e:
+        return shared_dataset(path, columnar_path), None
+    except (ValueError, OSError) as e:
         return None, str(e)
 
 
-def create_multiselect_filter(df, column_name, label, key):
-    if column_name in df.columns:
-        options = sorted(df[column_name].unique().tolist())
+def share_metric(label, count, total):
+    # "count (share%)", or N/A when the KPI's column is missing (count is None)
+    if count is None:
+        st.metric(label, "N/A")
+    else:
+        perc = (count / total * 100) if total else 0
+        st.metric(label, f"{count:,} ({perc:.1f}%)")
+
+
+def create_multiselect_filter(filter_index, column_name, label, key):
+    if column_name in filter_index['options']:
         return st.sidebar.multiselect(
             label,
-            options=options,
+            options=filter_index['options'][column_name],
             default=st.session_state.get(key, []),
             help=f"Seleccione uno o más {label.lower()}",
             key=key
@@ -93,25 +125,317 @@ def create_multiselect_filter(df, column_name, label, key):
     return []
 
 
-def apply_filters(df, filters):
-    df_filtered = df.copy()
-    for column, selected_values in filters.items():
-        if selected_values:
-            df_filtered = df_filtered[df_filtered[column].isin(selected_values)]
-    return df_filtered
+def load_spatial_index(path=DATA_PATH, columnar_path=COLUMNAR_DATA_PATH):
+    dataset, error = load_dataset(path, columnar_path)
+    if error or not all(col in dataset.df.columns for col in [COL_LAT, COL_LON]):
+        return None
+    return shared_spatial_index(dataset)
+
+
+@st.cache_resource
+def load_snapshot_store(path=STORE_PATH):
+    # Shared by every session; versions are re-read only when a snapshot is added
+    return SnapshotStore(path)
+
+
+@st.cache_resource
+def load_figure_cache():
+    return {'figures': OrderedDict(), 'hits': 0, 'misses': 0, 'lock': threading.Lock()}
+
+
+def figure_key(name, filters, params=None):
+    # Canonical hash of the filter state (selection order does not matter) plus figure parameters
+    state = {col: sorted(map(str, values)) for col, values in filters.items() if len(values) > 0}
+    payload = json.dumps([name, state, params or {}], sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def cached_figure(name, filters, build, *args, params=None):
+    # build(*args) only runs on a miss; args must be derived from filters and params
+    cache = load_figure_cache()
+    key = figure_key(name, filters, params)
+    with cache['lock']:
+        if key in cache['figures']:
+            cache['figures'].move_to_end(key)
+            cache['hits'] += 1
+            return cache['figures'][key]
+
+    with profiler.span(f'figura {name}'):
+        figure = build(*args)
+    with cache['lock']:
+        cache['misses'] += 1
+        cache['figures'][key] = figure
+        while len(cache['figures']) > FIGURE_CACHE_SIZE:
+            cache['figures'].popitem(last=False)
+    return figure
+
+
+@st.cache_resource
+def load_export_cache():
+    return {'payloads': OrderedDict(), 'bytes': 0, 'lock': threading.Lock()}
+
+
+def cached_export(cache, fmt, filters, df_filtered):
+    # Runs when the download button is clicked, off the script thread (cache is passed in)
+    key = figure_key(f'export_{fmt}', filters)
+    with cache['lock']:
+        if key in cache['payloads']:
+            cache['payloads'].move_to_end(key)
+            return cache['payloads'][key]
+
+    with profiler.span(f'exportar {fmt}'):
+        payload = export_bytes(df_filtered, fmt)
+    with cache['lock']:
+        if key not in cache['payloads'] and len(payload) <= EXPORT_CACHE_BYTES:
+            cache['payloads'][key] = payload
+            cache['bytes'] += len(payload)
+            while cache['bytes'] > EXPORT_CACHE_BYTES:
+                _, evicted = cache['payloads'].popitem(last=False)
+                cache['bytes'] -= len(evicted)
+    return payload
+
+
+def drop_stale_caches(version):
+    # Figures and exports are keyed by filters only: a newly published dataset version invalidates all of them
+    figure_cache, export_cache = load_figure_cache(), load_export_cache()
+    with figure_cache['lock']:
+        if figure_cache.setdefault('version', version) != version:
+            figure_cache['figures'].clear()
+            figure_cache['version'] = version
+    with export_cache['lock']:
+        if export_cache.setdefault('version', version) != version:
+            export_cache['payloads'].clear()
+            export_cache['bytes'] = 0
+            export_cache['version'] = version
+
+
+def figure_region_sistema(cube):
+    region_sistema = crosstab_cube(cube, COL_REGION, '_sistema').reset_index()
+    for col in SYSTEM_COLORS.keys():
+        if col not in region_sistema.columns:
+            region_sistema[col] = 0
+
+    ordered_cols = [COL_REGION] + list(SYSTEM_COLORS.keys())
+    region_sistema = region_sistema[ordered_cols]
+    region_total_counts = cube_counts(cube, COL_REGION)
+    region_sistema = region_sistema.set_index(COL_REGION).loc[region_total_counts.index].reset_index()
+
+    fig_region_sys = go.Figure()
+    for col in SYSTEM_COLORS.keys():
+        fig_region_sys.add_trace(go.Bar(
+            name=col,
+            y=region_sistema[COL_REGION],
+            x=region_sistema[col],
+            orientation='h',
+            marker_color=SYSTEM_COLORS[col],
+            hovertemplate=f'<b>%{{y}}</b><br>{col}: <b>%{{x}}</b><extra></extra>'
+        ))
+
+    fig_region_sys.update_layout(
+        barmode='stack',
+        yaxis={'categoryorder': 'total ascending'},
+        height=600,
+        showlegend=True,
+        legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="center", x=0.5, title='Sistema de Salud'),
+        margin=dict(l=50, r=50, t=50, b=50),
+        xaxis_title='Cantidad de Establecimientos',
+        yaxis_title='Región'
+    )
+    return fig_region_sys
+
+
+def figure_gobernanza(cube):
+    region_dep = crosstab_cube(cube, COL_REGION, '_dep').reset_index()
+    for col in DEPENDENCY_COLORS.keys():
+        if col not in region_dep.columns:
+            region_dep[col] = 0
+
+    ordered_dep_cols = [COL_REGION] + list(DEPENDENCY_COLORS.keys())
+    region_dep = region_dep[[c for c in ordered_dep_cols if c in region_dep.columns]]
+    region_dep['_total'] = region_dep.select_dtypes(include='number').sum(axis=1)
+    region_dep = region_dep.sort_values('_total', ascending=True).drop(columns='_total')
+
+    fig_gov = go.Figure()
+    for dep_name in DEPENDENCY_COLORS.keys():
+        if dep_name in region_dep.columns:
+            fig_gov.add_trace(go.Bar(
+                name=dep_name,
+                y=region_dep[COL_REGION],
+                x=region_dep[dep_name],
+                orientation='h',
+                marker_color=DEPENDENCY_COLORS[dep_name],
+                hovertemplate=f'<b>%{{y}}</b><br>{dep_name}: <b>%{{x}}</b><extra></extra>'
+            ))
+
+    fig_gov.update_layout(
+        barmode='stack',
+        height=600,
+        showlegend=True,
+        legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="center", x=0.5, title='Dependencia'),
+        margin=dict(l=50, r=50, t=50, b=50),
+        xaxis_title='Cantidad de Establecimientos',
+        yaxis_title='Región'
+    )
+    return fig_gov
+
+
+def figure_nivel(cube, column, title, center_text):
+    counts = cube_counts(cube, column).reset_index()
+    counts.columns = ['Label', 'Cantidad']
+    fig = go.Figure(data=[go.Pie(
+        labels=counts['Label'], values=counts['Cantidad'],
+        hole=0.4,
+        marker=dict(colors=DEFAULT_PLOTLY_COLORS, line=dict(color='white', width=2)),
+        textinfo='label+percent', textposition='outside', textfont=dict(size=11),
+        hovertemplate='<b>%{label}</b><br>Cantidad: <b>%{value}</b><br>%{percent}<extra></extra>',
+    )])
+    fig.update_layout(
+        title={'text': title, 'y': 0.95, 'x': 0.5, 'xanchor': 'center', 'font': dict(size=16)},
+        showlegend=False, height=420,
+        annotations=[dict(text=center_text, x=0.5, y=0.5, font=dict(size=13), showarrow=False)],
+        margin=dict(l=20, r=20, t=60, b=20),
+    )
+    return fig
+
+
+def figure_historico(values, opened, view_mode):
+    # values/opened come from series_window(); only (year, level) pairs with openings are plotted
+    niveles_complejidad = list(COMPLEXITY_COLORS.keys())
+
+    fig_hist = go.Figure()
+    for nivel in niveles_complejidad:
+        mask = opened[nivel].to_numpy()
+        if mask.any():
+            cantidad = values.loc[mask, nivel]
+            mode = 'lines+markers' if view_mode == "Acumulado" else 'lines+markers+text'
+            fig_hist.add_trace(go.Scatter(
+                x=cantidad.index, y=cantidad,
+                mode=mode, name=nivel,
+                line=dict(color=COMPLEXITY_COLORS.get(nivel, '#3498db'), width=3),
+                marker=dict(size=8),
+                text=cantidad if view_mode == "Anual" else None,
+                textposition='top center',
+                hovertemplate=f'<b>%{{x}}</b><br>{nivel}: <b>%{{y}}</b><extra></extra>'
+            ))
+
+    y_title = 'Acumulado de Establecimientos' if view_mode == "Acumulado" else 'Establecimientos Inaugurados'
+    unique_years = values.index[opened.any(axis=1)].tolist()
+    fig_hist.update_layout(
+        xaxis_title='Año', yaxis_title=y_title,
+        hovermode='closest',
+        xaxis=dict(tickmode='array', tickvals=unique_years, ticktext=unique_years, gridcolor='lightgray'),
+        yaxis=dict(gridcolor='lightgray'),
+        plot_bgcolor='white', height=550,
+        margin=dict(l=50, r=50, t=50, b=50),
+        legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="center", x=0.5),
+    )
+
+    niveles_tabla = sorted(nivel for nivel in niveles_complejidad if opened[nivel].any())
+    tabla = values.where(opened, 0).loc[unique_years, niveles_tabla].astype(int)
+    tabla.columns.name = COL_NIVEL_COMPLEJIDAD
+    return fig_hist, tabla
+
 
+def figure_snapshots(events):
+    # events comes from SnapshotStore.event_counts(); the first snapshot is the initial load
+    events = events.iloc[1:]
+    series = {
+        'Altas': ('Altas', '#2ecc71'),
+        'Bajas': ('Bajas', '#e74c3c'),
+        f'Cambios {COL_ESTADO}': ('Cambios de estado', '#f39c12'),
+    }
+    fig = go.Figure()
+    for column, (name, color) in series.items():
+        fig.add_trace(go.Bar(
+            x=events.index, y=events[column], name=name, marker_color=color,
+            hovertemplate=f'<b>%{{x|%Y-%m-%d}}</b><br>{name}: <b>%{{y}}</b><extra></extra>'
+        ))
+    fig.update_layout(
+        barmode='group', xaxis_title='Snapshot', yaxis_title='Establecimientos',
+        plot_bgcolor='white', height=400, yaxis=dict(gridcolor='lightgray'),
+        margin=dict(l=50, r=50, t=30, b=50),
+        legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="center", x=0.5),
+    )
+    return fig
 
-def classify_sistema(val):
-    return val if val in ('Público', 'Privado') else 'Otros'
 
+def figure_urgencia_region(cube_urg):
+    region_urg = crosstab_cube(cube_urg, COL_REGION, '_urgencia').reset_index()
 
-def simplify_dependency(val):
-    if val in ('Municipal', 'Privado', 'Servicio de Salud'):
-        return val
-    return 'Otro'
+    for col in URGENCY_COLORS.keys():
+        if col not in region_urg.columns:
+            region_urg[col] = 0
 
+    region_urg['_total'] = region_urg.select_dtypes(include='number').sum(axis=1)
+    region_urg = region_urg.sort_values('_total', ascending=True).drop(columns='_total')
 
-def visualizar_mapa(map_data):
+    fig_urg_region = go.Figure()
+    for urg_type, color in URGENCY_COLORS.items():
+        if urg_type in region_urg.columns:
+            fig_urg_region.add_trace(go.Bar(
+                name=urg_type.replace('Urgencia ', '').replace('Ambulatoria ', ''),
+                y=region_urg[COL_REGION],
+                x=region_urg[urg_type],
+                orientation='h',
+                marker_color=color,
+                hovertemplate=f'<b>%{{y}}</b><br>{urg_type}: <b>%{{x}}</b><extra></extra>'
+            ))
+
+    fig_urg_region.update_layout(
+        barmode='stack', height=600,
+        legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="center", x=0.5, title='Tipo de Urgencia'),
+        margin=dict(l=50, r=50, t=50, b=50),
+        xaxis_title='Cantidad', yaxis_title='Región',
+    )
+    return fig_urg_region
+
+
+def figure_urgencia_donut(cube_urg, total_urg):
+    urg_counts = cube_counts(cube_urg, '_urgencia').reset_index()
+    urg_counts.columns = ['Tipo', 'Cantidad']
+    colors_list = [URGENCY_COLORS.get(t, '#95a5a6') for t in urg_counts['Tipo']]
+
+    fig_urg_donut = go.Figure(data=[go.Pie(
+        labels=urg_counts['Tipo'].str.replace('Urgencia ', '').str.replace('Ambulatoria ', ''),
+        values=urg_counts['Cantidad'],
+        hole=0.4,
+        marker=dict(colors=colors_list, line=dict(color='white', width=2)),
+        textinfo='label+percent', textposition='outside', textfont=dict(size=11),
+        hovertemplate='<b>%{label}</b><br>Cantidad: <b>%{value}</b><br>%{percent}<extra></extra>',
+    )])
+    fig_urg_donut.update_layout(
+        showlegend=False, height=400,
+        annotations=[dict(text=f"{total_urg}", x=0.5, y=0.5, font=dict(size=18, weight='bold'), showarrow=False)],
+        margin=dict(l=20, r=20, t=20, b=20),
+    )
+    return fig_urg_donut
+
+
+def figure_top_tipos(cube, total_count):
+    counts = cube_counts(cube, COL_TIPO_ESTAB).reset_index()
+    counts.columns = ['Tipo de Establecimiento', 'Cantidad']
+    counts['Porcentaje'] = (counts['Cantidad'] / total_count * 100)
+    data_top = counts.head(20)
+
+    fig_types = go.Figure(go.Bar(
+        x=data_top['Cantidad'], y=data_top['Tipo de Establecimiento'],
+        orientation='h',
+        marker_color=sequential.Blues[-2],
+        text=[f'{n} ({p:.1f}%)' for n, p in zip(data_top['Cantidad'], data_top['Porcentaje'])],
+        textposition='outside',
+        hovertemplate='<b>%{y}</b><br>Cantidad: <b>%{x}</b><extra></extra>'
+    ))
+    fig_types.update_layout(
+        height=max(500, len(data_top) * 35),
+        margin=dict(l=50, r=150, t=30, b=50),
+        yaxis={'categoryorder': 'total ascending'}, showlegend=False,
+        xaxis_title='Cantidad', yaxis_title='Tipo',
+    )
+    return fig_types
+
+
+@st.fragment
+def visualizar_mapa(map_data, spatial_index=None):
     if not all(col in map_data.columns for col in [COL_LAT, COL_LON]):
         st.warning(f"Faltan columnas '{COL_LAT}' o '{COL_LON}' para el mapa.")
         return
@@ -121,92 +445,97 @@ def visualizar_mapa(map_data):
         st.warning("No hay datos con coordenadas geográficas válidas.")
         return
 
-    if COL_SISTEMA in map_data_valid.columns:
-        map_data_valid = map_data_valid.assign(_sistema=map_data_valid[COL_SISTEMA].map(classify_sistema))
-    else:
-        map_data_valid = map_data_valid.assign(_sistema='Otros')
-
-    # Pre-build tooltip strings (vectorized)
-    tooltip_parts = []
-    if COL_NOMBRE in map_data_valid.columns:
-        tooltip_parts.append('<b>' + map_data_valid[COL_NOMBRE].astype(str) + '</b>')
-    if COL_TIPO_ESTAB in map_data_valid.columns:
-        tooltip_parts.append(map_data_valid[COL_TIPO_ESTAB].astype(str))
-    if COL_COMUNA in map_data_valid.columns and COL_REGION in map_data_valid.columns:
-        tooltip_parts.append(map_data_valid[COL_COMUNA].astype(str) + ', ' + map_data_valid[COL_REGION].astype(str))
-    tooltip_series = tooltip_parts[0] if tooltip_parts else pd.Series('', index=map_data_valid.index)
-    for part in tooltip_parts[1:]:
-        tooltip_series = tooltip_series + '<br>' + part
-
-    # Pre-compute lists for fast iteration
-    lats = map_data_valid[COL_LAT].tolist()
-    lons = map_data_valid[COL_LON].tolist()
-    colors = map_data_valid['_sistema'].map(SYSTEM_COLORS).tolist()
-    tooltips = tooltip_series.tolist()
-
-    # Create Folium map
-    m = folium.Map(
-        location=[-35.5, -71.5],
-        zoom_start=5,
-        tiles='OpenStreetMap',
-        control_scale=True,
-    )
+    # Current view, as last reported by the map component (pan/zoom only reruns this fragment)
+    view = st.session_state.get(MAP_KEY) or {}
+    zoom = max(int(view.get('zoom') or MAP_ZOOM), 0)
+    bounds = view.get('bounds')
+
+    # Facility picked in the explorer search. st_folium only moves the map when center/zoom
+    # change, so they are passed on every run; the first run draws the focused area itself
+    focus = st.session_state.get(MAP_FOCUS_KEY)
+    center = focus_zoom = None
+    if focus:
+        center, focus_zoom = (focus['lat'], focus['lon']), MAP_FOCUS_ZOOM
+        if not focus.get('shown'):
+            zoom, bounds = MAP_FOCUS_ZOOM, focus_bounds(focus['lat'], focus['lon'])
+            focus['shown'] = True
+
+    # Imported here so sections without the map never load folium
+    from streamlit_folium import st_folium
+
+    # A pan/zoom rerun has no open rerun record, so this span is logged on its own
+    with profiler.span('visualizar_mapa'):
+        layer = data_layer(map_data, map_data_valid, spatial_index, zoom, bounds)
+        if focus:
+            focus_marker(focus['lat'], focus['lon'], focus['nombre']).add_to(layer)
+
+        st_folium(
+            base_map(), key=MAP_KEY, feature_group_to_add=layer, returned_objects=['zoom', 'bounds'],
+            center=center, zoom=focus_zoom, use_container_width=True, height=700,
+        )
+
+
+def focus_map(lat, lon, name):
+    # "Ver en el mapa" in the explorer search: opens the map section centered on the facility
+    st.session_state[MAP_FOCUS_KEY] = {'lat': lat, 'lon': lon, 'nombre': name}
+    st.session_state['seccion'] = tab_titles[0]
+
+
+def render_debug_panel(profiler, metrics):
+    with st.sidebar.expander("Depuración: tiempos por sección", expanded=True):
+        reruns = profiler.recent('rerun')
+        if reruns:
+            last = reruns[-1]
+            st.caption(f"Última ejecución: **{last['total_ms']:,.1f} ms** ({last['labels'].get('seccion', '')})")
+            st.dataframe(
+                [
+                    {
+                        'Sección': '\u2003' * span['depth'] + span['name'],
+                        'ms': span['ms'],
+                        '% del total': span['ms'] / last['total_ms'] * 100 if last['total_ms'] else 0,
+                        'Memoria pico (MB)': span.get('peak_mb'),
+                    }
+                    for span in last['spans']
+                ],
+                hide_index=True, use_container_width=True,
+                column_config={
+                    'ms': st.column_config.NumberColumn(format="%.1f"),
+                    '% del total': st.column_config.NumberColumn(format="%.0f%%"),
+                    'Memoria pico (MB)': st.column_config.NumberColumn(format="%.2f"),
+                },
+            )
+
+        # Fragment reruns (map pan/zoom) and deferred downloads are logged as their own records
+        others = [record for record in profiler.recent() if record['kind'] != 'rerun'][-10:]
+        if others:
+            st.markdown("**Fragmentos y descargas**")
+            st.dataframe(
+                [{'Tipo': r['kind'], 'Hora': r['timestamp'][11:], 'ms': r['total_ms']} for r in reversed(others)],
+                hide_index=True, use_container_width=True,
+            )
+
+        st.markdown(f"**Sesión ({len(reruns)} ejecuciones)**")
+        st.dataframe(
+            profiler.summary(), hide_index=True, use_container_width=True,
+            column_config={'name': 'Sección', 'n': 'Ejecuciones', 'p50_ms': 'p50 (ms)', 'p95_ms': 'p95 (ms)', 'max_ms': 'Máx. (ms)'},
+        )
 
-    # MarkerCluster with Leaflet.markercluster styling (green→yellow→orange→red)
-    cluster = MarkerCluster(
-        options={
-            'maxClusterRadius': 50,
-            'spiderfyOnMaxZoom': True,
-            'showCoverageOnHover': True,
-            'zoomToBoundsOnClick': True,
-        }
-    ).add_to(m)
-
-    # Add CircleMarkers (much lighter than Marker icons)
-    for lat, lon, color, tip in zip(lats, lons, colors, tooltips):
-        folium.CircleMarker(
-            location=[lat, lon],
-            radius=7,
-            color='white',
-            weight=1.5,
-            fill=True,
-            fill_color=color,
-            fill_opacity=0.85,
-            tooltip=tip,
-        ).add_to(cluster)
-
-    # Floating legend on the map
-    legend_html = '''
-    <div style="position:fixed;bottom:30px;right:30px;z-index:1000;
-        background:white;padding:10px 15px;border-radius:8px;
-        box-shadow:0 2px 10px rgba(0,0,0,0.15);font-size:13px;
-        font-family:Roboto,sans-serif;line-height:1.8;">
-        <b>Sistema de Salud</b><br>
-        <span style="display:inline-block;width:11px;height:11px;border-radius:50%;
-            background:#27ae60;border:1.5px solid white;box-shadow:0 0 2px rgba(0,0,0,0.3);
-            vertical-align:middle;margin-right:5px;"></span>Público<br>
-        <span style="display:inline-block;width:11px;height:11px;border-radius:50%;
-            background:#c0392b;border:1.5px solid white;box-shadow:0 0 2px rgba(0,0,0,0.3);
-            vertical-align:middle;margin-right:5px;"></span>Privado<br>
-        <span style="display:inline-block;width:11px;height:11px;border-radius:50%;
-            background:#7f8c8d;border:1.5px solid white;box-shadow:0 0 2px rgba(0,0,0,0.3);
-            vertical-align:middle;margin-right:5px;"></span>Otros
-    </div>
-    '''
-    m.get_root().html.add_child(folium.Element(legend_html))
-
-    st_folium(m, use_container_width=True, height=700, returned_objects=[])
+        if st.checkbox("Métricas (formato Prometheus)", key='debug_prometheus'):
+            st.code(metrics.prometheus_text(), language='text')
 
 
 # --- Main App Logic ---
 
 # Load Data
+profiler.section('carga_datos')
 with st.spinner('Cargando datos de establecimientos de salud...'):
-    df, error = load_data()
+    dataset, error = load_dataset()
 
 if error:
-    st.error(f"Error al cargar los datos: {error}")
+    st.error(error)
     st.stop()
+drop_stale_caches(dataset.version)
+df = dataset.df
 
 # Sidebar
 st.sidebar.title("Bienvenido")
@@ -219,7 +548,9 @@ st.sidebar.info(f"""
 """)
 
 # Sidebar Filters
+profiler.section('filtros')
 df_filtered = df
+filters_selected = {}
 if not df.empty:
     st.sidebar.markdown("### Filtros")
 
@@ -231,16 +562,16 @@ if not df.empty:
 
     st.sidebar.markdown("---")
 
+    filter_index = dataset.filter_index
+
     filters_selected = {
-        COL_REGION: create_multiselect_filter(df, COL_REGION, "Regiones", 'regiones_sel'),
-        COL_TIPO_ESTAB: create_multiselect_filter(df, COL_TIPO_ESTAB, "Tipos de Establecimiento", 'tipos_sel'),
-        COL_SISTEMA: create_multiselect_filter(df, COL_SISTEMA, "Sistema de Salud", 'sistemas_sel'),
-        COL_ESTADO: create_multiselect_filter(df, COL_ESTADO, "Estado de Funcionamiento", 'estados_sel'),
-        COL_DEPENDENCIA: create_multiselect_filter(df, COL_DEPENDENCIA, "Dependencia Administrativa", 'dependencia_sel'),
+        COL_REGION: create_multiselect_filter(filter_index, COL_REGION, "Regiones", 'regiones_sel'),
+        COL_TIPO_ESTAB: create_multiselect_filter(filter_index, COL_TIPO_ESTAB, "Tipos de Establecimiento", 'tipos_sel'),
+        COL_SISTEMA: create_multiselect_filter(filter_index, COL_SISTEMA, "Sistema de Salud", 'sistemas_sel'),
+        COL_ESTADO: create_multiselect_filter(filter_index, COL_ESTADO, "Estado de Funcionamiento", 'estados_sel'),
+        COL_DEPENDENCIA: create_multiselect_filter(filter_index, COL_DEPENDENCIA, "Dependencia Administrativa", 'dependencia_sel'),
     }
 
-    df_filtered = apply_filters(df, filters_selected)
-
     # Plaza EDF filter
     if COL_PLAZA_EDF in df.columns:
         st.sidebar.markdown("---")
@@ -251,475 +582,388 @@ if not df.empty:
             help="Filtrar solo establecimientos con plazas EDF disponibles en la Región Metropolitana",
             key='plaza_edf_sel'
         )
-        if plaza_edf_filter:
-            df_filtered = df_filtered[df_filtered[COL_PLAZA_EDF] == True]
+        filters_selected[COL_PLAZA_EDF] = [True] if plaza_edf_filter else []
 
         if COL_SERVICIO_EDF in df.columns:
-            servicios_disponibles = sorted(df[df[COL_PLAZA_EDF] == True][COL_SERVICIO_EDF].unique().tolist())
-            servicio_sel = st.sidebar.multiselect(
+            # ServicioSaludEDF is only filled for rows matched as Plaza EDF
+            servicios_disponibles = filter_index['options'].get(COL_SERVICIO_EDF, [])
+            filters_selected[COL_SERVICIO_EDF] = st.sidebar.multiselect(
                 "Servicio de Salud EDF",
                 options=servicios_disponibles,
                 default=st.session_state.get('servicio_edf_sel', []),
                 help="Filtrar por Servicio de Salud de las plazas EDF",
                 key='servicio_edf_sel'
             )
-            if servicio_sel:
-                df_filtered = df_filtered[df_filtered[COL_SERVICIO_EDF].isin(servicio_sel)]
+
+    df_filtered = apply_filters(df, filters_selected, filter_index)
 
     st.sidebar.markdown("---")
     st.sidebar.markdown(f"**Establecimientos filtrados:** {len(df_filtered):,}")
 
+# KPIs and crosstabs are answered from the count cube sliced by the same filters
+profiler.section('cubo')
+cube = dataset.cube(filters_selected)
+
 # --- Main Panel ---
 st.title("Establecimientos de Salud en Chile")
 
 # --- KPIs ---
+profiler.section('kpis')
 if not df_filtered.empty:
-    total_filtered = len(df_filtered)
+    kpis = dataset.kpis(filters_selected)
+    total_filtered = kpis['total']
 
     # Row 1: Core metrics
     col1, col2, col3 = st.columns(3)
     with col1:
         st.metric("Total Establecimientos", f"{total_filtered:,}")
     with col2:
-        if COL_TIPO_URGENCIA in df_filtered.columns:
-            urg_count = df_filtered[df_filtered[COL_TIPO_URGENCIA].isin(
-                [k for k in URGENCY_COLORS if k != 'Otros']
-            )].shape[0]
-            if urg_count == 0:
-                urg_count = df_filtered[COL_URGENCIA].value_counts().get("SI", 0) if COL_URGENCIA in df_filtered.columns else 0
-            urg_perc = (urg_count / total_filtered * 100) if total_filtered else 0
-            st.metric("Servicios de Urgencia", f"{urg_count:,} ({urg_perc:.1f}%)")
-        else:
-            st.metric("Servicios de Urgencia", "N/A")
+        share_metric("Servicios de Urgencia", kpis['urgencias'], total_filtered)
     with col3:
-        if COL_SISTEMA in df_filtered.columns:
-            public_count = df_filtered[df_filtered[COL_SISTEMA] == "Público"].shape[0]
-            public_perc = (public_count / total_filtered * 100) if total_filtered else 0
-            st.metric("Sistema Público", f"{public_count:,} ({public_perc:.1f}%)")
-        else:
-            st.metric("Sistema Público", "N/A")
+        share_metric("Sistema Público", kpis['publico'], total_filtered)
 
     # Row 2: Structural metrics
     col4, col5, col6 = st.columns(3)
     with col4:
-        if COL_TIPO_ATENCION in df_filtered.columns:
-            amb = df_filtered[df_filtered[COL_TIPO_ATENCION].str.contains('Abierta', case=False, na=False)].shape[0]
-            amb_perc = (amb / total_filtered * 100) if total_filtered else 0
-            st.metric("Atención Ambulatoria", f"{amb:,} ({amb_perc:.1f}%)")
-        else:
-            st.metric("Atención Ambulatoria", "N/A")
+        share_metric("Atención Ambulatoria", kpis['ambulatoria'], total_filtered)
     with col5:
-        if COL_COMUNA in df_filtered.columns and COL_URGENCIA in df_filtered.columns:
-            total_comunas = df_filtered[COL_COMUNA].nunique()
-            comunas_urg = df_filtered[df_filtered[COL_URGENCIA] == 'SI'][COL_COMUNA].nunique()
-            sin_cobertura = total_comunas - comunas_urg
-            st.metric("Cobertura Comunal de Urgencia", f"{comunas_urg} / {total_comunas}", delta=f"-{sin_cobertura} sin cobertura", delta_color="inverse")
+        if kpis['comunas'] is not None:
+            sin_cobertura = kpis['comunas'] - kpis['comunas_con_urgencia']
+            st.metric("Cobertura Comunal de Urgencia", f"{kpis['comunas_con_urgencia']} / {kpis['comunas']}", delta=f"-{sin_cobertura} sin cobertura", delta_color="inverse")
         else:
             st.metric("Cobertura Comunal de Urgencia", "N/A")
     with col6:
-        if COL_DEPENDENCIA in df_filtered.columns:
-            mun = df_filtered[df_filtered[COL_DEPENDENCIA] == 'Municipal'].shape[0]
-            mun_perc = (mun / total_filtered * 100) if total_filtered else 0
-            st.metric("Dependencia Municipal", f"{mun:,} ({mun_perc:.1f}%)")
-        else:
-            st.metric("Dependencia Municipal", "N/A")
+        share_metric("Dependencia Municipal", kpis['municipal'], total_filtered)
 else:
     st.warning("No hay datos para mostrar con los filtros seleccionados.")
 
 # --- Tabs ---
 tab_titles = ["Panorama Nacional", "Evolución Histórica", "Red de Urgencias", "Explorador de Datos"]
-tab1, tab2, tab3, tab4 = st.tabs(tab_titles)
+# Only the selected section runs; the selection is kept in the URL (?seccion=...)
+tab1, tab2, tab3, tab4 = st.tabs(tab_titles, key='seccion', bind='query-params')
+profiler.label(seccion=st.session_state.get('seccion'), filtros=sum(len(v) > 0 for v in filters_selected.values()))
 
 # =====================================================
 # TAB 1: PANORAMA NACIONAL
 # =====================================================
 with tab1:
-    st.subheader("Distribución Geográfica")
-    visualizar_mapa(df_filtered)
-
-    st.divider()
-
-    # --- Region x System stacked bar ---
-    st.subheader('Establecimientos por Región y Sistema de Salud')
-    if all(c in df_filtered.columns for c in [COL_REGION, COL_SISTEMA]):
-        df_plot = df_filtered.copy()
-        df_plot[COL_SISTEMA] = df_plot[COL_SISTEMA].map(classify_sistema)
-
-        region_sistema = pd.crosstab(df_plot[COL_REGION], df_plot[COL_SISTEMA]).reset_index()
-        for col in SYSTEM_COLORS.keys():
-            if col not in region_sistema.columns:
-                region_sistema[col] = 0
-
-        ordered_cols = [COL_REGION] + list(SYSTEM_COLORS.keys())
-        region_sistema = region_sistema[ordered_cols]
-        region_total_counts = df_filtered[COL_REGION].value_counts()
-        region_sistema = region_sistema.set_index(COL_REGION).loc[region_total_counts.index].reset_index()
-
-        fig_region_sys = go.Figure()
-        for col in SYSTEM_COLORS.keys():
-            fig_region_sys.add_trace(go.Bar(
-                name=col,
-                y=region_sistema[COL_REGION],
-                x=region_sistema[col],
-                orientation='h',
-                marker_color=SYSTEM_COLORS[col],
-                hovertemplate=f'<b>%{{y}}</b><br>{col}: <b>%{{x}}</b><extra></extra>'
-            ))
+    if tab1.open:
+        profiler.section(tab_titles[0])
+        st.subheader("Distribución Geográfica")
+        spatial_index = load_spatial_index()
+        visualizar_mapa(df_filtered, spatial_index)
 
-        fig_region_sys.update_layout(
-            barmode='stack',
-            yaxis={'categoryorder': 'total ascending'},
-            height=600,
-            showlegend=True,
-            legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="center", x=0.5, title='Sistema de Salud'),
-            margin=dict(l=50, r=50, t=50, b=50),
-            xaxis_title='Cantidad de Establecimientos',
-            yaxis_title='Región'
-        )
-        st.plotly_chart(fig_region_sys, use_container_width=True)
-
-    st.divider()
-
-    # --- Gobernanza: Region x Dependency ---
-    st.subheader('Gobernanza: Dependencia Administrativa por Región')
-    if all(c in df_filtered.columns for c in [COL_REGION, COL_DEPENDENCIA]):
-        df_gov = df_filtered.copy()
-        df_gov['_dep'] = df_gov[COL_DEPENDENCIA].apply(simplify_dependency)
-
-        region_dep = pd.crosstab(df_gov[COL_REGION], df_gov['_dep']).reset_index()
-        for col in DEPENDENCY_COLORS.keys():
-            if col not in region_dep.columns:
-                region_dep[col] = 0
-
-        ordered_dep_cols = [COL_REGION] + list(DEPENDENCY_COLORS.keys())
-        region_dep = region_dep[[c for c in ordered_dep_cols if c in region_dep.columns]]
-        region_dep['_total'] = region_dep.select_dtypes(include='number').sum(axis=1)
-        region_dep = region_dep.sort_values('_total', ascending=True).drop(columns='_total')
-
-        fig_gov = go.Figure()
-        for dep_name in DEPENDENCY_COLORS.keys():
-            if dep_name in region_dep.columns:
-                fig_gov.add_trace(go.Bar(
-                    name=dep_name,
-                    y=region_dep[COL_REGION],
-                    x=region_dep[dep_name],
-                    orientation='h',
-                    marker_color=DEPENDENCY_COLORS[dep_name],
-                    hovertemplate=f'<b>%{{y}}</b><br>{dep_name}: <b>%{{x}}</b><extra></extra>'
-                ))
-
-        fig_gov.update_layout(
-            barmode='stack',
-            height=600,
-            showlegend=True,
-            legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="center", x=0.5, title='Dependencia'),
-            margin=dict(l=50, r=50, t=50, b=50),
-            xaxis_title='Cantidad de Establecimientos',
-            yaxis_title='Región'
-        )
-        st.plotly_chart(fig_gov, use_container_width=True)
-
-    st.divider()
-
-    # --- Distribución por Nivel de Atención y Complejidad (side by side) ---
-    st.subheader("Niveles de Atención y Complejidad")
-    col_d1, col_d2 = st.columns(2)
-
-    with col_d1:
-        if COL_NIVEL_ATENCION in df_filtered.columns:
-            counts_na = df_filtered[COL_NIVEL_ATENCION].value_counts().reset_index()
-            counts_na.columns = ['Label', 'Cantidad']
-            fig_na = go.Figure(data=[go.Pie(
-                labels=counts_na['Label'], values=counts_na['Cantidad'],
-                hole=0.4,
-                marker=dict(colors=DEFAULT_PLOTLY_COLORS, line=dict(color='white', width=2)),
-                textinfo='label+percent', textposition='outside', textfont=dict(size=11),
-                hovertemplate='<b>%{label}</b><br>Cantidad: <b>%{value}</b><br>%{percent}<extra></extra>',
-            )])
-            fig_na.update_layout(
-                title={'text': 'Nivel de Atención', 'y': 0.95, 'x': 0.5, 'xanchor': 'center', 'font': dict(size=16)},
-                showlegend=False, height=420,
-                annotations=[dict(text="Atención", x=0.5, y=0.5, font=dict(size=13), showarrow=False)],
-                margin=dict(l=20, r=20, t=60, b=20),
-            )
-            st.plotly_chart(fig_na, use_container_width=True)
-
-    with col_d2:
-        if COL_NIVEL_COMPLEJIDAD in df_filtered.columns:
-            counts_nc = df_filtered[COL_NIVEL_COMPLEJIDAD].value_counts().reset_index()
-            counts_nc.columns = ['Label', 'Cantidad']
-            fig_nc = go.Figure(data=[go.Pie(
-                labels=counts_nc['Label'], values=counts_nc['Cantidad'],
-                hole=0.4,
-                marker=dict(colors=DEFAULT_PLOTLY_COLORS, line=dict(color='white', width=2)),
-                textinfo='label+percent', textposition='outside', textfont=dict(size=11),
-                hovertemplate='<b>%{label}</b><br>Cantidad: <b>%{value}</b><br>%{percent}<extra></extra>',
-            )])
-            fig_nc.update_layout(
-                title={'text': 'Nivel de Complejidad', 'y': 0.95, 'x': 0.5, 'xanchor': 'center', 'font': dict(size=16)},
-                showlegend=False, height=420,
-                annotations=[dict(text="Complejidad", x=0.5, y=0.5, font=dict(size=13), showarrow=False)],
-                margin=dict(l=20, r=20, t=60, b=20),
-            )
-            st.plotly_chart(fig_nc, use_container_width=True)
+        st.divider()
+
+        # --- Region x System stacked bar ---
+        st.subheader('Establecimientos por Región y Sistema de Salud')
+        if all(c in df_filtered.columns for c in [COL_REGION, COL_SISTEMA]):
+            fig_region_sys = cached_figure('region_sistema', filters_selected, figure_region_sistema, cube)
+            st.plotly_chart(fig_region_sys, use_container_width=True)
+
+        st.divider()
+
+        # --- Gobernanza: Region x Dependency ---
+        st.subheader('Gobernanza: Dependencia Administrativa por Región')
+        if all(c in df_filtered.columns for c in [COL_REGION, COL_DEPENDENCIA]):
+            fig_gov = cached_figure('gobernanza', filters_selected, figure_gobernanza, cube)
+            st.plotly_chart(fig_gov, use_container_width=True)
+
+        st.divider()
+
+        # --- Distribución por Nivel de Atención y Complejidad (side by side) ---
+        st.subheader("Niveles de Atención y Complejidad")
+        col_d1, col_d2 = st.columns(2)
+
+        with col_d1:
+            if COL_NIVEL_ATENCION in df_filtered.columns:
+                fig_na = cached_figure(
+                    'nivel_atencion', filters_selected, figure_nivel, cube, COL_NIVEL_ATENCION, 'Nivel de Atención', "Atención"
+                )
+                st.plotly_chart(fig_na, use_container_width=True)
+
+        with col_d2:
+            if COL_NIVEL_COMPLEJIDAD in df_filtered.columns:
+                fig_nc = cached_figure(
+                    'nivel_complejidad', filters_selected, figure_nivel, cube, COL_NIVEL_COMPLEJIDAD, 'Nivel de Complejidad', "Complejidad"
+                )
+                st.plotly_chart(fig_nc, use_container_width=True)
 
 
 # =====================================================
 # TAB 2: EVOLUCIÓN HISTÓRICA
 # =====================================================
 with tab2:
-    st.subheader("Inauguración de Establecimientos por Año")
-    st.info("Evolución anual de nuevos establecimientos. Ajusta el rango con el slider.")
-
-    if all(c in df_filtered.columns for c in [COL_FECHA_INICIO, COL_NIVEL_COMPLEJIDAD]):
-        df_hist = df_filtered.copy()
-        df_hist[COL_FECHA_INICIO] = pd.to_datetime(df_hist[COL_FECHA_INICIO], errors='coerce')
-        df_hist = df_hist.dropna(subset=[COL_FECHA_INICIO])
-        df_hist['Año'] = df_hist[COL_FECHA_INICIO].dt.year.astype(int)
-
-        if not df_hist.empty:
-            min_year = max(int(df_hist['Año'].min()), 2000)
-            max_year = int(df_hist['Año'].max())
-
-            year_range = st.slider("Rango de años", min_value=min_year, max_value=max_year, value=(min_year, max_year))
-            df_hist = df_hist[(df_hist['Año'] >= year_range[0]) & (df_hist['Año'] <= year_range[1])]
-
-            niveles_complejidad = list(COMPLEXITY_COLORS.keys())
-            df_hist_c = df_hist[df_hist[COL_NIVEL_COMPLEJIDAD].isin(niveles_complejidad)]
-
-            view_mode = st.radio("Vista", ["Anual", "Acumulado"], horizontal=True)
-
-            if not df_hist_c.empty:
-                df_agrupado = df_hist_c.groupby(['Año', COL_NIVEL_COMPLEJIDAD]).size().reset_index(name='Cantidad')
-
-                if view_mode == "Acumulado":
-                    df_agrupado = df_agrupado.sort_values('Año')
-                    df_agrupado['Cantidad'] = df_agrupado.groupby(COL_NIVEL_COMPLEJIDAD)['Cantidad'].cumsum()
-
-                fig_hist = go.Figure()
-                for nivel in niveles_complejidad:
-                    df_nivel = df_agrupado[df_agrupado[COL_NIVEL_COMPLEJIDAD] == nivel]
-                    if not df_nivel.empty:
-                        mode = 'lines+markers' if view_mode == "Acumulado" else 'lines+markers+text'
-                        fig_hist.add_trace(go.Scatter(
-                            x=df_nivel['Año'], y=df_nivel['Cantidad'],
-                            mode=mode, name=nivel,
-                            line=dict(color=COMPLEXITY_COLORS.get(nivel, '#3498db'), width=3),
-                            marker=dict(size=8),
-                            text=df_nivel['Cantidad'] if view_mode == "Anual" else None,
-                            textposition='top center',
-                            hovertemplate=f'<b>%{{x}}</b><br>{nivel}: <b>%{{y}}</b><extra></extra>'
-                        ))
-
-                y_title = 'Acumulado de Establecimientos' if view_mode == "Acumulado" else 'Establecimientos Inaugurados'
-                unique_years = sorted(df_hist_c['Año'].unique())
-                fig_hist.update_layout(
-                    xaxis_title='Año', yaxis_title=y_title,
-                    hovermode='closest',
-                    xaxis=dict(tickmode='array', tickvals=unique_years, ticktext=unique_years, gridcolor='lightgray'),
-                    yaxis=dict(gridcolor='lightgray'),
-                    plot_bgcolor='white', height=550,
-                    margin=dict(l=50, r=50, t=50, b=50),
-                    legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="center", x=0.5),
-                )
-                st.plotly_chart(fig_hist, use_container_width=True)
-
-                # Table
-                st.divider()
-                st.subheader("Detalle por Año")
-                tabla = df_agrupado.pivot_table(
-                    values='Cantidad', index='Año', columns=COL_NIVEL_COMPLEJIDAD,
-                    aggfunc='sum', fill_value=0
-                ).astype(int).sort_index()
-                st.dataframe(tabla, use_container_width=True)
+    if tab2.open:
+        profiler.section(tab_titles[1])
+        st.subheader("Inauguración de Establecimientos por Año")
+        st.info("Evolución anual de nuevos establecimientos. Ajusta el rango con el slider.")
+
+        if all(c in df_filtered.columns for c in [COL_FECHA_INICIO, COL_NIVEL_COMPLEJIDAD]):
+            # Prefix sums for the current filters; the slider and the view only pick rows of them
+            series = dataset.series(filters_selected)
+
+            if series is not None:
+                min_year = max(series['first_year'], HIST_MIN_YEAR)
+                max_year = series['last_year']
+
+                year_range = st.slider("Rango de años", min_value=min_year, max_value=max_year, value=(min_year, max_year))
+                view_mode = st.radio("Vista", ["Anual", "Acumulado"], horizontal=True)
+                values, opened = series_window(series, *year_range, cumulative=view_mode == "Acumulado")
+
+                if opened.to_numpy().any():
+                    fig_hist, tabla = cached_figure(
+                        'historico', filters_selected, figure_historico, values, opened, view_mode,
+                        params={'years': year_range, 'view': view_mode},
+                    )
+                    st.plotly_chart(fig_hist, use_container_width=True)
+
+                    # Table
+                    st.divider()
+                    st.subheader("Detalle por Año")
+                    st.dataframe(tabla, use_container_width=True)
+                else:
+                    st.warning("No hay datos de complejidad válidos para el rango seleccionado.")
             else:
-                st.warning("No hay datos de complejidad válidos para el rango seleccionado.")
+                st.warning("No hay registros con fechas de inicio válidas.")
         else:
-            st.warning("No hay registros con fechas de inicio válidas.")
-    else:
-        st.warning(f"Faltan columnas requeridas para el análisis histórico.")
+            st.warning(f"Faltan columnas requeridas para el análisis histórico.")
+
+        # Registry changes between snapshots, from the versioned store (whole registry, no filters)
+        store = load_snapshot_store()
+        snapshots = store.snapshots()['Snapshot']
+        if len(snapshots) > 1:
+            st.divider()
+            st.subheader("Altas, Bajas y Cambios de Estado por Snapshot")
+            st.caption("Registro completo según los snapshots publicados; no aplica los filtros de la barra lateral.")
+            events = store.event_counts(COL_ESTADO)
+            fig_events = cached_figure(
+                'snapshots', {}, figure_snapshots, events, params={'snapshots': snapshots.tolist()}
+            )
+            st.plotly_chart(fig_events, use_container_width=True)
+
+            fechas = snapshots.dt.date.tolist()
+            desde, hasta = st.select_slider(
+                "Comparar snapshots", options=fechas, value=(fechas[-2], fechas[-1]),
+                format_func=lambda fecha: fecha.strftime('%d-%m-%Y'),
+            )
+            if desde != hasta:
+                cambios = store.changes(desde, hasta, columns=[COL_NOMBRE, COL_REGION, COL_COMUNA])
+                c1, c2, c3 = st.columns(3)
+                conteo = cambios['Cambio'].value_counts()
+                c1.metric("Altas", f"{conteo.get('alta', 0):,}")
+                c2.metric("Bajas", f"{conteo.get('baja', 0):,}")
+                c3.metric("Modificaciones", f"{conteo.get('modificacion', 0):,}")
+                st.dataframe(cambios, use_container_width=True, hide_index=True)
+        elif len(snapshots) == 1:
+            st.caption("Las altas y bajas entre snapshots se muestran desde el segundo snapshot agregado al almacén histórico.")
 
 
 # =====================================================
 # TAB 3: RED DE URGENCIAS
 # =====================================================
 with tab3:
-    st.subheader("Red de Servicios de Urgencia")
-    st.info("Análisis de cobertura y tipología de la red de urgencias a nivel nacional.")
-
-    if COL_TIPO_URGENCIA in df_filtered.columns:
-        # Filter to actual urgency services
-        urgency_types = [k for k in URGENCY_COLORS if k != 'Otros']
-        df_urg = df_filtered[df_filtered[COL_TIPO_URGENCIA].isin(urgency_types)].copy()
-
-        # Also include minor types grouped as "Otros"
-        minor_urgency = df_filtered[
-            (~df_filtered[COL_TIPO_URGENCIA].isin(urgency_types)) &
-            (df_filtered[COL_TIPO_URGENCIA] != 'No Aplica') &
-            (df_filtered[COL_TIPO_URGENCIA] != 'SIN DATO') &
-            (df_filtered[COL_TIPO_URGENCIA].notna())
-        ].copy()
-        minor_urgency[COL_TIPO_URGENCIA] = 'Otros'
-        df_urg_all = pd.concat([df_urg, minor_urgency], ignore_index=True)
-
-        total_urg = len(df_urg_all)
-
-        # Mini KPIs
-        k1, k2, k3 = st.columns(3)
-        with k1:
-            st.metric("Total Servicios de Urgencia", f"{total_urg:,}")
-        with k2:
-            total_comunas = df_filtered[COL_COMUNA].nunique()
-            comunas_con = df_filtered[df_filtered[COL_URGENCIA] == 'SI'][COL_COMUNA].nunique()
-            comunas_sin = total_comunas - comunas_con
-            st.metric("Comunas Sin Cobertura", f"{comunas_sin}", delta=f"de {total_comunas} totales", delta_color="inverse")
-        with k3:
-            ueh = df_urg_all[df_urg_all[COL_TIPO_URGENCIA] == 'Urgencia Hospitalaria (UEH)'].shape[0]
-            sapu = df_urg_all[df_urg_all[COL_TIPO_URGENCIA] == 'Urgencia Ambulatoria (SAPU)'].shape[0]
-            ratio = f"{ueh/sapu:.2f}" if sapu > 0 else "N/A"
-            st.metric("Ratio Hospitalaria / SAPU", ratio, help="Relación entre urgencias hospitalarias (UEH) y atención primaria (SAPU)")
-
-        st.divider()
-
-        # --- Urgency types by region (stacked bar) ---
-        st.subheader("Tipos de Urgencia por Región")
-        if COL_REGION in df_urg_all.columns and not df_urg_all.empty:
-            region_urg = pd.crosstab(df_urg_all[COL_REGION], df_urg_all[COL_TIPO_URGENCIA]).reset_index()
-
-            for col in URGENCY_COLORS.keys():
-                if col not in region_urg.columns:
-                    region_urg[col] = 0
-
-            region_urg['_total'] = region_urg.select_dtypes(include='number').sum(axis=1)
-            region_urg = region_urg.sort_values('_total', ascending=True).drop(columns='_total')
-
-            fig_urg_region = go.Figure()
-            for urg_type, color in URGENCY_COLORS.items():
-                if urg_type in region_urg.columns:
-                    fig_urg_region.add_trace(go.Bar(
-                        name=urg_type.replace('Urgencia ', '').replace('Ambulatoria ', ''),
-                        y=region_urg[COL_REGION],
-                        x=region_urg[urg_type],
-                        orientation='h',
-                        marker_color=color,
-                        hovertemplate=f'<b>%{{y}}</b><br>{urg_type}: <b>%{{x}}</b><extra></extra>'
-                    ))
-
-            fig_urg_region.update_layout(
-                barmode='stack', height=600,
-                legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="center", x=0.5, title='Tipo de Urgencia'),
-                margin=dict(l=50, r=50, t=50, b=50),
-                xaxis_title='Cantidad', yaxis_title='Región',
-            )
-            st.plotly_chart(fig_urg_region, use_container_width=True)
-
-        st.divider()
+    if tab3.open:
+        profiler.section(tab_titles[2])
+        st.subheader("Red de Servicios de Urgencia")
+        st.info("Análisis de cobertura y tipología de la red de urgencias a nivel nacional.")
 
-        # --- Urgency type donut ---
-        col_u1, col_u2 = st.columns([1, 1])
-        with col_u1:
-            st.subheader("Distribución por Tipo")
-            urg_counts = df_urg_all[COL_TIPO_URGENCIA].value_counts().reset_index()
-            urg_counts.columns = ['Tipo', 'Cantidad']
-            colors_list = [URGENCY_COLORS.get(t, '#95a5a6') for t in urg_counts['Tipo']]
-
-            fig_urg_donut = go.Figure(data=[go.Pie(
-                labels=urg_counts['Tipo'].str.replace('Urgencia ', '').str.replace('Ambulatoria ', ''),
-                values=urg_counts['Cantidad'],
-                hole=0.4,
-                marker=dict(colors=colors_list, line=dict(color='white', width=2)),
-                textinfo='label+percent', textposition='outside', textfont=dict(size=11),
-                hovertemplate='<b>%{label}</b><br>Cantidad: <b>%{value}</b><br>%{percent}<extra></extra>',
-            )])
-            fig_urg_donut.update_layout(
-                showlegend=False, height=400,
-                annotations=[dict(text=f"{total_urg}", x=0.5, y=0.5, font=dict(size=18, weight='bold'), showarrow=False)],
-                margin=dict(l=20, r=20, t=20, b=20),
-            )
-            st.plotly_chart(fig_urg_donut, use_container_width=True)
-
-        # --- Coverage gap table ---
-        with col_u2:
-            st.subheader("Comunas Sin Urgencia")
-            if COL_COMUNA in df_filtered.columns and COL_REGION in df_filtered.columns:
-                todas_comunas = df_filtered[[COL_COMUNA, COL_REGION]].drop_duplicates()
-                comunas_con_urg = df_filtered[df_filtered[COL_URGENCIA] == 'SI'][COL_COMUNA].unique()
-                comunas_sin_urg = todas_comunas[~todas_comunas[COL_COMUNA].isin(comunas_con_urg)]
-                comunas_sin_urg = comunas_sin_urg.sort_values([COL_REGION, COL_COMUNA])
-
-                if not comunas_sin_urg.empty:
-                    st.caption(f"{len(comunas_sin_urg)} comunas sin servicio de urgencia")
+        if COL_TIPO_URGENCIA in df_filtered.columns:
+            # Actual urgency services, minor types grouped as "Otros" (see build_count_cube)
+            cube_urg = cube[cube['_urgencia'].notna()]
+
+            urg_kpis = dataset.urgency_kpis(filters_selected)
+            total_urg = urg_kpis['servicios']
+
+            # Mini KPIs
+            k1, k2, k3 = st.columns(3)
+            with k1:
+                st.metric("Total Servicios de Urgencia", f"{total_urg:,}")
+            with k2:
+                comunas_sin = urg_kpis['comunas'] - urg_kpis['comunas_con_urgencia']
+                st.metric("Comunas Sin Cobertura", f"{comunas_sin}", delta=f"de {urg_kpis['comunas']} totales", delta_color="inverse")
+            with k3:
+                ueh, sapu = urg_kpis['ueh'], urg_kpis['sapu']
+                ratio = f"{ueh/sapu:.2f}" if sapu > 0 else "N/A"
+                st.metric("Ratio Hospitalaria / SAPU", ratio, help="Relación entre urgencias hospitalarias (UEH) y atención primaria (SAPU)")
+
+            st.divider()
+
+            # --- Urgency types by region (stacked bar) ---
+            st.subheader("Tipos de Urgencia por Región")
+            if COL_REGION in cube_urg.columns and not cube_urg.empty:
+                fig_urg_region = cached_figure('urgencia_region', filters_selected, figure_urgencia_region, cube_urg)
+                st.plotly_chart(fig_urg_region, use_container_width=True)
+
+            st.divider()
+
+            # --- Urgency type donut ---
+            col_u1, col_u2 = st.columns([1, 1])
+            with col_u1:
+                st.subheader("Distribución por Tipo")
+                fig_urg_donut = cached_figure('urgencia_tipo', filters_selected, figure_urgencia_donut, cube_urg, total_urg)
+                st.plotly_chart(fig_urg_donut, use_container_width=True)
+
+            # --- Coverage gap table ---
+            with col_u2:
+                st.subheader("Brechas de Cobertura")
+                coverage_cols = [COL_COMUNA, COL_REGION, COL_LAT, COL_LON]
+                if all(col in df_filtered.columns for col in coverage_cols) and not df_filtered.empty:
+                    coverage = dataset.coverage(filters_selected)
+
+                    sin_propia = int((coverage['UrgenciasPropias'] == 0).sum())
+                    st.caption(
+                        f"{sin_propia} de {len(coverage)} comunas sin servicio de urgencia propio. "
+                        "Ordenadas por distancia mediana de sus establecimientos a la urgencia más cercana."
+                    )
                     st.dataframe(
-                        comunas_sin_urg.rename(columns={COL_REGION: 'Región', COL_COMUNA: 'Comuna'}),
+                        coverage[[
+                            COL_REGION, COL_COMUNA, 'UrgenciasPropias',
+                            'DistanciaUrgenciaMediana', 'DistanciaUrgenciaMax', 'DistanciaUEHMediana',
+                        ]],
                         hide_index=True, use_container_width=True, height=340,
+                        column_config={
+                            COL_REGION: 'Región',
+                            COL_COMUNA: 'Comuna',
+                            'UrgenciasPropias': st.column_config.NumberColumn("Urgencias propias"),
+                            'DistanciaUrgenciaMediana': st.column_config.NumberColumn("Mediana (km)", format="%.1f"),
+                            'DistanciaUrgenciaMax': st.column_config.NumberColumn("Máxima (km)", format="%.1f"),
+                            'DistanciaUEHMediana': st.column_config.NumberColumn("UEH, mediana (km)", format="%.1f"),
+                        },
                     )
-                else:
-                    st.success("Todas las comunas cuentan con al menos un servicio de urgencia.")
-    else:
-        st.warning("No hay datos de tipo de urgencia disponibles.")
+        else:
+            st.warning("No hay datos de tipo de urgencia disponibles.")
 
 
 # =====================================================
 # TAB 4: EXPLORADOR DE DATOS
 # =====================================================
 with tab4:
-    st.subheader("Explorador de Datos")
-
-    # Top 20 types in expander
-    with st.expander("Top 20 Tipos de Establecimiento", expanded=False):
-        if COL_TIPO_ESTAB in df_filtered.columns:
-            counts = df_filtered[COL_TIPO_ESTAB].value_counts().reset_index()
-            counts.columns = ['Tipo de Establecimiento', 'Cantidad']
-            total_count = len(df_filtered)
-            counts['Porcentaje'] = (counts['Cantidad'] / total_count * 100)
-            data_top = counts.head(20)
-
-            fig_types = go.Figure(go.Bar(
-                x=data_top['Cantidad'], y=data_top['Tipo de Establecimiento'],
-                orientation='h',
-                marker_color=px.colors.sequential.Blues[-2],
-                text=[f'{n} ({p:.1f}%)' for n, p in zip(data_top['Cantidad'], data_top['Porcentaje'])],
-                textposition='outside',
-                hovertemplate='<b>%{y}</b><br>Cantidad: <b>%{x}</b><extra></extra>'
-            ))
-            fig_types.update_layout(
-                height=max(500, len(data_top) * 35),
-                margin=dict(l=50, r=150, t=30, b=50),
-                yaxis={'categoryorder': 'total ascending'}, showlegend=False,
-                xaxis_title='Cantidad', yaxis_title='Tipo',
-            )
-            st.plotly_chart(fig_types, use_container_width=True)
+    if tab4.open:
+        profiler.section(tab_titles[3])
+        st.subheader("Explorador de Datos")
+
+        # Name/comuna search, accent and case insensitive, within the sidebar filters
+        busqueda = st.text_input(
+            "Buscar establecimiento", placeholder="Nombre o comuna, p. ej. hospital temuco", key='busqueda',
+            help="Tolera errores de tipeo y palabras incompletas; respeta los filtros de la barra lateral",
+        )
+        if busqueda.strip():
+            hits = dataset.search(busqueda, filters_selected, limit=SEARCH_RESULTS)
+            if hits.empty:
+                st.info("Ningún establecimiento coincide con la búsqueda y los filtros seleccionados.")
+            else:
+                search_cols = [COL_NOMBRE, COL_TIPO_ESTAB, COL_COMUNA, COL_REGION, 'Puntaje']
+                resultados = st.dataframe(
+                    hits[[col for col in search_cols if col in hits.columns]],
+                    hide_index=True, use_container_width=True, key='busqueda_resultados',
+                    on_select='rerun', selection_mode='single-row',
+                    column_config={'Puntaje': st.column_config.ProgressColumn("Coincidencia", min_value=0.0, max_value=1.0, format="%.2f")},
+                )
+                seleccion = resultados.selection.rows
+                if seleccion:
+                    hit = hits.iloc[seleccion[0]]
+                    if all(col in hits.columns for col in [COL_LAT, COL_LON]) and hit[[COL_LAT, COL_LON]].notna().all():
+                        st.button(
+                            f"Ver {hit[COL_NOMBRE]} en el mapa", on_click=focus_map,
+                            args=(float(hit[COL_LAT]), float(hit[COL_LON]), str(hit[COL_NOMBRE])),
+                        )
+                    else:
+                        st.caption("El establecimiento seleccionado no tiene coordenadas.")
+                else:
+                    st.caption("Selecciona un resultado para verlo en el mapa.")
+
+        # Top 20 types in expander
+        with st.expander("Top 20 Tipos de Establecimiento", expanded=False):
+            if COL_TIPO_ESTAB in df_filtered.columns:
+                fig_types = cached_figure('top_tipos', filters_selected, figure_top_tipos, cube, len(df_filtered))
+                st.plotly_chart(fig_types, use_container_width=True)
+
+        # k nearest facilities to a point
+        with st.expander("Establecimientos más cercanos a un punto", expanded=False):
+            if dataset.facility_index is None:
+                st.warning("No hay coordenadas disponibles para la búsqueda.")
+            else:
+                col1, col2, col3 = st.columns(3)
+                with col1:
+                    origin_lat = st.number_input("Latitud", value=-33.4489, min_value=-90.0, max_value=90.0, format="%.5f", key='knn_lat')
+                with col2:
+                    origin_lon = st.number_input("Longitud", value=-70.6693, min_value=-180.0, max_value=180.0, format="%.5f", key='knn_lon')
+                with col3:
+                    k_nearest = st.slider("Cantidad", 1, 20, 5, key='knn_k')
+
+                knn_labels = {
+                    COL_TIPO_URGENCIA: "Tipo de Urgencia",
+                    COL_NIVEL_COMPLEJIDAD: "Nivel de Complejidad",
+                    COL_SISTEMA: "Sistema de Salud",
+                }
+                knn_filters = {}
+                for col, restriction_col in zip(st.columns(len(KNN_FILTER_COLUMNS)), KNN_FILTER_COLUMNS):
+                    if restriction_col in df.columns:
+                        with col:
+                            knn_filters[restriction_col] = st.multiselect(
+                                knn_labels.get(restriction_col, restriction_col),
+                                options=count_values(df[restriction_col]).index.tolist(),
+                                key=f'knn_{restriction_col}',
+                            )
+
+                nearest = dataset.nearest(origin_lat, origin_lon, k=k_nearest, restrictions=knn_filters)
+                if nearest.empty:
+                    st.info("Ningún establecimiento cumple las restricciones seleccionadas.")
+                else:
+                    knn_cols = [
+                        'Rango', COL_NOMBRE, COL_TIPO_ESTAB, COL_TIPO_URGENCIA, COL_NIVEL_COMPLEJIDAD,
+                        COL_SISTEMA, COL_COMUNA, COL_REGION, 'DistanciaKm',
+                    ]
+                    st.dataframe(
+                        nearest[[col for col in knn_cols if col in nearest.columns]],
+                        hide_index=True, use_container_width=True,
+                        column_config={'DistanciaKm': st.column_config.NumberColumn("Distancia (km)", format="%.2f")},
+                    )
 
-    st.divider()
+        st.divider()
 
-    # Data table
-    st.subheader("Muestra de Datos Filtrados")
-    st.caption(f"Mostrando **{len(df_filtered):,}** registros filtrados.")
+        # Data table
+        st.subheader("Muestra de Datos Filtrados")
+        st.caption(f"Mostrando **{len(df_filtered):,}** registros filtrados.")
 
-    if not df_filtered.empty:
-        cols_to_show = [
-            COL_NOMBRE, COL_REGION, COL_COMUNA, COL_TIPO_ESTAB,
-            COL_SISTEMA, COL_DEPENDENCIA, COL_TIPO_ATENCION,
-            COL_NIVEL_ATENCION, COL_TIPO_URGENCIA, COL_URGENCIA
-        ]
-        cols_exist = [col for col in cols_to_show if col in df_filtered.columns]
+        if not df_filtered.empty:
+            cols_to_show = [
+                COL_NOMBRE, COL_REGION, COL_COMUNA, COL_TIPO_ESTAB,
+                COL_SISTEMA, COL_DEPENDENCIA, COL_TIPO_ATENCION,
+                COL_NIVEL_ATENCION, COL_TIPO_URGENCIA, COL_URGENCIA
+            ]
+            cols_exist = [col for col in cols_to_show if col in df_filtered.columns]
 
-        if cols_exist:
-            st.dataframe(df_filtered[cols_exist], hide_index=True, use_container_width=True)
+            if cols_exist:
+                st.dataframe(df_filtered[cols_exist], hide_index=True, use_container_width=True)
+            else:
+                st.dataframe(df_filtered, hide_index=True, use_container_width=True)
+
+            export_format = st.radio(
+                "Formato de descarga", available_formats(df_filtered.columns), horizontal=True, key='formato_descarga'
+            )
+            mime, extension = EXPORT_FORMATS[export_format]
+            export_cache = load_export_cache()
+            # The file is only built when the button is clicked, then cached by filter state
+            st.download_button(
+                label=f"Descargar datos filtrados ({export_format})",
+                data=lambda: cached_export(export_cache, export_format, filters_selected, df_filtered),
+                file_name=f'establecimientos_salud_filtrados{extension}',
+                mime=mime,
+                on_click='ignore',
+            )
         else:
-            st.dataframe(df_filtered, hide_index=True, use_container_width=True)
-
-        csv_data = df_filtered.to_csv(index=False, encoding='utf-8-sig').encode('utf-8-sig')
-        st.download_button(
-            label="Descargar datos filtrados (CSV)",
-            data=csv_data,
-            file_name='establecimientos_salud_filtrados.csv',
-            mime='text/csv',
-        )
-    else:
-        st.warning("No hay datos para mostrar o descargar.")
+            st.warning("No hay datos para mostrar o descargar.")
 
 
+# Figure cache counters, for tuning FIGURE_CACHE_SIZE
+figure_cache = load_figure_cache()
+st.sidebar.caption(
+    f"Caché de gráficos: {figure_cache['hits']:,} aciertos, {figure_cache['misses']:,} fallos, "
+    f"{len(figure_cache['figures'])}/{FIGURE_CACHE_SIZE} figuras"
+)
+
 # --- Footer ---
 st.markdown("---")
 st.markdown("""
@@ -727,3 +971,7 @@ st.markdown("""
 
 Desarrollado por: Rodrigo Muñoz Soto | [GitHub: rodrigooig](https://github.com/rodrigooig) | [LinkedIn](https://www.linkedin.com/in/munozsoto-rodrigo/)
 """)
+
+profiler.finish()
+if debug_panel:
+    render_debug_panel(profiler, load_span_metrics())
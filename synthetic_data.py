@@ -0,0 +1,295 @@
+import argparse
+import os
+import sys
+import unicodedata
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from clean_data import DATE_FORMAT, KEY_COLUMN, NON_ALPHA_PREFIX_RE, RAW_DECIMAL, RAW_SEPARATOR, detect_encoding
+
+SOURCE_PATH = 'data/establecimientos_20260310.csv'
+OUTPUT_PATH = 'data/establecimientos_sinteticos.csv'
+GENERATOR_CHUNK_ROWS = 100000
+# EstablecimientoCodigo of the first generated row (above every real code)
+SYNTHETIC_CODE_START = 1000000
+COORD_DECIMALS = 6
+# Bounds of the per-comuna kernel bandwidth for coordinates, in degrees (~200 m to ~5 km)
+MIN_BANDWIDTH_DEG = 0.002
+MAX_BANDWIDTH_DEG = 0.05
+# Standard deviation of the jitter applied to start dates
+DATE_JITTER_DAYS = 180
+
+DATE_COLUMN = 'FechaInicioFuncionamientoEstab'
+NAME_COLUMN = 'EstablecimientoGlosa'
+TYPE_COLUMN = 'TipoEstablecimientoGlosa'
+COMUNA_COLUMN = 'ComunaCodigo'
+# Street address columns, taken together from another facility of the same comuna
+ADDRESS_COLUMNS = ['TipoViaGlosa', 'Numero', 'NombreVia']
+
+# Columns normalized by clean_data.normalize_columns: they receive case and
+# whitespace noise, which normalize_text undoes exactly
+CASE_NOISE_COLUMNS = [
+    'EstablecimientoGlosa', 'RegionGlosa', 'SeremiSaludGlosa_ServicioDeSaludGlosa',
+    'TipoPertenenciaEstabGlosa', 'TipoEstablecimientoGlosa', 'AmbitoFuncionamiento',
+    'DependenciaAdministrativa', 'NivelAtencionEstabglosa', 'ComunaGlosa',
+    'TipoViaGlosa', 'NombreVia', 'TipoUrgencia', 'ClasificacionTipoSapu',
+    'TipoSistemaSaludGlosa', 'EstadoFuncionamiento', 'NivelComplejidadEstabGlosa',
+    'TipoAtencionEstabGlosa'
+]
+# Free-text columns that also receive spelling noise (typos, missing accents);
+# categories keep only undoable noise so the app sees the real category set
+SPELLING_NOISE_COLUMNS = ['EstablecimientoGlosa', 'NombreVia']
+# Spellings of SI/NO accepted by clean_data.clean_rows
+FLAG_NOISE = {'SI': ['Si', 'si'], 'NO': ['No', 'no']}
+FLAG_COLUMN = 'TieneServicioUrgencia'
+
+CASE_NOISE_KINDS = ['lower', 'title', 'spaces', 'region']
+SPELLING_NOISE_KINDS = ['accents', 'swap', 'drop', 'repeat']
+
+
+def read_source(path=SOURCE_PATH):
+    """
+    Snapshot crudo completo (las 32 columnas) como texto.
+    """
+    return pd.read_csv(path, sep=RAW_SEPARATOR, encoding=detect_encoding(path), dtype=str, low_memory=False)
+
+
+def group_index(values):
+    """
+    Índice de grupos para muestrear, por fila, otra fila del mismo grupo.
+
+    Returns:
+        (códigos por fila, filas ordenadas por grupo, inicio y tamaño de cada grupo)
+    """
+    codes, uniques = pd.factorize(pd.Series(values).fillna(''))
+    order = np.argsort(codes, kind='stable')
+    sizes = np.bincount(codes, minlength=len(uniques))
+    starts = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+    return codes, order, starts, sizes
+
+
+def sample_in_group(groups, source, rng):
+    """
+    Para cada fila de origen, una fila elegida al azar dentro de su mismo grupo.
+    """
+    codes, order, starts, sizes = groups
+    group = codes[source]
+    return order[starts[group] + (rng.random(len(source)) * sizes[group]).astype(np.int64)]
+
+
+def fit_profile(raw):
+    """
+    Ajusta el generador a un snapshot crudo:
+    - combinaciones de región, servicio, comuna, tipo, sistema, dependencia,
+      urgencia, niveles, estado y presencia de fecha/coordenadas: distribución
+      conjunta empírica (cada fila generada parte de una fila real);
+    - coordenadas: densidad de kernel gaussiano por comuna, con ancho de banda
+      de Scott acotado a [MIN_BANDWIDTH_DEG, MAX_BANDWIDTH_DEG];
+    - fechas de inicio: la de la fila real más un desplazamiento normal de
+      DATE_JITTER_DAYS días, dentro del rango observado;
+    - nombres: inicio de un nombre real y final de otro del mismo tipo de
+      establecimiento; dirección de otro establecimiento de la misma comuna.
+
+    Returns:
+        dict con las filas de origen y los arreglos precalculados.
+    """
+    raw = raw.reset_index(drop=True)
+    lat = pd.to_numeric(raw['Latitud'].str.replace(RAW_DECIMAL, '.'), errors='coerce').to_numpy(dtype=float)
+    lon = pd.to_numeric(raw['Longitud'].str.replace(RAW_DECIMAL, '.'), errors='coerce').to_numpy(dtype=float)
+
+    coords = pd.DataFrame({'comuna': raw[COMUNA_COLUMN].fillna(''), 'lat': lat, 'lon': lon})
+    spread = coords.groupby('comuna').agg(lat_std=('lat', 'std'), lon_std=('lon', 'std'), n=('lat', 'count'))
+    bandwidth = (np.sqrt(spread['lat_std'] * spread['lon_std']) * spread['n'].clip(lower=1) ** (-1 / 6))
+    bandwidth = bandwidth.fillna(MIN_BANDWIDTH_DEG).clip(MIN_BANDWIDTH_DEG, MAX_BANDWIDTH_DEG)
+
+    dates = pd.to_datetime(raw[DATE_COLUMN], format=DATE_FORMAT, errors='coerce')
+
+    words = raw[NAME_COLUMN].fillna('').str.split(' ').tolist()
+    heads = np.array([' '.join(w[:(len(w) + 1) // 2]) for w in words], dtype=object)
+    tails = np.array([' '.join(w[(len(w) + 1) // 2:]) for w in words], dtype=object)
+
+    return {
+        'rows': raw,
+        'lat': lat,
+        'lon': lon,
+        'bandwidth': bandwidth.reindex(coords['comuna']).to_numpy(dtype=float),
+        'dates': dates.to_numpy(dtype='datetime64[ns]'),
+        'date_range': (dates.min(), dates.max()),
+        'heads': heads,
+        'tails': tails,
+        'type_groups': group_index(raw[TYPE_COLUMN]),
+        'comuna_groups': group_index(raw[COMUNA_COLUMN]),
+    }
+
+
+def is_acronym(word):
+    # Same test as normalize_text: words it keeps as written
+    alpha_part = NON_ALPHA_PREFIX_RE.sub('', word)
+    return len(alpha_part) >= 2 and alpha_part.isupper()
+
+
+def strip_accents(text):
+    return ''.join(c for c in unicodedata.normalize('NFKD', text) if not unicodedata.combining(c))
+
+
+def case_noise(text, kind):
+    """
+    Variante de text que normalize_text vuelve a dejar igual: palabras en
+    minúscula o capitalizadas (salvo siglas), espacios extra o 'Region' sin tilde.
+    """
+    if kind == 'lower':
+        return ' '.join(w if is_acronym(w) else w.lower() for w in text.split(' '))
+    if kind == 'title':
+        return ' '.join(w if is_acronym(w) else w.capitalize() for w in text.split(' '))
+    if kind == 'spaces':
+        return ' ' + text.replace(' ', '  ') + ' '
+    return text.replace('Región ', 'Region ')
+
+
+def spelling_noise(text, kind, position):
+    """
+    Error de tipeo en text: sin tildes, dos letras vecinas invertidas, una
+    letra omitida o repetida (position en [0, 1) elige dónde).
+    """
+    if kind == 'accents':
+        return strip_accents(text)
+    if len(text) < 4:
+        return text
+    i = 1 + int(position * (len(text) - 2))
+    if kind == 'swap':
+        return text[:i - 1] + text[i] + text[i - 1] + text[i + 1:]
+    if kind == 'drop':
+        return text[:i] + text[i + 1:]
+    return text[:i] + text[i] + text[i:]
+
+
+def add_noise(chunk, rate, rng):
+    """
+    Altera una fracción rate de los valores de texto, como en los registros reales:
+    mayúsculas y espacios en las columnas normalizadas, errores de tipeo en
+    nombres y calles, y variantes de SI/NO.
+    """
+    for col in CASE_NOISE_COLUMNS:
+        values = chunk[col].to_numpy(dtype=object).copy()
+        rows = np.flatnonzero((rng.random(len(values)) < rate) & pd.notna(values))
+        spelling = col in SPELLING_NOISE_COLUMNS
+        kinds = CASE_NOISE_KINDS + (SPELLING_NOISE_KINDS if spelling else [])
+        picks = rng.integers(0, len(kinds), len(rows))
+        positions = rng.random(len(rows))
+        for row, pick, position in zip(rows, picks, positions):
+            kind = kinds[pick]
+            if kind in CASE_NOISE_KINDS:
+                values[row] = case_noise(values[row], kind)
+            else:
+                values[row] = spelling_noise(values[row], kind, position)
+        chunk[col] = values
+
+    flags = chunk[FLAG_COLUMN].to_numpy(dtype=object).copy()
+    for flag, variants in FLAG_NOISE.items():
+        rows = np.flatnonzero((flags == flag) & (rng.random(len(flags)) < rate))
+        flags[rows] = np.array(variants, dtype=object)[rng.integers(0, len(variants), len(rows))]
+    chunk[FLAG_COLUMN] = flags
+    return chunk
+
+
+def format_decimal(values):
+    text = pd.Series(np.round(values, COORD_DECIMALS)).astype(str).str.replace('.', RAW_DECIMAL, regex=False)
+    return text.where(~np.isnan(values)).to_numpy(dtype=object)
+
+
+def generate_chunk(profile, rows, rng, first_code=SYNTHETIC_CODE_START, noise=0.0):
+    """
+    Un bloque de rows filas sintéticas con el formato crudo del snapshot
+    (mismas columnas y orden, coordenadas con coma decimal, fechas dd-mm-aaaa).
+    """
+    raw = profile['rows']
+    source = rng.integers(0, len(raw), rows)
+    chunk = raw.iloc[source].reset_index(drop=True)
+
+    chunk[KEY_COLUMN] = np.arange(first_code, first_code + rows).astype(str)
+
+    donors = sample_in_group(profile['type_groups'], source, rng)
+    names = pd.Series(profile['heads'][source]) + ' ' + pd.Series(profile['tails'][donors])
+    chunk[NAME_COLUMN] = names.str.strip().replace('', np.nan).to_numpy(dtype=object)
+
+    neighbours = sample_in_group(profile['comuna_groups'], source, rng)
+    for col in ADDRESS_COLUMNS:
+        chunk[col] = raw[col].to_numpy(dtype=object)[neighbours]
+
+    bandwidth = profile['bandwidth'][source]
+    chunk['Latitud'] = format_decimal(profile['lat'][source] + rng.normal(0, 1, rows) * bandwidth)
+    chunk['Longitud'] = format_decimal(profile['lon'][source] + rng.normal(0, 1, rows) * bandwidth)
+
+    first_date, last_date = profile['date_range']
+    jitter = pd.to_timedelta(np.round(rng.normal(0, DATE_JITTER_DAYS, rows)), unit='D')
+    dates = (pd.Series(profile['dates'][source]) + jitter).clip(first_date, last_date)
+    chunk[DATE_COLUMN] = dates.dt.strftime(DATE_FORMAT).to_numpy(dtype=object)
+
+    if noise > 0:
+        chunk = add_noise(chunk, noise, rng)
+    return chunk
+
+
+def iter_synthetic(profile, rows, chunk_rows=GENERATOR_CHUNK_ROWS, seed=0, noise=0.0):
+    """
+    Genera rows filas sintéticas en bloques de a lo más chunk_rows;
+    la misma semilla produce siempre los mismos datos.
+    """
+    rng = np.random.default_rng(seed)
+    for start in range(0, rows, chunk_rows):
+        yield generate_chunk(profile, min(chunk_rows, rows - start), rng, SYNTHETIC_CODE_START + start, noise)
+
+
+def synthetic_frame(profile, rows, seed=0, noise=0.0):
+    """
+    rows filas sintéticas en un solo DataFrame (para pruebas en memoria).
+    """
+    return pd.concat(list(iter_synthetic(profile, rows, seed=seed, noise=noise)), ignore_index=True)
+
+
+def write_synthetic(output_file, profile, rows, chunk_rows=GENERATOR_CHUNK_ROWS, seed=0, noise=0.0):
+    """
+    Escribe un snapshot sintético separado por ';' en UTF-8, bloque a bloque
+    (la memoria depende de chunk_rows, no de rows).
+
+    Returns:
+        int: filas escritas.
+    """
+    written = 0
+    for chunk in iter_synthetic(profile, rows, chunk_rows, seed, noise):
+        first = written == 0
+        chunk.to_csv(output_file, sep=RAW_SEPARATOR, index=False, encoding='utf-8', mode='w' if first else 'a', header=first)
+        written += len(chunk)
+        print(f"  {written} filas generadas")
+    return written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Genera un registro sintético de establecimientos con el formato crudo MINSAL.")
+    parser.add_argument('--rows', type=int, default=1000000, help="Filas a generar (default: %(default)s)")
+    parser.add_argument('--output', default=OUTPUT_PATH, help="Archivo de salida (default: %(default)s)")
+    parser.add_argument('--source', default=SOURCE_PATH, help="Snapshot real al que se ajustan las distribuciones (default: %(default)s)")
+    parser.add_argument('--seed', type=int, default=0, help="Semilla (default: %(default)s)")
+    parser.add_argument('--noise', type=float, default=0.0,
+                        help="Fracción de valores de texto con errores de mayúsculas, espacios o tipeo (default: %(default)s)")
+    parser.add_argument('--chunk-rows', type=int, default=GENERATOR_CHUNK_ROWS, help="Filas por bloque (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.source):
+        print(f"Error: El archivo {args.source} no existe.")
+        sys.exit(1)
+    if os.path.dirname(args.output):
+        os.makedirs(os.path.dirname(args.output), exist_ok=True)
+
+    print(f"Ajustando distribuciones a {args.source}: {datetime.now().strftime('%H:%M:%S')}")
+    profile = fit_profile(read_source(args.source))
+    print(f"Generando {args.rows} filas en {args.output}...")
+    rows = write_synthetic(args.output, profile, args.rows, args.chunk_rows, args.seed, args.noise)
+    print(f"Proceso completado: {datetime.now().strftime('%H:%M:%S')}")
+    print(f"Archivo guardado como '{args.output}' con {rows} filas.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+import numpy as np
+import pandas as pd
+
+from clean_data import add_plaza_edf, apply_distinct, norm_match
+
+
+def write_plazas(path):
+    pd.DataFrame({
+        'SERVICIO DE SALUD': ['METROPOLITANO CENTRAL'],
+        'COMUNA': ['CERRILLOS'],
+        'ESTABLECIMIENTO': ['CENTRO DE SALUD FAMILIAR DR. NORMAN VOULLIEME'],
+    }).to_csv(path, index=False)
+
+
+def test_apply_distinct_maps_missing_values_through_func():
+    series = pd.Series(['Ñuñoa', np.nan, 'ñuñoa ', None])
+    result = apply_distinct(series, norm_match)
+    assert result.tolist() == ['NUNOA', '', 'NUNOA', '']
+    assert result.tolist() == series.apply(norm_match).tolist()
+
+
+def test_add_plaza_edf_with_missing_name(tmp_path):
+    plazas_file = tmp_path / 'plazas.csv'
+    write_plazas(plazas_file)
+    df = pd.DataFrame({
+        'EstablecimientoGlosa': ['Centro de Salud Familiar Dr. Norman Voullieme', np.nan],
+        'ComunaGlosa': ['Cerrillos', 'Cerrillos'],
+    })
+
+    result = add_plaza_edf(df, plazas_file=str(plazas_file))
+
+    assert result['PlazaEDF'].tolist() == [True, False]
@@ -0,0 +1,48 @@
+import os
+
+import pandas as pd
+import pytest
+
+from dataset import FacilityDataset
+from spatial import urgency_distances
+
+COLUMNAR_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'establecimientos_cleaned.parquet')
+KEYS = ['RegionGlosa', 'ComunaGlosa']
+
+
+@pytest.fixture(scope='module')
+def facilities(tmp_path_factory):
+    # Without the materialized table every call computes the coverage
+    missing = str(tmp_path_factory.mktemp('cobertura') / 'cobertura.csv')
+    return FacilityDataset(pd.read_parquet(COLUMNAR_FILE), missing)
+
+
+def by_comuna(table):
+    return table.set_index(KEYS).sort_index()
+
+
+@pytest.mark.parametrize('filters', [
+    {'TipoEstablecimientoGlosa': ['Centro de Salud Familiar (CESFAM)']},
+    {'DependenciaAdministrativa': ['Municipal']},
+    {'RegionGlosa': ['Región De Antofagasta']},
+])
+def test_filters_pick_origins_not_services(facilities, filters):
+    filtered = by_comuna(facilities.coverage(filters))
+    assert len(filtered)
+    # Distances of the remaining rows, measured against every service of the registry
+    rows = facilities.filter(filters)
+    distances = urgency_distances(facilities.df).loc[rows.index]
+    expected = distances.groupby([rows[col].astype(str) for col in KEYS])['DistanciaUrgencia'].agg(['min', 'median', 'max'])
+    expected.index.names = KEYS
+    expected = expected.sort_index()
+    pd.testing.assert_series_equal(filtered['DistanciaUrgenciaMin'], expected['min'], check_names=False)
+    pd.testing.assert_series_equal(filtered['DistanciaUrgenciaMediana'], expected['median'], check_names=False)
+    assert filtered['DistanciaUrgenciaMin'].notna().all()
+
+
+def test_region_filter_keeps_unfiltered_values(facilities):
+    region = 'Región De Antofagasta'
+    unfiltered = by_comuna(facilities.coverage())
+    filtered = by_comuna(facilities.coverage({'RegionGlosa': [region]}))
+    # Every facility of the region remains, so its comunas match the unfiltered table
+    pd.testing.assert_frame_equal(filtered, unfiltered.loc[[region]])
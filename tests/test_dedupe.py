@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+
+from clean_data import dedupe_facilities, find_duplicates, name_tokens
+
+
+def facilities(rows):
+    return pd.DataFrame(rows, columns=['EstablecimientoCodigo', 'EstablecimientoGlosa', 'TipoEstablecimientoGlosa',
+                                       'ComunaGlosa', 'Latitud', 'Longitud'])
+
+
+REGISTRY = facilities([
+    ['1', 'Hospital San José', 'Hospital', 'Santiago', -33.4500, -70.6500],
+    ['2', 'HOSPITAL  SAN JOSE', None, 'Santiago', -33.4502, -70.6501],
+    ['3', 'Hospital San José', 'Hospital', 'Maipú', -33.5100, -70.7600],
+    ['4', 'CESFAM Los Aromos', 'CESFAM', 'Santiago', -33.4600, -70.6600],
+    ['5', 'Hospital San José', 'Hospital', 'Santiago', -33.6000, -70.9000],
+])
+
+
+def test_name_tokens_drop_punctuation_and_comuna():
+    assert name_tokens('HOSPITAL DE SANTIAGO (ANEXO)', 'SANTIAGO') == frozenset(['HOSPITAL', 'ANEXO'])
+    assert name_tokens('', '') == frozenset()
+
+
+def test_groups_same_facility_in_same_comuna_and_cell():
+    groups = find_duplicates(REGISTRY)
+    # Different comuna (3), different name (4) and far away (5) stay out
+    assert sorted(groups['Fila']) == [0, 1]
+    assert groups['Grupo'].nunique() == 1
+    canonical = groups.loc[groups['Canonico'], 'Fila'].tolist()
+    assert canonical == [0]
+    assert (groups['Confianza'] >= 0.85).all()
+    assert groups.loc[groups['Fila'] == 0, 'DistanciaM'].item() == 0
+
+
+def test_same_name_with_different_type_is_not_grouped():
+    registry = facilities([
+        ['1', 'GENOSUR', 'Laboratorio Clínico', 'Las Condes', -33.4155, -70.6045],
+        ['2', 'GENOSUR', 'Sala Externa de Toma de Muestras (SETM)', 'Las Condes', -33.4121, -70.6033],
+        ['3', 'Siete Visión', 'Centro de Especialidades', 'Arica', -18.4823, -70.3114],
+        ['4', 'Siete Visión', 'Centro Diagnóstico y Tratamiento Privado', 'Arica', -18.4823, -70.3114],
+    ])
+    assert find_duplicates(registry).empty
+
+
+def test_missing_names_and_comunas():
+    registry = pd.concat([REGISTRY, facilities([
+        ['6', np.nan, 'Posta', 'Santiago', -33.4500, -70.6500],
+        ['7', 'Posta Rural', 'Posta', np.nan, -33.4500, -70.6500],
+        ['8', np.nan, 'Posta', np.nan, np.nan, np.nan],
+    ])], ignore_index=True)
+    groups = find_duplicates(registry)
+    assert sorted(groups['Fila']) == [0, 1]
+
+
+def test_empty_frame_and_collapse(tmp_path):
+    assert find_duplicates(REGISTRY.iloc[:0]).empty
+
+    report_file = tmp_path / 'duplicados.csv'
+    collapsed = dedupe_facilities(REGISTRY, report_file=str(report_file), collapse=True)
+    assert collapsed['EstablecimientoCodigo'].tolist() == ['1', '3', '4', '5']
+    report = pd.read_csv(report_file, sep=';', dtype={'EstablecimientoCodigo': str})
+    assert report['EstablecimientoCodigo'].tolist() == ['1', '2']
@@ -0,0 +1,35 @@
+import gc
+import tracemalloc
+
+from profiling import RerunProfiler
+
+
+def test_memory_tracing_stops_with_last_profiler():
+    assert not tracemalloc.is_tracing()
+    first = RerunProfiler().configure(True, memory=True)
+    second = RerunProfiler().configure(True, memory=True)
+    assert tracemalloc.is_tracing()
+
+    first.configure(True, memory=False)
+    assert tracemalloc.is_tracing()
+    # The session state holding the profiler is dropped when the session ends
+    del second
+    gc.collect()
+    assert not tracemalloc.is_tracing()
+
+
+def test_spans_record_memory_only_when_tracing():
+    profiler = RerunProfiler().configure(True, memory=True)
+    profiler.start()
+    with profiler.span('asignar'):
+        data = [0] * 100000
+    record = profiler.finish()
+    assert record['spans'][0]['peak_mb'] > 0
+    del data
+
+    profiler.configure(True)
+    profiler.start()
+    profiler.section('sin_memoria')
+    record = profiler.finish()
+    assert 'peak_mb' not in record['spans'][0]
+    assert not tracemalloc.is_tracing()
@@ -0,0 +1,93 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import clean_data
+from quality import check_quality, merge_reports, validate
+
+RAW_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'establecimientos_20260310.csv')
+
+CLEAN = pd.DataFrame({
+    'EstablecimientoCodigo': ['1', '2', '3', '4', '5', '6'],
+    'Latitud': [-33.45, -70.65, 10.0, np.nan, -27.1, -33.45],
+    'Longitud': [-70.65, -33.45, 10.0, -70.65, -109.35, -70.65],
+    'FechaInicioFuncionamientoEstab': ['01-02-2000', '2000-02-01', '', np.nan, '31-12-1999', '32-01-2000'],
+    'TipoUrgencia': ['No Aplica', 'SAPU', 'No Aplica', np.nan, 'SIN DATO', 'SAPU'],
+    'TieneServicioUrgencia': ['NO', 'SI', 'SI', np.nan, 'NO', np.nan],
+})
+
+
+def violating_rows(report):
+    return {name: result['filas'] for name, result in report['reglas'].items()}
+
+
+def test_rules_flag_expected_rows():
+    report = validate(CLEAN)
+    assert report['filas'] == 6
+    # Missing and empty values are not violations, except the urgency flag mismatch
+    assert violating_rows(report) == {
+        'coordenadas_fuera_de_chile': ['3'],
+        'coordenadas_invertidas': ['2'],
+        'fecha_inicio_invalida': ['2', '6'],
+        'urgencia_inconsistente': ['3', '6'],
+    }
+    assert report['reglas']['fecha_inicio_invalida']['fraccion'] == pytest.approx(2 / 6)
+
+
+def test_empty_frame_has_no_violations():
+    report = validate(CLEAN.iloc[:0])
+    assert report['filas'] == 0
+    assert all(result['violaciones'] == 0 and result['fraccion'] == 0.0 for result in report['reglas'].values())
+
+
+def test_merged_block_reports_match_full_frame():
+    blocks = [validate(CLEAN.iloc[:2]), validate(CLEAN.iloc[2:2]), validate(CLEAN.iloc[2:])]
+    assert merge_reports(blocks) == validate(CLEAN)
+    assert merge_reports([])['filas'] == 0
+
+
+def test_threshold_decides_pass_or_fail(tmp_path):
+    report_file = tmp_path / 'calidad.json'
+    report, failed = check_quality(CLEAN, str(report_file), max_fraction=0.3)
+    assert failed == ['fecha_inicio_invalida', 'urgencia_inconsistente']
+    assert not report['aprobado'] and report_file.exists()
+
+    report, failed = check_quality(CLEAN, max_fraction=0.5)
+    assert failed == [] and report['aprobado']
+    # Without a threshold the report never fails
+    assert check_quality(CLEAN)[1] == []
+
+
+@pytest.fixture
+def snapshot(tmp_path, monkeypatch):
+    # A slice of the bundled snapshot, with the coordinates of its first row swapped
+    raw = pd.read_csv(RAW_FILE, sep=';', dtype=str, nrows=200)
+    raw.loc[0, ['Latitud', 'Longitud']] = raw.loc[0, ['Longitud', 'Latitud']].to_numpy()
+    path = tmp_path / 'establecimientos_20260310.csv'
+    raw.to_csv(path, sep=';', index=False)
+    monkeypatch.chdir(tmp_path)
+    return str(path)
+
+
+@pytest.mark.parametrize('mode', [[], ['--stream']])
+def test_failed_gate_keeps_previous_output(snapshot, tmp_path, mode):
+    output_dir = tmp_path / 'salida'
+    output_dir.mkdir()
+    outputs = ['establecimientos_cleaned.csv', 'establecimientos_cleaned.parquet', 'establecimientos_hashes.csv']
+    for name in outputs:
+        (output_dir / name).write_text('anterior')
+
+    with pytest.raises(SystemExit) as exit_info:
+        clean_data.main([snapshot, '--output-dir', str(output_dir), '--max-violations', '0', *mode])
+    assert exit_info.value.code == 1
+    assert all((output_dir / name).read_text() == 'anterior' for name in outputs)
+    assert not [name for name in os.listdir(output_dir) if name.endswith('.tmp')]
+    assert (output_dir / 'calidad_datos.json').exists()
+
+    clean_data.main([snapshot, '--output-dir', str(output_dir), '--max-violations', '0.01', *mode])
+    clean = pd.read_csv(output_dir / 'establecimientos_cleaned.csv', sep=';', dtype=str)
+    assert len(clean) == 200
+    assert pd.read_parquet(output_dir / 'establecimientos_cleaned.parquet').shape[0] == 200
+    assert not [name for name in os.listdir(output_dir) if name.endswith('.tmp')]
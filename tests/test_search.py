@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+
+from clean_data import norm_match
+from search import build_search_index, fold_text, search_positions
+
+FACILITIES = pd.DataFrame({
+    'EstablecimientoGlosa': ['Hospital de Ñuñoa', 'Hospital Clínico San Borja', 'CESFAM Valparaíso', np.nan, 'Posta Rural Ñuñoa'],
+    'ComunaGlosa': ['Ñuñoa', 'Santiago', 'Valparaíso', 'Arica', np.nan],
+})
+
+
+def test_fold_text_matches_norm_match():
+    values = ['  Hospital  Clínico ', 'ñuñoa', '', np.nan, 'CONCEPCIÓN']
+    assert fold_text(values).tolist() == [norm_match(value) for value in values]
+
+
+def test_search_ranks_best_match_first_despite_typo():
+    index = build_search_index(FACILITIES)
+    positions, scores = search_positions(index, 'hospitl clinico')
+    assert positions[0] == 1
+    assert np.all(np.diff(scores) <= 0)
+    assert np.all((scores > 0) & (scores <= 1))
+
+
+def test_search_ignores_accents_and_matches_prefix():
+    index = build_search_index(FACILITIES)
+    positions, _ = search_positions(index, 'nunoa')
+    assert set(positions) == {0, 4}
+    positions, _ = search_positions(index, 'valpa')
+    assert positions.tolist() == [2]
+
+
+def test_search_handles_missing_names_and_empty_queries():
+    index = build_search_index(FACILITIES)
+    # The row without a name is still found by its comuna
+    positions, _ = search_positions(index, 'arica')
+    assert positions.tolist() == [3]
+    for query in ('', '   ', 'zzzz'):
+        positions, scores = search_positions(index, query)
+        assert len(positions) == 0 and len(scores) == 0
+
+
+def test_search_restricted_to_rows_and_limited():
+    index = build_search_index(FACILITIES)
+    positions, _ = search_positions(index, 'nunoa', rows=np.array([1, 2, 4]))
+    assert positions.tolist() == [4]
+    positions, _ = search_positions(index, 'hospital', limit=1)
+    assert len(positions) == 1
+
+
+def test_empty_frame():
+    index = build_search_index(FACILITIES.iloc[:0])
+    positions, _ = search_positions(index, 'hospital')
+    assert len(positions) == 0
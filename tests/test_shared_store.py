@@ -0,0 +1,79 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import dataset
+import shared_store
+from dataset import FacilityDataset, shared_dataset
+from shared_store import KEEP_VERSIONS, attach, current_version, publish, published_versions
+
+COLUMNAR_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'establecimientos_cleaned.parquet')
+
+
+@pytest.fixture(scope='module')
+def clean():
+    return pd.read_parquet(COLUMNAR_FILE).head(500)
+
+
+def test_publish_attach_round_trip(tmp_path, clean):
+    root = str(tmp_path / 'compartido')
+    version = publish(clean, root, version='v1')
+    assert current_version(root) == version == 'v1'
+
+    built, mapped = FacilityDataset(clean), attach(root)
+    assert mapped.version == 'v1'
+    pd.testing.assert_frame_equal(mapped.df, clean, check_dtype=False)
+    pd.testing.assert_frame_equal(mapped.count_cube, built.count_cube, check_dtype=False)
+    assert mapped.filter_index['options'] == built.filter_index['options']
+    for column, bitmaps in built.filter_index['bitmaps'].items():
+        for value, bitmap in bitmaps.items():
+            np.testing.assert_array_equal(mapped.filter_index['bitmaps'][column][value], bitmap)
+    for name, values in built.search_index.items():
+        np.testing.assert_array_equal(mapped.search_index[name], values)
+
+
+def test_text_columns_mapped_without_copy(tmp_path, clean, monkeypatch):
+    # pandas < 3 path: text columns come back as Arrow-backed columns over the mapped file
+    root = str(tmp_path / 'compartido')
+    publish(clean, root, version='v1')
+    monkeypatch.setattr(shared_store, 'copies_text', lambda: True)
+    frame = shared_store.map_frame(os.path.join(root, 'v1', shared_store.FRAME_FILE))
+    text = [col for col in frame.columns if isinstance(frame[col].dtype, pd.ArrowDtype)]
+    assert 'EstablecimientoGlosa' in text
+    assert frame['EstablecimientoGlosa'].tolist() == clean['EstablecimientoGlosa'].tolist()
+
+
+def test_publish_prunes_old_versions(tmp_path, clean):
+    root = str(tmp_path / 'compartido')
+    for version in ('v1', 'v2', 'v3'):
+        publish(clean, root, version=version)
+    assert published_versions(root) == ['v1', 'v2', 'v3'][-KEEP_VERSIONS:]
+    assert current_version(root) == 'v3'
+    with pytest.raises(ValueError):
+        publish(clean, root, version='v3')
+
+
+def test_shared_dataset_follows_published_version(tmp_path, clean, monkeypatch):
+    monkeypatch.setattr(dataset, '_SHARED_DATASETS', {})
+    path = str(tmp_path / 'establecimientos_cleaned.csv')
+    root = str(tmp_path / 'compartido')
+    publish(clean, root, version='v1')
+    first = shared_dataset(path)
+    assert first.version == 'v1' and shared_dataset(path) is first
+
+    publish(clean.head(100), root, version='v2')
+    second = shared_dataset(path)
+    assert second.version == 'v2' and len(second.df) == 100
+
+
+def test_shared_dataset_retries_pruned_version(tmp_path, clean, monkeypatch):
+    monkeypatch.setattr(dataset, '_SHARED_DATASETS', {})
+    path = str(tmp_path / 'establecimientos_cleaned.csv')
+    root = str(tmp_path / 'compartido')
+    publish(clean, root, version='v2')
+    # ACTUAL still named v1 when it was read, but v1 was pruned before mapping it
+    versions = iter(['v1'])
+    monkeypatch.setattr(shared_store, 'current_version', lambda root: next(versions, 'v2'))
+    assert shared_dataset(path).version == 'v2'
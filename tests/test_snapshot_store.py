@@ -0,0 +1,78 @@
+import os
+import subprocess
+import sys
+
+import pandas as pd
+import pytest
+
+from snapshot_store import SnapshotStore, main
+
+
+def snapshot(rows):
+    return pd.DataFrame(rows, columns=['EstablecimientoCodigo', 'EstablecimientoGlosa', 'EstadoFuncionamiento'])
+
+
+FIRST = snapshot([['1', 'Hospital A', 'Vigente'], ['2', 'CESFAM B', 'Vigente']])
+SECOND = snapshot([['1', 'Hospital A', 'Cerrado'], ['3', 'Posta C', 'Vigente']])
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = SnapshotStore(str(tmp_path / 'historico'))
+    store.append(FIRST, '2026-01-01')
+    store.append(SECOND, '2026-02-01')
+    return store
+
+
+def test_as_of_returns_state_at_each_date(store):
+    january = store.as_of('2026-01-15')
+    assert january['EstablecimientoCodigo'].tolist() == ['1', '2']
+    assert january['EstadoFuncionamiento'].astype(str).tolist() == ['Vigente', 'Vigente']
+
+    february = store.as_of('2026-03-01')
+    assert february['EstablecimientoCodigo'].tolist() == ['1', '3']
+    assert february['EstadoFuncionamiento'].astype(str).tolist() == ['Cerrado', 'Vigente']
+
+    assert store.as_of('2025-12-31').empty
+
+
+def test_removed_facility_is_tombstoned(store):
+    history = store.history('2')
+    assert history['Operacion'].tolist() == ['alta', 'baja']
+    assert history['ValidoHasta'].iloc[0] == pd.Timestamp('2026-02-01')
+
+    changes = store.changes('2026-01-01', '2026-02-01').set_index('EstablecimientoCodigo')
+    assert changes['Cambio'].to_dict() == {'1': 'modificacion', '2': 'baja', '3': 'alta'}
+    assert changes.loc['1', 'ColumnasModificadas'] == 'EstadoFuncionamiento'
+
+
+def test_unchanged_snapshot_is_counted_with_zeros(store):
+    summary = store.append(SECOND, '2026-03-01')
+    assert (summary['Altas'], summary['Modificaciones'], summary['Bajas'], summary['SinCambios']) == (0, 0, 0, 2)
+
+    counts = store.event_counts('EstadoFuncionamiento')
+    assert counts.index.tolist() == pd.to_datetime(['2026-01-01', '2026-02-01', '2026-03-01']).tolist()
+    assert counts.loc['2026-03-01'].tolist() == [0, 0, 0, 0]
+    assert counts.loc['2026-02-01', 'Cambios EstadoFuncionamiento'] == 1
+
+
+def test_append_rejects_older_snapshot(store):
+    with pytest.raises(ValueError):
+        store.append(FIRST, '2026-01-15')
+
+
+def test_cli_date_falls_back_to_clean_file_name(tmp_path):
+    clean_file = tmp_path / 'establecimientos_20260310_cleaned.csv'
+    FIRST.to_csv(clean_file, sep=';', index=False)
+    # The source name has 8 digits that are not a date (NaT), so the clean file name is used
+    main(['--store', str(tmp_path / 'historico'), 'add', str(clean_file), '--source', 'export_99999999.csv'])
+    assert SnapshotStore(str(tmp_path / 'historico')).snapshots()['Snapshot'].tolist() == [pd.Timestamp('2026-03-10')]
+
+
+def test_default_store_follows_data_dir(tmp_path):
+    # Same directory the app reads from when ESTABLECIMIENTOS_DATA_DIR is set (read at import time)
+    env = {**os.environ, 'ESTABLECIMIENTOS_DATA_DIR': str(tmp_path)}
+    code = 'import snapshot_store; print(snapshot_store.STORE_PATH)'
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.run([sys.executable, '-c', code], env=env, cwd=root, capture_output=True, text=True, check=True)
+    assert output.stdout.strip() == os.path.join(str(tmp_path), 'historico')
@@ -0,0 +1,97 @@
+import argparse
+import importlib
+import importlib.util
+import os
+import sys
+import threading
+import time
+
+from dataset import COL_LAT, COL_LON, COLUMNAR_DATA_PATH, DATA_PATH, shared_dataset
+from map_layers import MAP_ZOOM, base_map, data_layer, shared_spatial_index
+
+APP_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'streamlit_app.py')
+# Modules streamlit_app.py only imports when a section needs them
+DEFERRED_IMPORTS = ['folium', 'folium.plugins', 'streamlit_folium', 'scipy.spatial', 'pyarrow.parquet']
+
+
+def module_available(module):
+    return importlib.util.find_spec(module.split('.')[0]) is not None
+
+
+def warm_up(path=DATA_PATH, columnar_path=COLUMNAR_DATA_PATH, verbose=True):
+    """
+    Deja el proceso listo antes de la primera sesión:
+    1. importa los módulos diferidos (folium, streamlit_folium, scipy, pyarrow);
+    2. carga el dataset compartido y construye sus índices (filtros, cubos,
+       series, KD-tree, búsqueda por nombre, cobertura);
+    3. precalcula los agregados sin filtros (KPIs, urgencias, series, cobertura);
+    4. construye el índice espacial compartido, con los clusters sin filtrar
+       de cada zoom que usa visualizar_mapa;
+    5. genera y descarta una vez el mapa nacional por defecto. No queda
+       guardado (st_folium modifica la capa que recibe, así que cada sesión
+       arma la suya); solo calienta folium y sus plantillas.
+    Las sesiones que lleguen mientras tanto esperan el mismo dataset en vez
+    de cargarlo de nuevo.
+
+    Returns:
+        dict paso -> segundos.
+    """
+    timings = {}
+
+    def step(name, func):
+        start = time.perf_counter()
+        result = func()
+        timings[name] = time.perf_counter() - start
+        if verbose:
+            print(f"Calentamiento: {name} en {timings[name]:.2f} s")
+        return result
+
+    step('imports', lambda: [importlib.import_module(module) for module in DEFERRED_IMPORTS if module_available(module)])
+    dataset = step('dataset', lambda: shared_dataset(path, columnar_path, warm=True))
+    step('agregados', lambda: (dataset.kpis(), dataset.urgency_kpis(), dataset.series(), dataset.coverage()))
+    spatial_index = step('indice espacial', lambda: shared_spatial_index(dataset))
+
+    def render_default_map():
+        # Output thrown away: only the first-render cost of folium and its templates is paid here
+        valid = dataset.df.dropna(subset=[COL_LAT, COL_LON])
+        m = base_map()
+        data_layer(dataset.df, valid, spatial_index, MAP_ZOOM).add_to(m)
+        return m.get_root().render()
+
+    step('plantillas del mapa', render_default_map)
+    return timings
+
+
+def start_warm_up(path=DATA_PATH, columnar_path=COLUMNAR_DATA_PATH, verbose=True):
+    """
+    warm_up() en un hilo de fondo; el servidor puede aceptar conexiones mientras tanto.
+    """
+    thread = threading.Thread(
+        target=warm_up, args=(path, columnar_path, verbose), name='warm-up', daemon=True
+    )
+    thread.start()
+    return thread
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Inicia streamlit_app.py con el dataset ya cargado e indexado en el proceso del servidor. "
+                    "Los argumentos no reconocidos se pasan a 'streamlit run'."
+    )
+    parser.add_argument('--wait', action='store_true',
+                        help="Termina el calentamiento antes de abrir el puerto (útil con readiness probes)")
+    args, streamlit_args = parser.parse_known_args(argv)
+
+    if args.wait:
+        warm_up()
+    else:
+        start_warm_up()
+
+    # Same process as the warm-up, so the app finds the dataset and modules already loaded
+    from streamlit.web import cli
+    sys.argv = ['streamlit', 'run', APP_SCRIPT, *streamlit_args]
+    sys.exit(cli.main())
+
+
+if __name__ == "__main__":
+    main()